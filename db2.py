@@ -7,23 +7,64 @@
 #
 
 from __future__ import print_function
-from IPython.display import HTML as pHTML, Image as pImage, display as pdisplay, Javascript as Javascript
 from IPython.core.magic import (Magics, magics_class, line_magic,
                                 cell_magic, line_cell_magic, needs_local_scope)
-import ibm_db
-import pandas
-import ibm_db_dbi
+import io
+import csv
+import datetime
+import decimal
+import gzip
 import json
+import math
 import getpass
+import hashlib
 import os
 import pickle
+import queue
 import time
 import sys
 import re
+import threading
 import warnings
 
 warnings.filterwarnings("ignore")
 
+# Modules that are slow to import (pandas, ibm_db) are only imported the first time they are used. 
+# The placeholder replaces itself with the real module on first use.
+
+class LazyModule(object):
+    
+    def __init__(self, name):
+        self.__dict__["_name"] = name
+        
+    def __getattr__(self, attr):
+        module = sys.modules.get(self._name)
+        if (module == None): module = __import__(self._name)
+        globals()[self._name] = module
+        return getattr(module, attr)
+
+ibm_db = LazyModule("ibm_db")
+ibm_db_dbi = LazyModule("ibm_db_dbi")
+pandas = LazyModule("pandas")
+numpy = LazyModule("numpy")
+qgrid = None
+
+def pdisplay(*args, **kwargs):
+    from IPython.display import display
+    return display(*args, **kwargs)
+
+def pHTML(*args, **kwargs):
+    from IPython.display import HTML
+    return HTML(*args, **kwargs)
+
+def pImage(*args, **kwargs):
+    from IPython.display import Image
+    return Image(*args, **kwargs)
+
+def Javascript(*args, **kwargs):
+    from IPython.display import Javascript as pJavascript
+    return pJavascript(*args, **kwargs)
+
 # Python Hack for Input between 2 and 3
 
 try: 
@@ -42,12 +83,27 @@ _settings = {
      "protocol" : "TCPIP",    
      "uid"      : "DB2INST1",
      "pwd"      : "password",
-     "ssl"      : ""
+     "ssl"      : "",
+     "macropath": None,
+     "listlimit": 1000,
+     "listmode" : "AUTO",
+     "warmup"   : False,
+     "fetchsize": 0,
+     "prefetch" : False,
+     "pagesize" : 100,
+     "compact"  : False,
+     "decimal"  : "FLOAT",
+     "temporal" : "STRING",
+     "cache"    : False,
+     "cachedir" : "db2cache",
+     "cachesize": 1024,
+     "cachettl" : 3600
 }
 
 _environment = {
      "jupyter"  : True,
-     "qgrid"    : True
+     "qgrid"    : None,                     # None until a GRID display checks for it
+     "widgets"  : None                      # ipywidgets for the windowed grid, checked the same way
 }
 
 _display = {
@@ -77,10 +133,16 @@ _hdbi = None
 _stmt = []
 _stmtID = []
 _stmtSQL = []
+_connectLock = threading.RLock()          # Held while the handles above or the prepared statements change
+_profiles = {}                            # Named connection profiles (CONNECT AS name)
+_session = {"autocommit" : True, "registers" : {}, "reconnects" : 0, "lastUsed" : 0}
+_warmups = []                             # Background connects started at load time (OPTION WARMUP)
 _vars = {}
 _macros = {}
-_flags = []
+_library = {"path" : None, "mtime" : None, "index" : {}, "files" : {}, "cache" : None}
 _debug = False
+_recording = {"file" : None, "name" : "", "start" : 0, "count" : 0}
+_recordLock = threading.Lock()          # Held while an event is written to the recording
 
 # Db2 Error Messages and Codes
 sqlcode = 0
@@ -88,30 +150,308 @@ sqlstate = "0"
 sqlerror = ""
 sqlelapsed = 0
 
-# Check to see if QGrid is installed
+# Execution context
+#
+# Every %sql call gets its own ExecContext that holds the flags that were supplied, the connection,
+# the options and the namespace to use, and the SQLCODE/SQLSTATE of the statements it runs. It is
+# passed down to the routines that run statements, and the context of the current call is also kept
+# per thread (currentContext) for helpers like flag() and db2_error(). Only when the call finishes 
+# are the status values copied to the sqlcode/sqlstate/sqlerror/sqlelapsed variables above.
+
+class ExecContext(object):
+    
+    def __init__(self, local_ns=None):
+        self.flags = set()
+        self.local_ns = local_ns
+        self.settings = _settings
+        self.hdbc = _hdbc
+        self.hdbi = _hdbi
+        self.sqlcode = 0
+        self.sqlstate = "0"
+        self.sqlerror = ""
+        self.sqlelapsed = 0
+        self.flagValues = {}              # Values of flags like -conn name
+        self.profile = None               # Connection profile used by this call (-conn name)
+        self.stmt = _stmt                 # Prepared statements of the connection
+        self.stmtID = _stmtID
+        self.stmtSQL = _stmtSQL
+        self.lists = {}                   # Temporary tables holding large lists (:var -> table)
+        self.listTables = []              # Lists the last statement rendered uses a temporary table for
+        self.listFailed = False           # A temporary table could not be created for a list
+        self.listWarned = set()           # Lists we already warned about being placed in the SQL
+        self.chunk = None                 # Large list the statement is run in chunks for
+        self.chunkPart = None             # Values of the chunk being run
+        self.recorded = None              # Statement of this context being timed for RECORD
+        self.retry = False                # The statement failed with a lost connection and can be run again
+        
+    def flag(self, inflag):
+        if isinstance(inflag,list):
+            for x in inflag:
+                if (x in self.flags):
+                    return True
+            return False
+        else:
+            return (inflag in self.flags)
+        
+    def useProfile(self, name):
+        
+        # Run the statements of this call with the connection, options and prepared statements of a profile
+        
+        profile = _profiles.get(name.upper())
+        if (profile == None): return False
+        self.profile = profile
+        self.settings = profile["settings"]
+        self.hdbc = profile["hdbc"]
+        self.hdbi = profile["hdbi"]
+        self.stmt = profile["stmt"]
+        self.stmtID = profile["stmtID"]
+        self.stmtSQL = profile["stmtSQL"]
+        return True
+        
+    def connected(self):
+        
+        if (self.profile != None): return self.profile["connected"]
+        return _connected
+    
+    def session(self):
+        
+        # Autocommit, special registers and reconnect count of the connection
+        
+        if (self.profile != None): return self.profile["session"]
+        return _session
+        
+    def connect(self):
+        
+        # Make sure there is a connection and use it for the statements in this context
+        
+        if (len(_warmups) > 0): waitWarmup()
+        
+        if (self.profile != None):
+            if (self.profile["connected"] == False):
+                if (profileConnect(self.profile) == False):
+                    return False
+            self.hdbc = self.profile["hdbc"]
+            self.hdbi = self.profile["hdbi"]
+        else:
+            if (_connected == False):
+                if (db2_doConnect() == False):
+                    return False
+            self.hdbc = _hdbc
+            self.hdbi = _hdbi
+            
+        session = self.session()
+        now = time.time()
+        if (now - session["lastUsed"] > _validateIdle):       # Idle connections may have been dropped
+            try:
+                active = ibm_db.active(self.hdbc)
+            except:
+                active = False
+            if (active == False and db2_reconnect(self) == False):
+                return False
+        session["lastUsed"] = now
+        
+        return True
+        
+    def resetStatus(self):
+        self.sqlcode = 0
+        self.sqlstate = "0"
+        self.sqlerror = ""
+        
+    # The prepared statements belong to the connection and are shared by every context that uses it,
+    # so they are only changed or looked up while holding _connectLock
+        
+    def addStatement(self, stmtID, stmt, sql):
+        with _connectLock:
+            if (stmtID in self.stmtID) == False:
+                self.stmt.append(stmt)
+                self.stmtID.append(stmtID)
+                self.stmtSQL.append(sql)          # Kept so the statement can be prepared again after a reconnect
+            else:
+                stmtIX = self.stmtID.index(stmtID)
+                self.stmt[stmtIX] = stmt
+                self.stmtSQL[stmtIX] = sql
+                
+    def findStatement(self, stmtID):
+        with _connectLock:
+            if (stmtID in self.stmtID) == False: return None
+            return self.stmt[self.stmtID.index(stmtID)]
+        
+    def clearStatements(self):
+        with _connectLock:
+            del self.stmt[:]
+            del self.stmtID[:]
+            del self.stmtSQL[:]
+
+_context = threading.local()
+
+def currentContext():
+    
+    ctx = getattr(_context,"ctx",None)
+    if (ctx == None):
+        ctx = ExecContext()
+        _context.ctx = ctx
+    return ctx
+
+def setContext(ctx):
+    
+    # Make ctx the context for this thread and return the one it replaces
+    
+    previous = getattr(_context,"ctx",None)
+    _context.ctx = ctx
+    return previous
+
+def publishStatus(ctx):
+    
+    global sqlcode, sqlstate, sqlerror, sqlelapsed
+    
+    sqlcode = ctx.sqlcode
+    sqlstate = ctx.sqlstate
+    sqlerror = ctx.sqlerror
+    sqlelapsed = ctx.sqlelapsed
+
+# Scanners used by the argument parsers to jump to the next interesting character
+
+_argsScan = re.compile("'[^']*'?|\"[^\"]*\"?| ")
+_splitScan = re.compile("'[^']*'?|\"[^\"]*\"?|,")
+_sqlScan = re.compile("['\":]|--|/\\*")
+_varScan = re.compile("[@_A-Za-z0-9]*(?:\\[(?:'[^']*'|\"[^\"]*\"|[^\\]'\"])*\\]|\\.[_A-Za-z][_A-Za-z0-9]*)*")
+_blankLines = {ord("\n") : " ", ord("\r") : " "}
+_stmtScan = {}
+_valueFlags = ["-conn","-fanout","-decimal","-temporal","-partitions","-by","-bounds",
+               "-materialize","-watermark","-lookback","-refresh"]
+_setRegister = re.compile("\\s*SET\\s+(?:CURRENT\\s+)?(SCHEMA|SQLID|PATH|FUNCTION\\s+PATH|ISOLATION|DEGREE|QUERY\\s+OPTIMIZATION|LOCK\\s+TIMEOUT)\\b",re.IGNORECASE)
+
+# Connections that are lost are opened again with an exponential backoff. A connection that has not 
+# been used for _validateIdle seconds is checked before it is used.
+
+_connectionStates = ("08001","08003","08004","08007","08S01","40003")
+_connectionCodes = (-30081,-30108,-1224,-30080,-1229,-900)
+_reconnectAttempts = 5
+_reconnectDelay = 0.5
+_validateIdle = 30
+_firstCommand = re.compile("(?:^\\s*)([a-zA-Z]+)(?:\\s+.*|$)")
+
+# Macro compiler limits
+
+_macroOps = ["=","==","<=","=<",">=","=>","<>","!=","<",">"]
+_macroNesting = 16
+
+# Compiled macro substitution templates keyed by their text
+
+_templateScan = re.compile("\\{([^{}]*)\\}")
+_templates = {}
+_templatesSize = 1000
+
+# Parsed SQL templates keyed by the text of the statement
+
+_parseCache = {}
+_parseCacheSize = 500
+
+# Fetch size tuning (OPTION FETCHSIZE AUTO and -autotune). The best fetch size for every statement
+# fingerprint is kept in db2fetch.pickle.
+
+_fetchSizes = [64, 256, 1024, 4096, 16384]
+_fetchTuneRows = 20000
+_fetchTuning = None
+_tuneSelect = re.compile("^\\s*(SELECT|WITH|VALUES)\\b", re.IGNORECASE)
+_tuneUnsafe = re.compile("\\b((FINAL|NEW|OLD)\\s+TABLE|NEXT\\s+VALUE\\s+FOR|NEXTVAL|INSERT|UPDATE|DELETE|MERGE)\\b", re.IGNORECASE)
+_pageCacheSize = 8                                    # Pages of a -page result kept in memory
+_gridPrefetch = 4                                     # Grid windows read from the server at a time
+_gridLiteral = re.compile("'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"")  # Strings and quoted names in a grid filter
+_gridKeyword = re.compile("\\b(SELECT|VALUES|UNION|INTERSECT|EXCEPT|WITH|ORDER|GROUP|HAVING|FETCH|LIMIT|OFFSET)\\b", re.IGNORECASE)
+_compactRatio = 0.5                                   # Most distinct values per row for a categorical
+_exportBatch = 10000                                  # Rows written at a time by EXPORT
+_exportSyntax = re.compile("^\\s*EXPORT\\s+TO\\s+('[^']*'|\"[^\"]*\"|\\S+)\\s*(.*)$", re.IGNORECASE | re.DOTALL)
+_exportOption = re.compile("^\\s*([A-Za-z]+)\\s*=\\s*('[^']*'|\\S+)", re.DOTALL)
+_partitionMax = 32                                    # Most partitions (and connections) for -partitions
+_partitionColumn = re.compile('^([A-Za-z_#@$][A-Za-z0-9_#@$]*|"[^"]+")$')  # -by column (name or "quoted name")
+_poolSize = 8                                         # Idle connections kept for each database
+_pool = {}                                            # Idle connections keyed by the connection string
+_poolLock = threading.Lock()
+_cacheIndex = None                                    # Index of the result cache, read the first time it is used
+_cacheIndexDir = None
+_cacheLock = threading.Lock()
+_materialized = {}                                    # Results kept with -materialize, by name
+_materializePath = "db2materialize"                   # Directory the materialized results are saved in
+_decimalModes = ["FLOAT","EXACT","SCALED"]            # OPTION DECIMAL and -decimal
+_temporalModes = ["STRING","NATIVE"]                  # OPTION TEMPORAL and -temporal
+
+_fingerprintScan = re.compile("'[^']*'|\\b[0-9]+(?:\\.[0-9]+)?\\b|\\s+")
+
+# A large list can only be run in chunks as the values of IN ( ) in a SELECT without any of _chunkUnsafe.
+# A NOT in front of the column (NOT ID IN) and an OR anywhere in the statement would repeat rows.
+
+_chunkIn = re.compile("(?:^|[^A-Za-z0-9_#@$])(NOT\\s+)?IN\\s*\\(\\s*$", re.IGNORECASE)
+_chunkNot = re.compile("(?:^|[^A-Za-z0-9_#@$])NOT\\s+[(\\s]*[A-Za-z0-9_#@$.\"]+\\s+IN\\s*\\(\\s*$", re.IGNORECASE)
+_chunkOr = re.compile("\\bOR\\b", re.IGNORECASE)
+_chunkQuotes = re.compile("'[^']*'|\"[^\"]*\"")
+_chunkSelect = re.compile("^\\s*(SELECT|WITH)\\b", re.IGNORECASE)
+_chunkUnsafe = re.compile("\\b(GROUP\\s+BY|HAVING|ORDER\\s+BY|DISTINCT|FETCH\\s+FIRST|LIMIT|OFFSET|UNION|EXCEPT|INTERSECT|OVER|" +
+                          "COUNT|COUNT_BIG|SUM|AVG|MIN|MAX|STDDEV|VARIANCE|LISTAGG|ARRAY_AGG)\\b", re.IGNORECASE)
 
-try:
-    import qgrid
-    qgrid.set_defaults(grid_options=_display)
-except:
-    _environment['qgrid'] = False
+# Compiled host variable access paths (name, name.attr, name[0], name['key']) keyed by their text
+
+_pathName = re.compile("[_A-Za-z][_A-Za-z0-9]*")
+_pathScan = re.compile("\\.([_A-Za-z][_A-Za-z0-9]*)|\\[\\s*(-?[0-9]+|'[^']*'|\"[^\"]*\")\\s*\\]")
+_paths = {}
+_pathsSize = 1000
+
+# Check to see if QGrid is installed. This is only done the first time a grid is displayed.
+
+def gridAvailable():
+    
+    global qgrid
+    
+    if (_environment['qgrid'] == None):
+        if (_environment['jupyter'] == False):
+            _environment['qgrid'] = False
+        else:
+            try:
+                import qgrid
+                qgrid.set_defaults(grid_options=_display)
+                _environment['qgrid'] = True
+            except:
+                _environment['qgrid'] = False
+            
+    return _environment['qgrid']
+
+# Check to see if ipywidgets is installed for the windowed grid
+
+def widgetsAvailable():
+    
+    if (_environment['widgets'] == None):
+        if (_environment['jupyter'] == False):
+            _environment['widgets'] = False
+        else:
+            try:
+                import ipywidgets
+                _environment['widgets'] = True
+            except:
+                _environment['widgets'] = False
+                
+    return _environment['widgets']
     
 # Check if we are running in iPython or Jupyter
 
-try:
-    if (get_ipython().config == {}): 
+def checkEnvironment(ip):
+    
+    try:
+        if (ip.config == {}): 
+            _environment['jupyter'] = False
+            _environment['qgrid'] = False
+            _environment['widgets'] = False
+        else:
+            _environment['jupyter'] = True
+    except:
         _environment['jupyter'] = False
         _environment['qgrid'] = False
-    else:
-        _environment['jupyter'] = True
-except:
-    _environment['jupyter'] = False
-    _environment['qgrid'] = False
 
 
-def setOptions(inSQL):
+def setOptions(inSQL,ctx):
 
-    global _settings, _display
+    global _display
+    
+    settings = ctx.settings
 
     cParms = inSQL.split()
     cnt = 0
@@ -121,7 +461,7 @@ def setOptions(inSQL):
             
             if cnt+1 < len(cParms):
                 try:
-                    _settings["maxrows"] = int(cParms[cnt+1])
+                    settings["maxrows"] = int(cParms[cnt+1])
                 except Exception as err:
                     errormsg("Invalid MAXROWS value provided.")
                     pass
@@ -138,11 +478,8 @@ def setOptions(inSQL):
                     if (maxgrid <= 5):                      # Minimum window size is 5
                         maxgrid = 5
                     _display["maxVisibleRows"] =  int(cParms[cnt+1])
-                    try:
-                        import qgrid
+                    if (_environment['qgrid'] == True):
                         qgrid.set_defaults(grid_options=_display)
-                    except:
-                        _environment['qgrid'] = False
                         
                 except Exception as err:
                     errormsg("Invalid MAXGRID value provided.")
@@ -155,7 +492,7 @@ def setOptions(inSQL):
         elif cParms[cnt].upper() == 'RUNTIME':
             if cnt+1 < len(cParms):
                 try:
-                    _settings["runtime"] = int(cParms[cnt+1])
+                    settings["runtime"] = int(cParms[cnt+1])
                 except Exception as err:
                     errormsg("Invalid RUNTIME value provided.")
                     pass
@@ -167,24 +504,192 @@ def setOptions(inSQL):
         elif cParms[cnt].upper() == 'DISPLAY':
             if cnt+1 < len(cParms):
                 if (cParms[cnt+1].upper() == 'GRID'):
-                    _settings["display"] = 'GRID'
+                    settings["display"] = 'GRID'
                 elif (cParms[cnt+1].upper()  == 'PANDAS'):
-                    _settings["display"] = 'PANDAS'
+                    settings["display"] = 'PANDAS'
                 else:
                     errormsg("Invalid DISPLAY value provided.")
                 cnt = cnt + 1
             else:
                 errormsg("No value provided for the DISPLAY option.")
                 return  
+        elif cParms[cnt].upper() == 'MACROPATH':
+            if cnt+1 < len(cParms):
+                path = cParms[cnt+1]
+                if (path.upper() in ("OFF","NONE")):
+                    _settings["macropath"] = None
+                else:
+                    path = os.path.abspath(os.path.expanduser(path))
+                    if (os.path.isdir(path) == False):
+                        errormsg("The MACROPATH directory " + path + " does not exist.")
+                        return
+                    _settings["macropath"] = path
+                cnt = cnt + 1
+            else:
+                errormsg("No directory provided for the MACROPATH option.")
+                return
+        elif cParms[cnt].upper() == 'CACHE':
+            if cnt+1 < len(cParms):
+                if (cParms[cnt+1].upper() == 'ON'):
+                    _settings["cache"] = True
+                elif (cParms[cnt+1].upper() == 'OFF'):
+                    _settings["cache"] = False
+                else:
+                    errormsg("Invalid CACHE value provided.")
+                cnt = cnt + 1
+            else:
+                errormsg("No value provided for the CACHE option.")
+                return
+        elif cParms[cnt].upper() == 'CACHEDIR':
+            if cnt+1 < len(cParms):
+                _settings["cachedir"] = os.path.abspath(os.path.expanduser(cParms[cnt+1]))
+                cnt = cnt + 1
+            else:
+                errormsg("No directory provided for the CACHEDIR option.")
+                return
+        elif cParms[cnt].upper() in ('CACHESIZE','CACHETTL'):
+            option = cParms[cnt].upper()
+            if cnt+1 < len(cParms):
+                try:
+                    value = int(cParms[cnt+1])
+                    if (value < 0): value = 0
+                    _settings[option.lower()] = value
+                except Exception as err:
+                    errormsg("Invalid " + option + " value provided.")
+                    pass
+                cnt = cnt + 1
+            else:
+                errormsg("No value provided for the " + option + " option.")
+                return
+        elif cParms[cnt].upper() == 'LISTLIMIT':
+            if cnt+1 < len(cParms):
+                try:
+                    listlimit = int(cParms[cnt+1])
+                    if (listlimit < 1): listlimit = 1
+                    settings["listlimit"] = listlimit
+                except Exception as err:
+                    errormsg("Invalid LISTLIMIT value provided.")
+                    pass
+                cnt = cnt + 1
+            else:
+                errormsg("No value provided for the LISTLIMIT option.")
+                return
+        elif cParms[cnt].upper() == 'LISTMODE':
+            if cnt+1 < len(cParms):
+                listmode = cParms[cnt+1].upper()
+                if (listmode in ("AUTO","INLINE","TEMP","CHUNK")):
+                    settings["listmode"] = listmode
+                else:
+                    errormsg("Invalid LISTMODE value provided.")
+                cnt = cnt + 1
+            else:
+                errormsg("No value provided for the LISTMODE option.")
+                return
+        elif cParms[cnt].upper() == 'WARMUP':
+            if cnt+1 < len(cParms):
+                if (cParms[cnt+1].upper() == 'ON'):
+                    _settings["warmup"] = True
+                elif (cParms[cnt+1].upper() == 'OFF'):
+                    _settings["warmup"] = False
+                else:
+                    errormsg("Invalid WARMUP value provided.")
+                cnt = cnt + 1
+            else:
+                errormsg("No value provided for the WARMUP option.")
+                return
+        elif cParms[cnt].upper() == 'FETCHSIZE':
+            if cnt+1 < len(cParms):
+                fetchsize = None
+                if (cParms[cnt+1].upper() == 'AUTO'):
+                    fetchsize = "AUTO"
+                else:
+                    try:
+                        fetchsize = max(int(cParms[cnt+1]),0)
+                    except Exception as err:
+                        errormsg("Invalid FETCHSIZE value provided.")
+                        pass
+                if (fetchsize != None and fetchsize != 0 and blockFetch() == False):
+                    errormsg("This version of ibm_db does not have SQL_ATTR_BLOCK_FOR_NROWS, so the fetch size cannot be set.")
+                elif (fetchsize != None):
+                    settings["fetchsize"] = fetchsize
+                cnt = cnt + 1
+            else:
+                errormsg("No value provided for the FETCHSIZE option.")
+                return
+        elif cParms[cnt].upper() == 'PREFETCH':
+            if cnt+1 < len(cParms):
+                if (cParms[cnt+1].upper() == 'ON'):
+                    settings["prefetch"] = True
+                elif (cParms[cnt+1].upper() == 'OFF'):
+                    settings["prefetch"] = False
+                else:
+                    errormsg("Invalid PREFETCH value provided.")
+                cnt = cnt + 1
+            else:
+                errormsg("No value provided for the PREFETCH option.")
+                return
+        elif cParms[cnt].upper() == 'COMPACT':
+            if cnt+1 < len(cParms):
+                if (cParms[cnt+1].upper() == 'ON'):
+                    settings["compact"] = True
+                elif (cParms[cnt+1].upper() == 'OFF'):
+                    settings["compact"] = False
+                else:
+                    errormsg("Invalid COMPACT value provided.")
+                cnt = cnt + 1
+            else:
+                errormsg("No value provided for the COMPACT option.")
+                return
+        elif cParms[cnt].upper() in ('DECIMAL','TEMPORAL'):
+            option = cParms[cnt].upper()
+            modes = _decimalModes if option == 'DECIMAL' else _temporalModes
+            if cnt+1 < len(cParms):
+                if (cParms[cnt+1].upper() in modes):
+                    settings[option.lower()] = cParms[cnt+1].upper()
+                else:
+                    errormsg("Invalid " + option + " value provided. Use one of " + ", ".join(modes) + ".")
+                cnt = cnt + 1
+            else:
+                errormsg("No value provided for the " + option + " option.")
+                return
+        elif cParms[cnt].upper() == 'PAGESIZE':
+            if cnt+1 < len(cParms):
+                try:
+                    pagesize = int(cParms[cnt+1])
+                    if (pagesize < 1): pagesize = 1
+                    settings["pagesize"] = pagesize
+                except Exception as err:
+                    errormsg("Invalid PAGESIZE value provided.")
+                    pass
+                cnt = cnt + 1
+            else:
+                errormsg("No value provided for the PAGESIZE option.")
+                return
         elif (cParms[cnt].upper() == 'LIST'):
-            print("(MAXROWS) Maximum number of rows displayed: " + str(_settings["maxrows"]))
-            print("(MAXGRID) Maximum grid display size: " + str(_settings["maxgrid"]))
-            print("(RUNTIME) How many seconds to a run a statement for performance testing: " + str(_settings["runtime"]))
-            print("(DISPLAY) Use PANDAS or GRID display format for output: " + _settings["display"]) 
+            print("(MAXROWS) Maximum number of rows displayed: " + str(settings["maxrows"]))
+            print("(MAXGRID) Maximum grid display size: " + str(settings["maxgrid"]))
+            print("(RUNTIME) How many seconds to a run a statement for performance testing: " + str(settings["runtime"]))
+            print("(DISPLAY) Use PANDAS or GRID display format for output: " + settings["display"]) 
+            print("(MACROPATH) Directory of macro files: " + str(_settings.get("macropath")))
+            print("(LISTLIMIT) Largest list of values placed in the SQL: " + str(settings.get("listlimit",1000)))
+            print("(LISTMODE) Use AUTO, INLINE, TEMP or CHUNK for larger lists: " + settings.get("listmode","AUTO"))
+            print("(WARMUP) Connect in the background when the extension is loaded: " + ("ON" if _settings.get("warmup",False) else "OFF"))
+            print("(FETCHSIZE) Rows fetched per network request (0 for the driver default or AUTO): " + str(settings.get("fetchsize",0)))
+            print("(PREFETCH) Prefetch the row count of result sets: " + ("ON" if settings.get("prefetch",False) else "OFF"))
+            print("(PAGESIZE) Rows in each page of a -page result: " + str(settings.get("pagesize",100)))
+            print("(COMPACT) Reduce the memory used by DataFrame results: " + ("ON" if settings.get("compact",False) else "OFF"))
+            print("(DECIMAL) Return DECIMAL values as FLOAT, EXACT (Decimal) or SCALED (integer): " + settings.get("decimal","FLOAT"))
+            print("(TEMPORAL) Return dates and times as STRING or NATIVE (datetime) values: " + settings.get("temporal","STRING"))
+            print("(CACHE) Keep DataFrame results in the on-disk result cache: " + ("ON" if _settings.get("cache",False) else "OFF"))
+            print("(CACHEDIR) Directory of the result cache: " + str(_settings.get("cachedir","db2cache")))
+            print("(CACHESIZE) Largest size of the result cache in MB (0 for no limit): " + str(_settings.get("cachesize",1024)))
+            print("(CACHETTL) Seconds a cached result can be used for (0 for no limit): " + str(_settings.get("cachettl",3600)))
+            print("Times the connection was lost and re-established: " + str(ctx.session()["reconnects"]))
             return
         else:
             cnt = cnt + 1
             
+    if (ctx.profile != None): save_profiles()
     save_settings()
 
 def sqlhelp():
@@ -214,9 +719,48 @@ def sqlhelp():
          {sr}
            {sd}d{ed1}{sd}Change SQL delimiter to "@" from ";"{ed2}
          {er}
+         {sr}
+           {sd}conn name{ed1}{sd}Run the statement using the connection profile name (CONNECT AS name){ed2}
+         {er}
+         {sr}
+           {sd}fanout p1,p2{ed1}{sd}Run the statement on several connection profiles at once and combine the results{ed2}
+         {er}
+         {sr}
+           {sd}autotune{ed1}{sd}Find the fastest fetch size for the query and remember it (see OPTION FETCHSIZE){ed2}
+         {er}
+         {sr}
+           {sd}page{ed1}{sd}Return a paged result that only fetches the rows that are looked at, i.e. result[1000:1100] or result.page(10){ed2}
+         {er}
+         {sr}
+           {sd}compact{ed1}{sd}Reduce the memory used by the DataFrame (strip CHAR padding, categoricals, smaller integers){ed2}
+         {er}
+         {sr}
+           {sd}decimal mode{ed1}{sd}Return DECIMAL values as FLOAT, EXACT (Decimal) or SCALED (integer) values (see OPTION DECIMAL){ed2}
+         {er}
+         {sr}
+           {sd}temporal mode{ed1}{sd}Return dates and times as STRING or NATIVE (datetime) values (see OPTION TEMPORAL){ed2}
+         {er}
+         {sr}
+           {sd}partitions n -by col{ed1}{sd}Split the query into n ranges of the column and fetch them in parallel (-bounds v1,v2 for the split points, -quantiles for NTILE bounds){ed2}
+         {er}
+         {sr}
+           {sd}materialize name -watermark col{ed1}{sd}Keep the result of the query under the name along with the highest value of the column{ed2}
+         {er}
+         {sr}
+           {sd}refresh name{ed1}{sd}Add the rows above the watermark of a materialized result (-lookback n to fetch the last n days again){ed2}
+         {er}
+         {sr}
+           {sd}cache, nocache{ed1}{sd}Use the on-disk result cache for the query, or fetch it again and replace the cached result (see OPTION CACHE, CACHE LIST and CACHE CLEAR){ed2}
+         {er}
+         {sr}
+           {sd}continue{ed1}{sd}Keep running a script (-f) after a statement fails{ed2}
+         {er}
          {sr}
            {sd}e, echo{ed1}{sd}Echo the SQL command that was generated after macro and variable substituion.{ed2}
          {er}
+         {sr}
+           {sd}f{ed1}{sd}Run the SQL statements in a file. Wildcards can be used to run several files.{ed2}
+         {er}
          {sr}
            {sd}h, help{ed1}{sd}Display %sql help information.{ed2}
          {er}        
@@ -239,7 +783,7 @@ def sqlhelp():
            {sd}t,time{ed1}{sd}Time the following SQL statement and return the number of times it executes in 1 second{ed2}
          {er}
          {sr}
-           {sd}grid{ed1}{sd}Display the results in a scrollable grid{ed2}
+           {sd}grid{ed1}{sd}Display the results in a scrollable grid. Rows are fetched as they are scrolled to and sorting and filtering are done by Db2{ed2}
          {er}       
         
         </table>
@@ -254,14 +798,27 @@ preceded with a minus sign (i.e. -q).
 Option     Description
 a, all     Return all rows in answer set and do not limit display 
 d          Change SQL delimiter to "@" from ";" 
+conn name  Run the statement using the connection profile name (CONNECT AS name)
+fanout p,q Run the statement on several connection profiles at once and combine the results
+autotune   Find the fastest fetch size for the query and remember it
+page       Return a paged result that only fetches the rows that are looked at
+compact    Reduce the memory used by the DataFrame that is returned
+decimal m  Return DECIMAL values as FLOAT, EXACT or SCALED values
+temporal m Return dates and times as STRING or NATIVE values
+partitions Split the query into ranges (-partitions n -by col) and fetch them in parallel
+materialize Keep the result for -refresh (-materialize name -watermark col)
+refresh n  Fetch only the new rows of a materialized result (-lookback n for the last n days)
+cache      Use the on-disk result cache for the query (-nocache to fetch it again)
+continue   Keep running a script (-f) after a statement fails
 e, echo    Echo the SQL command that was generated after substitution 
+f          Run the SQL statements in a file (wildcards can be used)
 h, help    Display %sql help information
 j          Create a pretty JSON representation. Only the first column is formatted 
 json       Retrieve the result set as a JSON record 
 q, quiet   Quiet results - no answer set or messages returned from the function 
 r, array   Return the result set as an array of values 
 t,time     Time the SQL statement and return the execution count per second
-grid       Display the results in a scrollable grid 
+grid       Display the first rows of the results (a scrollable grid in Jupyter)
        """        
     helpSQL = helpSQL.format(**locals())
     
@@ -292,8 +849,14 @@ def connected_help():
        %sql CONNECT CLOSE
        %sql CONNECT RESET
        %sql CONNECT PROMPT - use this to be prompted for values
+       %sql CONNECT AS &lt;name&gt; ... - any of the above for the connection profile name
        </pre>
        <p>
+       <b>CONNECT AS</b> creates a named connection profile that is kept open alongside the default connection.
+       A statement is run against a profile with the -conn option (%sql -conn &lt;name&gt; SELECT ...). Every 
+       profile has its own options (OPTION with -conn) and prepared statements. Profiles are saved and reconnect 
+       automatically the first time they are used in a new notebook.
+       <p>
        If you use a "?" for the password field, the system will prompt you for a password. This avoids typing the 
        password as clear text on the screen. If a connection is not successful, the system will print the error
        message associated with the connect request.
@@ -359,6 +922,13 @@ The CONNECT command has the following format:
 %sql CONNECT CREDENTIALS varname
 %sql CONNECT CLOSE
 %sql CONNECT RESET
+%sql CONNECT AS name ... (any of the above for the connection profile name)
+
+CONNECT AS creates a named connection profile that is kept open alongside the 
+default connection. A statement is run against a profile with the -conn option
+(%sql -conn name SELECT ...). Every profile has its own options (OPTION with -conn)
+and prepared statements. Profiles are saved and reconnect automatically the first
+time they are used in a new notebook.
 
 If you use a "?" for the password field, the system will prompt you for a password.
 This avoids typing the password as clear text on the screen. If a connection is 
@@ -411,9 +981,9 @@ to connect to Db2:
 
 # Prompt for Connection information
 
-def connected_prompt():
+def connected_prompt(settings=None):
     
-    global _settings
+    if (settings == None): settings = _settings
     
     _database = ''
     _hostname = ''
@@ -440,15 +1010,15 @@ def connected_prompt():
     _pwd = getpass.getpass("Password [password]: ");
     if (_pwd.strip() == ""): return False
         
-    _settings["database"] = _database.strip()
-    _settings["hostname"] = _hostname.strip()
-    _settings["port"] = _port.strip()
-    _settings["uid"] = _uid.strip()
-    _settings["pwd"] = _pwd.strip()
-    _settings["ssl"] = _ssl.strip()
-    _settings["maxrows"] = 10
-    _settings["maxgrid"] = 5
-    _settings["runtime"] = 1
+    settings["database"] = _database.strip()
+    settings["hostname"] = _hostname.strip()
+    settings["port"] = _port.strip()
+    settings["uid"] = _uid.strip()
+    settings["pwd"] = _pwd.strip()
+    settings["ssl"] = _ssl.strip()
+    settings["maxrows"] = 10
+    settings["maxgrid"] = 5
+    settings["runtime"] = 1
     
     return True
     
@@ -473,31 +1043,53 @@ def split_string(in_port,splitter=":"):
 
 def parseConnect(inSQL,local_ns):
     
+    # Returns True when the connection (or the profile of CONNECT AS) was made or closed
+    
     global _settings, _connected
-
-    _connected = False
+    
+    waitWarmup()                                   # Do not race a background connect
     
     cParms = inSQL.split()
     cnt = 0
     
-    _settings["ssl"] = ""
+    # CONNECT AS name ... works on the connection profile name instead of the default connection
+    
+    profile = None
+    if (len(cParms) > 1 and cParms[1].upper() == 'AS'):
+        if (len(cParms) < 3):
+            errormsg("No profile name specified in the CONNECT AS statement")
+            return
+        name = cParms[2].upper()
+        profile = _profiles.get(name)
+        if (profile == None):
+            profile = newProfile(name)
+        cParms = cParms[:1] + cParms[3:]
+        settings = profile["settings"]
+    else:
+        _connected = False
+        settings = _settings
+    
+    settings["ssl"] = ""
     
     while cnt < len(cParms):
         if cParms[cnt].upper() == 'TO':
             if cnt+1 < len(cParms):
-                _settings["database"] = cParms[cnt+1].upper()
+                settings["database"] = cParms[cnt+1].upper()
                 cnt = cnt + 1
             else:
                 errormsg("No database specified in the CONNECT statement")
                 return
         elif cParms[cnt].upper() == "SSL":
-            _settings["ssl"] = "Security=SSL;"  
+            settings["ssl"] = "Security=SSL;"  
             cnt = cnt + 1
         elif cParms[cnt].upper() == 'CREDENTIALS':
             if cnt+1 < len(cParms):
                 credentials = cParms[cnt+1]
-                tempid = eval(credentials,local_ns)
-                if (isinstance(tempid,dict) == False): 
+                try:
+                    tempid = resolveVariable(credentials,local_ns)
+                except KeyError:
+                    tempid = None
+                if (tempid != None and isinstance(tempid,dict) == False): 
                     errormsg("The CREDENTIALS variable (" + credentials + ") does not contain a valid Python dictionary (JSON object)")
                     return
                 if (tempid == None):
@@ -512,11 +1104,11 @@ def parseConnect(inSQL,local_ns):
                     _id = tempid
                     
                 try:
-                    _settings["database"] = _id["db"]
-                    _settings["hostname"] = _id["hostname"]
-                    _settings["port"] = _id["port"]
-                    _settings["uid"] = _id["username"]
-                    _settings["pwd"] = _id["password"]
+                    settings["database"] = _id["db"]
+                    settings["hostname"] = _id["hostname"]
+                    settings["port"] = _id["port"]
+                    settings["uid"] = _id["username"]
+                    settings["pwd"] = _id["password"]
                     try:
                         fname = credentials + ".pickle"
                         with open(fname,'wb') as f:
@@ -537,16 +1129,16 @@ def parseConnect(inSQL,local_ns):
               
         elif cParms[cnt].upper() == 'USER':
             if cnt+1 < len(cParms):
-                _settings["uid"] = cParms[cnt+1].upper()
+                settings["uid"] = cParms[cnt+1].upper()
                 cnt = cnt + 1
             else:
                 errormsg("No userid specified in the CONNECT statement")
                 return
         elif cParms[cnt].upper() == 'USING':
             if cnt+1 < len(cParms):
-                _settings["pwd"] = cParms[cnt+1]   
-                if (_settings["pwd"] == '?'):
-                    _settings["pwd"] = getpass.getpass("Password [password]: ") or "password"
+                settings["pwd"] = cParms[cnt+1]   
+                if (settings["pwd"] == '?'):
+                    settings["pwd"] = getpass.getpass("Password [password]: ") or "password"
                 cnt = cnt + 1
             else:
                 errormsg("No password specified in the CONNECT statement")
@@ -555,26 +1147,29 @@ def parseConnect(inSQL,local_ns):
             if cnt+1 < len(cParms):
                 hostport = cParms[cnt+1].upper()
                 ip, port = split_string(hostport)
-                if (port == None): _settings["port"] = "50000"
-                _settings["hostname"] = ip
+                if (port == None): settings["port"] = "50000"
+                settings["hostname"] = ip
                 cnt = cnt + 1
             else:
                 errormsg("No hostname specified in the CONNECT statement")
                 return
         elif cParms[cnt].upper() == 'PORT':                           
             if cnt+1 < len(cParms):
-                _settings["port"] = cParms[cnt+1].upper()
+                settings["port"] = cParms[cnt+1].upper()
                 cnt = cnt + 1
             else:
                 errormsg("No port specified in the CONNECT statement")
                 return
         elif cParms[cnt].upper() == 'PROMPT':
-            if (connected_prompt() == False): 
+            if (connected_prompt(settings) == False): 
                 print("Connection canceled.")
                 return 
             else:
                 cnt = cnt + 1
         elif cParms[cnt].upper() in ('CLOSE','RESET') :
+            if (profile != None):
+                profileClose(profile, cParms[cnt].upper() == 'RESET')
+                return True
             try:
                 result = ibm_db.close(_hdbc)
                 _hdbi.close()
@@ -582,23 +1177,21 @@ def parseConnect(inSQL,local_ns):
                 pass
             success("Connection closed.")          
             if cParms[cnt].upper() == 'RESET': 
-                _settings["database"] = ''
-            return
+                settings["database"] = ''
+            return True
         else:
             cnt = cnt + 1
                      
-    _ = db2_doConnect()
+    if (profile != None):
+        profile["connected"] = False
+        return profileConnect(profile)
+    else:
+        return db2_doConnect()
 
-def db2_doConnect():
+def db2_dsn(settings):
+    
+    # Build the connection string for a set of connection settings
     
-    global _hdbc, _hdbi, _connected, _runtime
-    global _settings  
-
-    if _connected == False: 
-        
-        if len(_settings["database"]) == 0:
-            return False
-
     dsn = (
            "DRIVER={{IBM DB2 ODBC DRIVER}};"
            "DATABASE={0};"
@@ -606,48 +1199,333 @@ def db2_doConnect():
            "PORT={2};"
            "PROTOCOL=TCPIP;"
            "UID={3};"
-           "PWD={4};{5}").format(_settings["database"], 
-                                 _settings["hostname"], 
-                                 _settings["port"], 
-                                 _settings["uid"], 
-                                 _settings["pwd"],
-                                 _settings["ssl"])
+           "PWD={4};{5}").format(settings["database"], 
+                                 settings["hostname"], 
+                                 settings["port"], 
+                                 settings["uid"], 
+                                 settings["pwd"],
+                                 settings["ssl"])
+    
+    return dsn
+
+def db2_connect(settings,quiet=False):
+    
+    dsn = db2_dsn(settings)
 
     # Get a database handle (hdbc) and a statement handle (hstmt) for subsequent access to DB2
 
     try:
-        _hdbc  = ibm_db.connect(dsn, "", "")
+        hdbc  = ibm_db.connect(dsn, "", "")
     except Exception as err:
-        db2_error(False,True) # errormsg(str(err))
-        _connected = False
-        _settings["database"] = ''
-        return False
+        db2_error(quiet,True) # errormsg(str(err))
+        return None
     
     try:
-        _hdbi = ibm_db_dbi.Connection(_hdbc)
+        hdbi = ibm_db_dbi.Connection(hdbc)
     except Exception as err:
-        db2_error(False,True) # errormsg(str(err))
-        _connected = False
-        _settings["database"] = ''
-        return False  
+        db2_error(quiet,True) # errormsg(str(err))
+        return None
     
-    _connected = True
+    return hdbc, hdbi
+
+def db2_reconnect(ctx):
     
-    # Save the values for future use
+    #
+    # Open the connection of a context again after it was lost. The connect is retried with an 
+    # exponential backoff. Once connected the autocommit setting and special registers (SET SCHEMA,
+    # SET CURRENT PATH, ...) are restored and the prepared statements are prepared again, so the
+    # statement IDs that were handed out keep working. When two contexts lose the same connection the
+    # one that gets _connectLock second uses the connection the first one made. A context that was 
+    # not using the shared connection (a pooled -partitions connection) only gets a new one for itself.
+    #
     
-    save_settings()
+    global _hdbc, _hdbi
     
-    success("Connection successful.")
-    return True
+    session = ctx.session()
+    delay = _reconnectDelay
+    handles = None
+    
+    with _connectLock:
+        lost = ctx.hdbc
+        shared = lost is (ctx.profile["hdbc"] if (ctx.profile != None) else _hdbc)
+    
+    for attempt in range(_reconnectAttempts):
+        if (attempt > 0):
+            time.sleep(delay)
+            delay = delay * 2
+        handles = db2_connect(ctx.settings,True)
+        if (handles != None): break
+        
+    if (handles == None):
+        session["lastUsed"] = 0                              # Check again on the next call
+        errormsg("The connection to " + ctx.settings["database"] + " was lost and could not be re-established after " + 
+                 str(_reconnectAttempts) + " attempts.")
+        return False
+    
+    with _connectLock:
+        current = ctx.profile["hdbc"] if (ctx.profile != None) else _hdbc
+        if (shared == True and current is not lost):          # Another context reconnected first
+            try:
+                ibm_db.close(handles[0])
+            except:
+                pass
+            ctx.hdbc = current
+            ctx.hdbi = ctx.profile["hdbi"] if (ctx.profile != None) else _hdbi
+            return True
+        
+        try:
+            ibm_db.close(lost)
+        except:
+            pass
+        
+        hdbc, hdbi = handles
+        if (shared == False):                                  # A connection of its own (-partitions)
+            pass
+        elif (ctx.profile != None):
+            ctx.profile["hdbc"] = hdbc
+            ctx.profile["hdbi"] = hdbi
+        else:
+            _hdbc = hdbc
+            _hdbi = hdbi
+        ctx.hdbc = hdbc
+        ctx.hdbi = hdbi
+        
+        for setting in (["AUTOCOMMIT"] + list(session["registers"])):
+            try:
+                if (setting == "AUTOCOMMIT"):
+                    if (session["autocommit"] == False): ibm_db.autocommit(hdbc, False)
+                else:
+                    ibm_db.exec_immediate(hdbc, session["registers"][setting])
+            except:
+                pass
+        
+        for i in range(len(ctx.stmtSQL) if shared else 0):   # Statements belong to the shared connection
+            try:
+                stmt = ibm_db.prepare(hdbc, ctx.stmtSQL[i])
+                if (stmt != False): ctx.stmt[i] = stmt
+            except:
+                pass
+            
+        session["reconnects"] += 1
+        session["lastUsed"] = time.time()
+    
+    success("The connection to " + ctx.settings["database"] + " was lost and has been re-established (reconnects: " + 
+            str(session["reconnects"]) + ").")
     
+    return True
 
-def load_settings():
+def connectionLost(sqlstate, sqlcode):
+    
+    return (sqlstate in _connectionStates or sqlcode in _connectionCodes)
 
-    # This routine will load the settings from the previous session if they exist
+def retryStatement(ctx, quiet):
     
-    global _settings
+    #
+    # True when the statement that just failed should be run again: its connection was lost and has
+    # been re-established. This is only done with autocommit on, since otherwise the work the 
+    # transaction did before the statement was rolled back with the connection. Each statement is
+    # run again only once.
+    #
     
-    fname = "db2connect.pickle"
+    if (ctx.retry == False): return False
+    
+    ctx.retry = False
+    ctx.sqlcode, ctx.sqlstate, ctx.sqlerror = 0, "0", ""
+    if (quiet == False): success("Running the statement again.")
+    
+    return True
+
+def retryStatements(ctx, statements):
+    
+    # The statements to run, with a statement that failed because the connection was lost given again
+    
+    for sqlin in statements:
+        ctx.retry = False
+        yield sqlin
+        if (retryStatement(ctx, ctx.flag(["-q","-quiet"])) == True):
+            yield sqlin
+
+def trackSession(ctx, sql):
+    
+    # Remember the special registers that are set so they can be restored after a reconnect
+    
+    found = _setRegister.match(sql)
+    if (found != None):
+        register = " ".join(found.group(1).upper().split())
+        ctx.session()["registers"][register] = sql
+
+def db2_doConnect(quiet=False):
+    
+    # A quiet connect (used by the background warm-up) does not display anything and leaves the 
+    # settings alone if it fails, so the first statement can connect again and report the error.
+    
+    global _hdbc, _hdbi, _connected, _runtime
+    global _settings  
+
+    if _connected == False: 
+        
+        if len(_settings["database"]) == 0:
+            return False
+
+    handles = db2_connect(_settings,quiet)
+    
+    with _connectLock:
+        if (handles == None):
+            _connected = False
+            if (quiet == False): _settings["database"] = ''
+            return False
+        _hdbc, _hdbi = handles
+        _connected = True
+        _session.update({"autocommit" : True, "registers" : {}, "lastUsed" : time.time()})
+    
+    if (quiet == True): return True
+    
+    # Save the values for future use
+    
+    save_settings()
+    
+    success("Connection successful.")
+    return True
+
+# Background warm-up
+#
+# With OPTION WARMUP ON the saved connection and every saved profile are connected in background 
+# threads when the extension is loaded, and a small query is run to prime the connection. The first
+# statement that needs a connection waits for them to finish instead of connecting itself.
+
+_warmupSQL = "SELECT 1 FROM SYSIBM.SYSDUMMY1"
+
+def warmupConnect(profile):
+    
+    try:
+        if (profile == None):
+            if (db2_doConnect(True) == False): return
+            hdbc = _hdbc
+        else:
+            if (profileConnect(profile,True) == False): return
+            hdbc = profile["hdbc"]
+        stmt = ibm_db.exec_immediate(hdbc,_warmupSQL)
+        if (stmt != False): ibm_db.free_result(stmt)
+    except:
+        pass
+    
+def startWarmup():
+    
+    if (_settings.get("warmup",False) == False): return
+    
+    targets = [None] if (len(_settings["database"]) > 0) else []
+    targets.extend([_profiles[name] for name in _profiles])
+    
+    for target in targets:
+        t = threading.Thread(target=warmupConnect, args=(target,))
+        t.daemon = True
+        _warmups.append(t)
+        t.start()
+        
+def waitWarmup():
+    
+    while (len(_warmups) > 0):
+        _warmups.pop().join()
+    
+
+# Connection profiles
+#
+# CONNECT AS name keeps a separate connection open for every profile name. A profile has its own copy
+# of the settings (connection information and options), its own connection handles and its own list
+# of prepared statements. Only the settings are saved - the connection is opened again the first 
+# time the profile is used.
+
+def newProfile(name):
+    
+    profile = {
+        "name"      : name,
+        "settings"  : dict(_settings),    # Start with the options of the default connection
+        "connected" : False,
+        "hdbc"      : None,
+        "hdbi"      : None,
+        "stmt"      : [],
+        "stmtID"    : [],
+        "stmtSQL"   : [],
+        "session"   : {"autocommit" : True, "registers" : {}, "reconnects" : 0, "lastUsed" : 0}
+    }
+    _profiles[name] = profile
+    
+    return profile
+
+def profileConnect(profile,quiet=False):
+    
+    if (len(profile["settings"]["database"]) == 0):
+        return False
+    
+    handles = db2_connect(profile["settings"],quiet)
+    if (handles == None):
+        return False
+    
+    with _connectLock:
+        profile["hdbc"], profile["hdbi"] = handles
+        profile["connected"] = True
+        del profile["stmt"][:]            # Statements prepared on an old connection are gone
+        del profile["stmtID"][:]
+        del profile["stmtSQL"][:]
+        profile["session"].update({"autocommit" : True, "registers" : {}, "lastUsed" : time.time()})
+    
+    if (quiet == True): return True
+    
+    save_profiles()
+    
+    success("Connection " + profile["name"] + " successful.")
+    return True
+
+def profileClose(profile, reset):
+    
+    try:
+        ibm_db.close(profile["hdbc"])
+        profile["hdbi"].close()
+    except:
+        pass
+    
+    profile["connected"] = False
+    profile["hdbc"] = None
+    profile["hdbi"] = None
+    
+    if (reset == True):
+        del _profiles[profile["name"]]
+        
+    save_profiles()
+    success("Connection " + profile["name"] + " closed.")
+    
+def load_profiles():
+    
+    fname = "db2profiles.pickle"
+    
+    try:
+        with open(fname,'rb') as f:
+            saved = pickle.load(f)
+    except:
+        return
+    
+    for name in saved:
+        if (name not in _profiles):
+            profile = newProfile(name)
+            profile["settings"].update(saved[name])
+
+def save_profiles():
+    
+    fname = "db2profiles.pickle"
+    
+    try:
+        with open(fname,'wb') as f:
+            pickle.dump(dict([(name,_profiles[name]["settings"]) for name in _profiles]),f)
+    except:
+        errormsg("Failed trying to write the Db2 connection profiles.")
+
+def load_settings():
+
+    # This routine will load the settings from the previous session if they exist
+    
+    global _settings
+    
+    fname = "db2connect.pickle"
 
     try:
         with open(fname,'rb') as f: 
@@ -660,6 +1538,8 @@ def load_settings():
     except: 
         pass
     
+    load_profiles()
+    
     return
     
 def save_settings():
@@ -688,10 +1568,11 @@ def save_settings():
  
     return  
 
-def db2_error(quiet,connect=False):
+def db2_error(quiet,connect=False,ctx=None):
     
-    global sqlerror, sqlcode, sqlstate, _environment
+    global _environment
     
+    if (ctx == None): ctx = currentContext()
     
     try:
         if (connect == False):
@@ -701,48 +1582,23 @@ def db2_error(quiet,connect=False):
             errmsg = ibm_db.conn_errormsg().replace('\r',' ')
             errmsg = errmsg[errmsg.rfind("]")+1:].strip()
             
-        sqlerror = errmsg
- 
-        msg_start = errmsg.find("SQLSTATE=")
-        if (msg_start != -1):
-            msg_end = errmsg.find(" ",msg_start)
-            if (msg_end == -1):
-                msg_end = len(errmsg)
-            sqlstate = errmsg[msg_start+9:msg_end]
-        else:
-            sqlstate = "0"
-    
-        msg_start = errmsg.find("SQLCODE=")
-        if (msg_start != -1):
-            msg_end = errmsg.find(" ",msg_start)
-            if (msg_end == -1):
-                msg_end = len(errmsg)
-            sqlcode = errmsg[msg_start+8:msg_end]
-            try:
-                sqlcode = int(sqlcode)
-            except:
-                pass
-        else:        
-            sqlcode = 0
-            
     except:
-        errmsg = "Unknown error."
-        sqlcode = -99999
-        sqlstate = "-99999"
-        sqlerror = errmsg
+        ctx.sqlcode = -99999
+        ctx.sqlstate = "-99999"
+        ctx.sqlerror = "Unknown error."
         return
         
+    ctx.sqlerror = errmsg
     
     msg_start = errmsg.find("SQLSTATE=")
     if (msg_start != -1):
         msg_end = errmsg.find(" ",msg_start)
         if (msg_end == -1):
             msg_end = len(errmsg)
-        sqlstate = errmsg[msg_start+9:msg_end]
+        ctx.sqlstate = errmsg[msg_start+9:msg_end]
     else:
-        sqlstate = "0"
+        ctx.sqlstate = "0"
         
-    
     msg_start = errmsg.find("SQLCODE=")
     if (msg_start != -1):
         msg_end = errmsg.find(" ",msg_start)
@@ -753,19 +1609,22 @@ def db2_error(quiet,connect=False):
             sqlcode = int(sqlcode)
         except:
             pass
+        ctx.sqlcode = sqlcode
     else:
-        sqlcode = 0
-    
-    if quiet == True: return
-    
-    if (errmsg == ""): return
+        ctx.sqlcode = 0
+        
+    if (quiet == False and errmsg != ""):
 
-    html = '<p><p style="border:2px; border-style:solid; border-color:#FF0000; background-color:#ffe6e6; padding: 1em;">'
+        html = '<p><p style="border:2px; border-style:solid; border-color:#FF0000; background-color:#ffe6e6; padding: 1em;">'
     
-    if (_environment["jupyter"] == True):
-        pdisplay(pHTML(html+errmsg+"</p>"))
-    else:
-        print(errmsg)
+        if (_environment["jupyter"] == True):
+            pdisplay(pHTML(html+errmsg+"</p>"))
+        else:
+            print(errmsg)
+        
+    if (connect == False and connectionLost(ctx.sqlstate,ctx.sqlcode) == True):
+        reconnected = db2_reconnect(ctx)                     # Ready for the next statement
+        ctx.retry = (reconnected == True and ctx.session()["autocommit"] == True)
     
 # Print out an error message
 
@@ -833,23 +1692,161 @@ def setMacro(inSQL,parms):
         return None
     
     macroName = names[1].upper()
-    _macros[macroName] = inSQL
+    
+    if (inSQL == None or inSQL.strip() == ""):
+        errormsg("No macro body supplied for " + macroName + ".")
+        return None
+    
+    try:
+        _macros[macroName] = compileMacro(inSQL)
+    except ValueError as err:
+        errormsg("Macro " + macroName + ": " + str(err))
+        return None
+    
+    _library["files"].pop(macroName,None)          # A defined macro replaces a library macro
 
     return
 
+def indexMacros():
+    
+    #
+    # Return the index of the macro files in the MACROPATH directory. A file called name.macro holds
+    # the macro NAME (other files, like select.sql, are not macros). Only the directory is listed here
+    # - the files are read when the macro is first used. The directory is listed again when its 
+    # modification time changes.
+    #
+    
+    global _library
+    
+    path = _settings.get("macropath")
+    
+    if (path != _library["path"]):                 # The path changed so forget everything
+        for name in _library["files"]: _macros.pop(name,None)
+        _library["path"] = path
+        _library["mtime"] = None
+        _library["index"] = {}
+        _library["files"] = {}
+        _library["cache"] = None                   # The compiled macros are kept in the directory
+        
+    if (path == None): return _library["index"]
+    
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return {}
+    
+    if (mtime != _library["mtime"]):
+        index = {}
+        for fname in os.listdir(path):
+            name, ext = os.path.splitext(fname)
+            if (ext.lower() == ".macro" and name != ""):
+                index[name.upper()] = os.path.join(path,fname)
+        _library["index"] = index
+        _library["mtime"] = mtime
+        
+    return _library["index"]
+
+def loadMacroCache():
+    
+    # The compiled macros from earlier sessions, saved in db2macros.pickle in the MACROPATH directory.
+    # Entries are keyed by file name and hold the modification time, the SHA1 of the text and the 
+    # compiled macro.
+    
+    if (_library["cache"] == None):
+        try:
+            with open(os.path.join(_library["path"],"db2macros.pickle"),'rb') as f:
+                _library["cache"] = pickle.load(f)
+        except:
+            _library["cache"] = {}
+            
+    return _library["cache"]
+
+def saveMacroCache():
+    
+    try:
+        with open(os.path.join(_library["path"],"db2macros.pickle"),'wb') as f:
+            pickle.dump(_library["cache"],f)
+    except:
+        errormsg("Failed trying to write the compiled macro cache.")
+
+def findMacro(macro_name):
+    
+    #
+    # Make sure that the library macro macro_name is loaded and current. Returns False if there is
+    # no such macro in the MACROPATH directory. A macro is only compiled if neither the modification
+    # time nor the SHA1 of the file match what is in the cache, so edited files are picked up the
+    # next time the macro is used.
+    #
+    
+    global _macros, _library
+    
+    index = indexMacros()
+    fname = index.get(macro_name)
+    
+    try:
+        mtime = os.stat(fname).st_mtime if (fname != None) else None
+    except OSError:
+        mtime = None
+        
+    if (mtime == None):                            # No file (anymore) so drop the library macro
+        if (macro_name in _library["files"]):
+            del _library["files"][macro_name]
+            _macros.pop(macro_name,None)
+        return False
+    
+    if (_library["files"].get(macro_name) == mtime): return True
+    
+    cache = loadMacroCache()
+    cached = cache.get(fname)
+    
+    if (cached == None or cached[0] != mtime):
+        try:
+            with open(fname,'r') as f:
+                text = f.read()
+        except:
+            errormsg("Unable to read the macro file " + fname + ".")
+            return False
+        
+        sha1 = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        
+        if (cached != None and cached[1] == sha1):  # Touched but not changed
+            cached = (mtime, sha1, cached[2])
+        else:
+            if (text.lstrip()[:5].lower() == "%%sql"):  # Files saved from a %%sql define cell
+                text = text.lstrip().split("\n",1)[1] if "\n" in text.lstrip() else ""
+            try:
+                cached = (mtime, sha1, compileMacro(text))
+            except ValueError as err:
+                errormsg("Macro " + macro_name + ": " + str(err))
+                return False
+            
+        cache[fname] = cached
+        saveMacroCache()
+        
+    _macros[macro_name] = cached[2]
+    _library["files"][macro_name] = mtime
+    
+    return True
+
 def checkMacro(in_sql):
        
     global _macros
     
     if (len(in_sql) == 0): return(in_sql)          # Nothing to do 
     
-    tokens = parseArgs(in_sql,None)                # Take the string and reduce into tokens
+    # Every statement goes through here, so check the first word before tokenizing the whole string.
+    # A macro name never contains a quote, so the first blank-delimited word is the name.
     
-    macro_name = tokens[0].upper()                 # Uppercase the name of the token
+    macro_name = in_sql.lstrip().split(" ",1)[0].upper()
  
-    if (macro_name not in _macros): 
-        return(in_sql) # No macro by this name so just return the string
+    if (macro_name not in _macros or macro_name in _library["files"]):
+        if (_settings.get("macropath") == None and _library["path"] == None):
+            return(in_sql) # No macro by this name so just return the string
+        if (findMacro(macro_name) == False):
+            return(in_sql) # Not in the macro library either
 
+    tokens = parseArgs(in_sql,None)                # Take the string and reduce into tokens
+    
     result = runMacro(_macros[macro_name],in_sql,tokens)  # Execute the macro using the tokens we found
 
     return(result)                                 # Runmacro will either return the original SQL or the new one
@@ -937,232 +1934,264 @@ def splitassign(arg):
 
 def parseArgs(argin,_vars):
 
-    quoteChar = ""
-    inQuote = False
-    inArg = True
+    # Tokens are separated by single blanks (two blanks in a row produce a "null" token) and quoted
+    # strings are kept together. The scan jumps from one interesting character to the next instead
+    # of walking the string one character at a time.
+
     args = []
-    arg = ''
+    text = argin.lstrip()
+    end = len(text)
+    start = 0
     
-    for ch in argin.lstrip():
-        if (inQuote == True):
-            if (ch == quoteChar):
-                inQuote = False   
-                arg = arg + ch #z
-            else:
-                arg = arg + ch
-        elif (ch == "\"" or ch == "\'"): # Do we have a quote
-            quoteChar = ch
-            arg = arg + ch #z
-            inQuote = True
-        elif (ch == " "):
-            if (arg != ""):
-                arg = subvars(arg,_vars)
-                args.append(arg)
+    for found in _argsScan.finditer(text):
+        if (found.group(0) == " "):
+            pos = found.start()
+            if (pos > start):
+                args.append(subvars(text[start:pos],_vars))
             else:
                 args.append("null")
-            arg = ""
-        else:
-            arg = arg + ch
+            start = pos + 1
                 
-    if (arg != ""):
-        arg = subvars(arg,_vars)
-        args.append(arg)   
+    if (start < end):
+        args.append(subvars(text[start:],_vars))
                
     return(args)
 
-def runMacro(script,in_sql,tokens):
+def compileMacro(script):
+    
+    #
+    # Translate the text of a macro into a list of instructions when it is defined, so running it
+    # does not have to split and tokenize the lines again. Each line becomes one instruction, with
+    # the text held as compiled templates (see compileTemplate):
+    #
+    #   ("sql", line)                     - add the line to the generated SQL
+    #   ("if", arg1, op, arg2, target)    - jump to target when the comparison is false
+    #   ("jump", target)                  - end of the true branch of an if/else
+    #   ("echo", args) ("exit", args)     - display a message (exit also ends the macro)
+    #   ("var", name, args)               - set a macro variable
+    #   ("return",)                       - stop and return the SQL generated so far
+    #
+    # Errors in the if/else/endif structure are raised as a ValueError. The operator of an if is 
+    # checked here unless it comes from a variable (if {1} {2} 5), which is checked when it runs.
+    #
+    
+    code = []
+    blocks = []                                     # Open if/else instructions that need a target
+    lineno = 0
+    
+    for line in script.split("\n"):
+        lineno = lineno + 1
+        line = line.strip()
+        if (line == ""): continue
+        if (line[0] == "#"): continue               # A comment line starts with a # in the first position of the line
+        args = parseArgs(line,None)                 # Tokens are substituted when the macro runs
+        keyword = args[0]
+        
+        if (keyword == "if"):
+            if (len(args) < 4):
+                raise ValueError("Incorrect number of arguments for the if clause on line " + str(lineno) + ".")
+            if ("{" not in args[2] and args[2] not in _macroOps):
+                raise ValueError("Unknown comparison operator in the if statement on line " + str(lineno) + ": " + args[2])
+            if (len(blocks) >= _macroNesting):
+                raise ValueError("if statements are nested more than " + str(_macroNesting) + " deep on line " + str(lineno) + ".")
+            blocks.append((len(code),lineno))
+            code.append(["if", compileTemplate(args[1]), compileTemplate(args[2]), compileTemplate(args[3]), None])
+        elif (keyword == "else"):
+            if (len(blocks) == 0):
+                raise ValueError("else without a matching if on line " + str(lineno) + ".")
+            start, ifline = blocks.pop()
+            code[start][-1] = len(code) + 1         # A false if continues after the jump
+            blocks.append((len(code),ifline))
+            code.append(["jump", None])
+        elif (keyword == "endif"):
+            if (len(blocks) == 0):
+                raise ValueError("Unmatched if/endif pairs on line " + str(lineno) + ".")
+            start, ifline = blocks.pop()
+            code[start][-1] = len(code)
+        elif (keyword in ("exit","echo")):
+            code.append([keyword, [compileTemplate(arg) for arg in args[1:]]])
+        elif (keyword == "var"):
+            if (len(args) < 2):
+                raise ValueError("No variable name supplied on line " + str(lineno) + ".")
+            code.append(["var", compileTemplate(args[1]), [compileTemplate(arg) for arg in args[2:]]])
+        elif (keyword == "return"):
+            code.append(["return"])
+        elif (keyword == "pass"):
+            pass
+        else:
+            code.append(["sql", compileTemplate(line)])
+            
+    if (len(blocks) > 0):
+        raise ValueError("Missing endif for the if statement on line " + str(blocks[-1][1]) + ".")
+    
+    return [tuple(instruction) for instruction in code]
+
+def macroCompare(arg1, op, arg2):
+    
+    if (len(arg2) > 2):                             # Remove quotes from the comparison value
+        ch1 = arg2[0]
+        ch2 = arg2[-1:]
+        if (ch1 in ['"',"'"] and ch1 == ch2):
+            arg2 = arg2[1:-1].strip()
+            
+    if (op in ["=","=="]):
+        return arg1 == arg2
+    elif (op in ["<=","=<"]):
+        return arg1 <= arg2
+    elif (op in [">=","=>"]):                    
+        return arg1 >= arg2
+    elif (op in ["<>","!="]):                    
+        return arg1 != arg2
+    elif (op in ["<"]):
+        return arg1 < arg2
+    else:
+        return arg1 > arg2
+
+def runMacro(code,in_sql,tokens):
     
-    result = ""
-    runIT = True 
-    code = script.split("\n")
-    level = 0
-    runlevel = [True,False,False,False,False,False,False,False,False,False]
-    ifcount = 0
+    result = []
     _vars = {}
     
     for i in range(0,len(tokens)):
-        vstr = str(i)
-        _vars[vstr] = tokens[i]
+        _vars[str(i)] = tokens[i]
         
     if (len(tokens) == 0):
         _vars["argc"] = "0"
     else:
         _vars["argc"] = str(len(tokens)-1)
-          
-    for line in code:
-        line = line.strip()
-        if (line == "" or line == "\n"): continue
-        if (line[0] == "#"): continue    # A comment line starts with a # in the first position of the line
-        args = parseArgs(line,_vars)     # Get all of the arguments
-        if (args[0] == "if"):
-            ifcount = ifcount + 1
-            if (runlevel[level] == False): # You can't execute this statement
-                continue
-            level = level + 1    
-            if (len(args) < 4):
-                print("Macro: Incorrect number of arguments for the if clause.")
-                return insql
-            arg1 = args[1]
-            arg2 = args[3]
-            if (len(arg2) > 2):
-                ch1 = arg2[0]
-                ch2 = arg2[-1:]
-                if (ch1 in ['"',"'"] and ch1 == ch2):
-                    arg2 = arg2[1:-1].strip()
-               
-            op   = args[2]
-            if (op in ["=","=="]):
-                if (arg1 == arg2):
-                    runlevel[level] = True
-                else:
-                    runlevel[level] = False                
-            elif (op in ["<=","=<"]):
-                if (arg1 <= arg2):
-                    runlevel[level] = True
-                else:
-                    runlevel[level] = False                
-            elif (op in [">=","=>"]):                    
-                if (arg1 >= arg2):
-                    runlevel[level] = True
-                else:
-                    runlevel[level] = False                                       
-            elif (op in ["<>","!="]):                    
-                if (arg1 != arg2):
-                    runlevel[level] = True
-                else:
-                    runlevel[level] = False  
-            elif (op in ["<"]):
-                if (arg1 < arg2):
-                    runlevel[level] = True
-                else:
-                    runlevel[level] = False                
-            elif (op in [">"]):
-                if (arg1 > arg2):
-                    runlevel[level] = True
-                else:
-                    runlevel[level] = False                
-            else:
-                print("Macro: Unknown comparison operator in the if statement:" + op)
-
-                continue
-
-        elif (args[0] in ["exit","echo"] and runlevel[level] == True):
-            msg = ""
-            for msgline in args[1:]:
-                if (msg == ""):
-                    msg = subvars(msgline,_vars)
-                else:
-                    msg = msg + " " + subvars(msgline,_vars)
+    
+    pc = 0
+    end = len(code)
+    
+    while pc < end:
+        instruction = code[pc]
+        op = instruction[0]
+        pc = pc + 1
+        
+        if (op == "sql"):
+            result.append(renderTemplate(instruction[1],_vars))
+            
+        elif (op == "if"):
+            arg1 = renderTemplate(instruction[1],_vars)
+            compare = renderTemplate(instruction[2],_vars)
+            arg2 = renderTemplate(instruction[3],_vars)
+            if (compare not in _macroOps):                    # The operator came from a variable
+                errormsg("Macro: Unknown comparison operator in the if statement: " + compare)
+                pc = instruction[4]
+            elif (macroCompare(arg1,compare,arg2) == False):
+                pc = instruction[4]
+                
+        elif (op == "jump"):
+            pc = instruction[1]
+            
+        elif (op in ["exit","echo"]):
+            msg = " ".join([renderTemplate(arg,_vars) for arg in instruction[1]])
             if (msg != ""): 
-                if (args[0] == "echo"):
+                if (op == "echo"):
                     debug(msg,error=False)
                 else:
                     debug(msg,error=True)
-            if (args[0] == "exit"): return ''
-       
-        elif (args[0] == "pass" and runlevel[level] == True):
-            pass
-
-        elif (args[0] == "var" and runlevel[level] == True):
-            value = ""
-            for val in args[2:]:
-                if (value == ""):
-                    value = subvars(val,_vars)
-                else:
-                    value = value + " " + subvars(val,_vars)
-            value.strip()
-            _vars[args[1]] = value 
-
-        elif (args[0] == 'else'):
-
-            if (ifcount == level):
-                runlevel[level] = not runlevel[level]
-                
-        elif (args[0] == 'return' and runlevel[level] == True):
-            return(result)
-
-        elif (args[0] == "endif"):
-            ifcount = ifcount - 1
-            if (ifcount < level):
-                level = level - 1
-                if (level < 0):
-                    print("Macro: Unmatched if/endif pairs.")
-                    return ''
+            if (op == "exit"): return ''
+            
+        elif (op == "var"):
+            value = " ".join([renderTemplate(arg,_vars) for arg in instruction[2]])
+            _vars[renderTemplate(instruction[1],_vars)] = value 
                 
-        else:
-            if (runlevel[level] == True):
-                if (result == ""):
-                    result = subvars(line,_vars)
-                else:
-                    result = result + "\n" + subvars(line,_vars)
+        elif (op == "return"):
+            break
                     
-    return(result)       
+    return("\n".join(result))       
 
-def subvars(script,_vars):
+def compileTemplate(script):
     
-    if (_vars == None): return script
+    #
+    # Break a macro line into a tuple of literal strings and placeholders. A placeholder is a tuple 
+    # of (form, name, index) where the form is "" for {n} or {name}, "^" for the uppercase {^n}
+    # form and "*" for {*n}, which is every argument from n onwards (index holds n as an integer).
+    # Braces are paired innermost first, so a } that comes before the next { is just text.
+    #
     
-    remainder = script
-    result = ""
-    done = False
+    parts = []
+    pos = 0
     
-    while done == False:
-        bv = remainder.find("{")
-        if (bv == -1):
-            done = True
-            continue
-        ev = remainder.find("}")
-        if (ev == -1):
-            done = True
-            continue
-        result = result + remainder[:bv]
-        vvar = remainder[bv+1:ev]
-        remainder = remainder[ev+1:]
-        
-        upper = False
-        allvars = False
-        if (vvar[0] == "^"):
-            upper = True
-            vvar = vvar[1:]
-        elif (vvar[0] == "*"):
-            vvar = vvar[1:]
-            allvars = True
+    for found in _templateScan.finditer(script):
+        name = found.group(1)
+        form = name[:1]
+        if (form in ("^","*")):
+            name = name[1:]
         else:
-            pass
+            form = ""
+        if (name == ""): continue                       # {} is left alone
+        index = None
+        if (form == "*"):
+            try:
+                index = int(name)
+            except:
+                pass                                    # Not an argument number so only this variable is used
+        if (found.start() > pos): 
+            parts.append(script[pos:found.start()])
+        parts.append((form,name,index))
+        pos = found.end()
         
-        if (vvar in _vars):
-            if (upper == True):
-                items = _vars[vvar].upper()
-            elif (allvars == True):
-                try:
-                    iVar = int(vvar)
-                except:
-                    return(script)
-                items = ""
-                sVar = str(iVar)
-                while sVar in _vars:
-                    if (items == ""):
-                        items = _vars[sVar]
-                    else:
-                        items = items + " " + _vars[sVar]
-                    iVar = iVar + 1
-                    sVar = str(iVar)
+    if (pos < len(script)):
+        parts.append(script[pos:])
+        
+    return tuple(parts)
+
+def getTemplate(script):
+    
+    global _templates
+    
+    template = _templates.get(script)
+    if (template == None):
+        if (len(_templates) >= _templatesSize): _templates.clear()
+        template = compileTemplate(script)
+        _templates[script] = template
+        
+    return template
+
+def renderTemplate(template,_vars):
+    
+    # Substitute the macro variables into a compiled template in a single pass
+    
+    if (len(template) == 1 and isinstance(template[0],str)): 
+        return template[0]                              # Nothing to substitute
+    
+    result = []
+    
+    for part in template:
+        if (isinstance(part,str)):
+            result.append(part)
+            continue
+        form, name, index = part
+        value = _vars.get(name)
+        if (value == None):
+            if (form == "*"):
+                result.append("")
             else:
-                items = _vars[vvar]
+                result.append("null")
+        elif (form == "^"):
+            result.append(value.upper())
+        elif (form == "*" and index != None):
+            sVar = name
+            while sVar in _vars:
+                result.append(_vars[sVar])
+                result.append(" ")
+                index = index + 1
+                sVar = str(index)
+            result.pop()                                # Remove the trailing blank
         else:
-            if (allvars == True):
-                items = ""
-            else:
-                items = "null"                
-                 
-        result = result + items
+            result.append(value)
                 
-    if (remainder != ""):
-        result = result + remainder
-        
-    return(result)
+    return("".join(result))
 
-def sqlTimer(hdbc, runtime, inSQL):
+def subvars(script,_vars):
+    
+    if (_vars == None or "{" not in script): return script
+    
+    return renderTemplate(getTemplate(script),_vars)
+
+def sqlTimer(ctx, runtime, inSQL):
     
     count = 0
     t_end = time.time() + runtime
@@ -1170,25 +2199,44 @@ def sqlTimer(hdbc, runtime, inSQL):
     while time.time() < t_end:
         
         try:
-            stmt = ibm_db.exec_immediate(hdbc,inSQL) 
+            stmt = ibm_db.exec_immediate(ctx.hdbc,inSQL) 
             if (stmt == False):
-                db2_error(flag(["-q","-quiet"]))
+                db2_error(ctx.flag(["-q","-quiet"]),ctx=ctx)
                 return(-1)
             ibm_db.free_result(stmt)
             
         except Exception as err:
-            db2_error(False)
+            db2_error(False,ctx=ctx)
             return(-1)
         
         count = count + 1
                     
     return(count)
 
-def splitargs(arguments):
-    
-    import types
+def parseNumber(arg):
     
-    # String the string and remove the ( and ) characters if they at the beginning and end of the string
+    # Convert an integer or float literal into a number. Anything else returns None.
+    
+    try:
+        return int(arg,0)
+    except ValueError:
+        pass
+    
+    try:
+        value = float(arg)
+    except ValueError:
+        return None
+    
+    if (math.isinf(value) or math.isnan(value)):
+        if (arg.strip("+-").isalpha() == True): return None   # inf and nan are not literals
+        
+    return value
+
+def splitargs(arguments):
+    
+    import types
+    
+    # String the string and remove the ( and ) characters if they at the beginning and end of the string
     
     results = []
     
@@ -1204,46 +2252,24 @@ def splitargs(arguments):
     else:
         step2 = step1
             
-    # Now we have a string without brackets. Start scanning for commas
+    # Now we have a string without brackets. Start scanning for commas. Arguments are sliced out of
+    # the string at each comma instead of being built up one character at a time
             
-    quoteCH = ""
-    pos = 0
-    arg = ""
+    start = 0
     args = []
+    inQuote = False
             
-    while pos < len(step2):
-        ch = step2[pos]
-        if (quoteCH == ""):                     # Are we in a quote?
-            if (ch in ('"',"'")):               # Check to see if we are starting a quote
-                quoteCH = ch
-                arg = arg + ch
-                pos += 1
-            elif (ch == ","):                   # Are we at the end of a parameter?
-                arg = arg.strip()
-                args.append(arg)
-                arg = ""
-                inarg = False 
-                pos += 1
-            else:                               # Continue collecting the string
-                arg = arg + ch
-                pos += 1
-        else:
-            if (ch == quoteCH):                 # Are we at the end of a quote?
-                arg = arg + ch                  # Add the quote to the string
-                pos += 1                        # Increment past the quote
-                quoteCH = ""                    # Stop quote checking (maybe!)
-            else:
-                pos += 1
-                arg = arg + ch
-
-    if (quoteCH != ""):                         # So we didn't end our string
-        arg = arg.strip()
-        args.append(arg)
-    elif (arg != ""):                           # Something left over as an argument
-        arg = arg.strip()
-        args.append(arg)
-    else:
-        pass
+    for found in _splitScan.finditer(step2):
+        token = found.group(0)
+        if (token == ","):                      # Are we at the end of a parameter?
+            args.append(step2[start:found.start()].strip())
+            start = found.end()
+        elif (len(token) == 1 or token[-1] != token[0]):
+            inQuote = True                      # The last quote was never closed
+
+    arg = step2[start:]
+    if (inQuote == True or arg != ""):          # Something left over as an argument
+        args.append(arg.strip())
     
     results = []
     
@@ -1257,16 +2283,11 @@ def splitargs(arguments):
             else:
                 isString = False 
                 isNumber = False 
-                try:
-                    value = eval(arg)
-                    if (type(value) == int):
-                        isNumber = True
-                    elif (isinstance(value,float) == True):
-                        isNumber = True
-                    else:
-                        value = arg
-                except:
+                value = parseNumber(arg)
+                if (value == None):
                     value = arg
+                else:
+                    isNumber = True
 
         else:
             value = ""
@@ -1278,135 +2299,449 @@ def splitargs(arguments):
         
     return results
 
-def sqlParser(sqlin,local_ns):
-       
-    sql_cmd = ""
-    encoded_sql = sqlin
-    
-    firstCommand = "(?:^\s*)([a-zA-Z]+)(?:\s+.*|$)"
+def sqlTokenize(sqlin):
     
-    findFirst = re.match(firstCommand,sqlin)
-    
-    if (findFirst == None): # We did not find a match so we just return the empty string
-        return sql_cmd, encoded_sql
-    
-    cmd = findFirst.group(1)
-    sql_cmd = cmd.upper()
-
     #
-    # Scan the input string looking for variables in the format :var. If no : is found just return.
-    # Var must be alpha+number+_ to be valid
+    # Scan the input string once and break it into a template of literal text and host variable slots
+    # (:var). Variables inside quoted strings, quoted identifiers and comments are left alone. A slot
+    # is a tuple of (variable name, flag_quotes) - the name includes any .attr, [0] or ['key'] steps
+    # and a variable name that is stopped by a period is not quoted. The template only depends on the
+    # text so it is cached and reused when a cell is rerun.
     #
     
-    if (':' not in sqlin): # A quick check to see if parameters are in here, but not fool-proof!         
-        return sql_cmd, encoded_sql    
+    template = []
+    pos = 0
+    start = 0
+    end = len(sqlin)
+    
+    while pos < end:
+        found = _sqlScan.search(sqlin,pos)
+        if (found == None):
+            break
+        token = found.group(0)
+        pos = found.start()
+        if (token in ("'",'"')):                              # Quoted string or identifier
+            close = sqlin.find(token,pos+1)
+            pos = end if (close == -1) else close + 1
+        elif (token == "--"):                                 # Comment to the end of the line
+            close = sqlin.find("\n",pos)
+            pos = end if (close == -1) else close
+        elif (token == "/*"):                                 # Block comment
+            close = sqlin.find("*/",pos+2)
+            pos = end if (close == -1) else close + 2
+        else:                                                 # Possible host variable
+            varName = _varScan.match(sqlin,pos+1).group(0)
+            nextPos = pos + 1 + len(varName)
+            if (varName == "" or varName[0] in ('[','.')):    # Not a variable so keep the text
+                pos = nextPos
+                continue
+            if (pos > start):
+                template.append(sqlin[start:pos])
+            flag_quotes = not (nextPos < end and sqlin[nextPos] == '.')
+            template.append((varName,flag_quotes))
+            pos = nextPos
+            start = pos
+            
+    if (start < end):
+        template.append(sqlin[start:])
+        
+    return template
+
+def sqlRender(template,local_ns,ctx=None):
     
-    inVar = False 
-    inQuote = "" 
-    varName = ""
-    encoded_sql = ""
+    # Fill in the variable slots of a template with the current contents of the variables
     
     STRING = 0
     NUMBER = 1
     LIST = 2
     RAW = 3
     
-    for ch in sqlin:
-        if (inVar == True): # We are collecting the name of a variable
-            if (ch.upper() in "@_ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789[]"):
-                varName = varName + ch
-                continue
+    encoded_sql = []
+    
+    for position in range(len(template)):
+        item = template[position]
+        if (isinstance(item,str)):
+            encoded_sql.append(item)
+            continue
+        varName, flag_quotes = item
+        try:
+            varValue, rest = resolvePath(varName,local_ns)
+        except KeyError:                                      # Unknown variables are left in the SQL
+            encoded_sql.append(":" + varName)
+            continue
+        if (rest != ""): flag_quotes = False                  # :schema.TABLE is not quoted
+        varValue, varType = formatContents(varValue,flag_quotes)
+        if (varType == LIST):
+            if (ctx == None or len(varValue) <= ctx.settings.get("listlimit",1000)):
+                encoded_sql.append(listValues(varValue))
             else:
-                if (varName == ""):
-                    encode_sql = encoded_sql + ":"
-                elif (varName[0] in ('[',']')):
-                    encoded_sql = encoded_sql + ":" + varName
+                encoded_sql.append(largeList(ctx,varName,varValue,template,position))
+        elif (varType == NUMBER):
+            encoded_sql.append(str(varValue))
+        else:                                                 # STRING and RAW are already formatted
+            encoded_sql.append(varValue)
+        if (rest != ""): encoded_sql.append(rest)
+            
+    return "".join(encoded_sql)
+
+def listValues(values):
+    
+    # Convert a Python list into a comma separated list of SQL constants
+    
+    items = []
+    for v in values:
+        if (isinstance(v,int) == True):                       # Integer value 
+            items.append(str(v))
+        elif (isinstance(v,float) == True):
+            items.append(str(v))
+        else:
+            try:
+                if (v.find('0x') == 0):                       # Just guessing this is a hex value at beginning
+                    items.append(v)
                 else:
-                    if (ch == '.'): # If the variable name is stopped by a period, assume no quotes are used
-                        flag_quotes = False
-                    else:
-                        flag_quotes = True
-                    varValue, varType = getContents(varName,flag_quotes,local_ns)
-                    if (varValue == None):                 
-                        encoded_sql = encoded_sql + ":" + varName
-                    else:
-                        if (varType == STRING):
-                            encoded_sql = encoded_sql + varValue
-                        elif (varType == NUMBER):
-                            encoded_sql = encoded_sql + str(varValue)
-                        elif (varType == RAW):
-                            encoded_sql = encoded_sql + varValue
-                        elif (varType == LIST):
-                            start = True
-                            for v in varValue:
-                                if (start == False):
-                                    encoded_sql = encoded_sql + ","
-                                if (isinstance(v,int) == True):         # Integer value 
-                                    encoded_sql = encoded_sql + str(v)
-                                elif (isinstance(v,float) == True):
-                                    encoded_sql = encoded_sql + str(v)
-                                else:
-                                    flag_quotes = True
-                                    try:
-                                        if (v.find('0x') == 0):               # Just guessing this is a hex value at beginning
-                                            encoded_sql = encoded_sql + v
-                                        else:
-                                            encoded_sql = encoded_sql + addquotes(v,flag_quotes)      # String
-                                    except:
-                                        encoded_sql = encoded_sql + addquotes(str(v),flag_quotes)                                   
-                                start = False
-
-                encoded_sql = encoded_sql + ch
-                varName = ""
-                inVar = False  
-        elif (inQuote != ""):
-            encoded_sql = encoded_sql + ch
-            if (ch == inQuote): inQuote = ""
-        elif (ch in ("'",'"')):
-            encoded_sql = encoded_sql + ch
-            inQuote = ch
-        elif (ch == ":"): # This might be a variable
-            varName = ""
-            inVar = True
+                    items.append(addquotes(v,True))           # String
+            except:
+                items.append(addquotes(str(v),True))
+                
+    return ",".join(items)
+
+def largeList(ctx,varName,values,template,position):
+    
+    #
+    # A list that is longer than LISTLIMIT is not placed in the SQL. With LISTMODE TEMP the values are
+    # array inserted into a declared global temporary table and the list becomes a subselect against
+    # it. The table is only created when the statement is about to run (loadLists), on the connection 
+    # that runs it. With LISTMODE CHUNK the statement is run once for every LISTLIMIT values and the 
+    # results are put back together, which is only correct for a plain IN list in a SELECT that does not
+    # aggregate, sort or limit the rows (chunkable). AUTO uses a temporary table and falls back to chunks
+    # if the table cannot be created. A list that cannot be handled either way is placed in the SQL 
+    # with a warning.
+    #
+    
+    listmode = ctx.settings.get("listmode","AUTO")
+    
+    if (listmode == "INLINE"):
+        return listValues(values)
+    
+    if (ctx.chunk != None and ctx.chunk[0] == varName):         # Render the chunk that is being run
+        if (ctx.chunkPart != None): return listValues(ctx.chunkPart)
+        return listValues(ctx.chunk[1][:ctx.settings.get("listlimit",1000)])
+    
+    if (listmode in ("AUTO","TEMP") and ctx.listFailed == False):
+        return "SELECT V FROM SESSION." + listEntry(ctx,varName,values)["table"]
+    
+    if (listmode in ("AUTO","CHUNK") and ctx.chunk == None and 
+        chunkable(template,position,varName,listSlots(template,ctx.local_ns))):
+        unique = []                                           # Only one list is run in chunks
+        seen = set()
+        for v in values:                                      # Duplicates would repeat rows
+            key = repr(v)
+            if (key not in seen):
+                seen.add(key)
+                unique.append(v)
+        ctx.chunk = (varName,unique)
+        return listValues(unique[:ctx.settings.get("listlimit",1000)])
+    
+    if (varName not in ctx.listWarned and ctx.flag(["-q","-quiet"]) == False):
+        ctx.listWarned.add(varName)
+        errormsg("Warning: the " + str(len(values)) + " values of :" + varName + " were placed in the SQL. " + 
+                 "A temporary table could not be used and the statement cannot be run in chunks " +
+                 "(only the value list of IN ( ) in a SELECT without OR, NOT, other lists, aggregates, DISTINCT, " +
+                 "ORDER BY or FETCH FIRST can be).")
+    
+    return listValues(values)
+
+def chunkable(template,position,varName,lists=()):
+    
+    #
+    # True when the list at template[position] is the whole value list of an IN predicate (not NOT IN,
+    # not NOT column IN) in a SELECT whose rows can be added together across chunks. lists has the 
+    # names of the other variables in the statement that hold lists - only one list can be chunked.
+    #
+    
+    before = template[position-1] if (position > 0 and isinstance(template[position-1],str)) else ""
+    found = _chunkIn.search(before)
+    if (found == None or found.group(1) != None): return False
+    if (_chunkNot.search(before) != None): return False
+    
+    after = template[position+1] if (position + 1 < len(template) and isinstance(template[position+1],str)) else ""
+    if (after.lstrip()[:1] != ")"): return False                # IN (:ids, 5)
+    
+    uses = [item[0] for item in template if isinstance(item,str) == False]
+    if (uses.count(varName) != 1): return False
+    for name in uses:
+        if (name != varName and name in lists): return False
+    
+    text = _chunkQuotes.sub(" ", " ".join([item for item in template if isinstance(item,str)]))
+    if (_chunkSelect.match(text) == None): return False
+    if (_chunkOr.search(text) != None): return False
+    
+    return _chunkUnsafe.search(text) == None
+
+def listSlots(template,local_ns):
+    
+    # The names of the variables in a template that currently hold lists
+    
+    lists = set()
+    for item in template:
+        if (isinstance(item,str) or item[0] in lists): continue
+        try:
+            value, rest = resolvePath(item[0],local_ns)
+        except KeyError:
+            continue
+        if (isinstance(value,list) == True): lists.add(item[0])
+        
+    return lists
+
+def listEntry(ctx,varName,values):
+    
+    # The temporary table for a list. A list that was changed since it was loaded is loaded again.
+    
+    digest = hashlib.sha1(repr(values).encode("utf-8")).hexdigest()
+    
+    entry = ctx.lists.get(varName)
+    if (entry == None):
+        entry = {"table" : "DB2LIST_" + str(len(ctx.lists) + 1), "digest" : None, "loaded" : {}}
+        ctx.lists[varName] = entry
+    if (entry["digest"] != digest):
+        entry["values"] = values
+        entry["digest"] = digest
+        entry["loaded"] = {}
+        
+    if (varName not in ctx.listTables): ctx.listTables.append(varName)
+        
+    return entry
+
+def loadLists(ctx,hdbc):
+    
+    # Create the temporary tables of the statement that was just rendered on the connection that runs it
+    
+    for varName in ctx.listTables:
+        entry = ctx.lists[varName]
+        loaded = entry["loaded"].get(id(hdbc))
+        if (loaded != None and loaded[1] == entry["digest"]): continue
+        if (listTable(hdbc,entry["table"],entry["values"]) == None): return False
+        entry["loaded"][id(hdbc)] = (hdbc, entry["digest"])  # Keep the handle so its id is not reused
+        
+    return True
+
+def renderStatement(ctx,sqlin,hdbc=None):
+    
+    #
+    # Parse a statement that is about to run on hdbc (the connection of the context by default) and
+    # load its large lists there. If a temporary table cannot be created the statement is rendered 
+    # again without them.
+    #
+    # Every statement that is run goes through here, so this is also where a recording picks it up
+    # (the main loop, -f scripts, -fanout targets, -partitions and -materialize). PREPARE and EXECUTE
+    # are recorded by parsePExec and the EXPORT command only when its query is rendered on its own.
+    #
+    
+    if (hdbc == None): hdbc = ctx.hdbc
+    
+    sqlType, sql = sqlParser(sqlin,ctx)
+    if (len(ctx.listTables) > 0 and loadLists(ctx,hdbc) == False):
+        ctx.listFailed = True
+        sqlType, sql = sqlParser(sqlin,ctx)
+        
+    if (_recording["file"] != None and sqlType not in ("PREPARE","EXECUTE","EXPORT") and sql.strip() != ""):
+        recordStart("sql", sql, ctx=ctx)
+        
+    return sqlType, sql
+
+def listTable(hdbc,table,values):
+    
+    #
+    # Create the temporary table SESSION.table with a single column V and insert the values with one
+    # array insert. Returns None if the table could not be created or loaded.
+    #
+    
+    if (all(isinstance(v,int) for v in values) == True):
+        coltype = "BIGINT"
+        rows = tuple((v,) for v in values)
+    elif (all(isinstance(v,(int,float)) for v in values) == True):
+        coltype = "DOUBLE"
+        rows = tuple((float(v),) for v in values)
+    else:
+        rows = tuple((str(v),) for v in values)
+        coltype = "VARCHAR(" + str(max([len(v[0]) for v in rows] + [1])) + ")"
+    
+    try:
+        stmt = ibm_db.exec_immediate(hdbc,"DECLARE GLOBAL TEMPORARY TABLE SESSION." + table + 
+                                     " (V " + coltype + ") ON COMMIT PRESERVE ROWS NOT LOGGED WITH REPLACE")
+        if (stmt == False): return None
+        stmt = ibm_db.prepare(hdbc,"INSERT INTO SESSION." + table + " VALUES (?)")
+        if (stmt == False): return None
+        if (ibm_db.execute_many(stmt,rows) == None): return None
+    except Exception as err:
+        return None
+    
+    return table
+
+def chunkResults(ctx,sqlin,run):
+    
+    # Run a statement once for every chunk of a large list and return the list of results
+    
+    listlimit = ctx.settings.get("listlimit",1000)
+    values = ctx.chunk[1]
+    results = []
+    
+    try:
+        for start in range(0,len(values),listlimit):
+            ctx.chunkPart = values[start:start+listlimit]
+            sqlType, sql = sqlParser(sqlin,ctx)
+            results.append(run(sql))
+    finally:
+        ctx.chunkPart = None
+        
+    return results
+
+def sqlParser(sqlin,ctx):
+       
+    global _parseCache
+    
+    if (ctx != None): ctx.listTables = []                     # Filled in by sqlRender
+    
+    parsed = _parseCache.get(sqlin)
+    
+    if (parsed == None):
+        
+        findFirst = _firstCommand.match(sqlin)
+    
+        if (findFirst == None): # We did not find a match so we just return the empty string
+            sql_cmd = ""
+            template = None
+        else:
+            sql_cmd = findFirst.group(1).upper()
+            if (':' not in sqlin): # A quick check to see if parameters are in here
+                template = None
+            else:
+                template = sqlTokenize(sqlin)
+                if (len(template) == 1 and isinstance(template[0],str)):
+                    template = None                           # No variables found
+                
+        if (len(_parseCache) >= _parseCacheSize): _parseCache.clear()
+        parsed = (sql_cmd, template)
+        _parseCache[sqlin] = parsed
+        
+    sql_cmd, template = parsed
+    
+    if (template == None):
+        return sql_cmd, sqlin
+    else:
+        return sql_cmd, sqlRender(template,ctx.local_ns,ctx)
+
+def userNamespace():
+    
+    # The IPython user namespace or an empty one when we are not running under IPython
+    
+    try:
+        return get_ipython().user_ns
+    except:
+        return {}
+
+def compilePath(varName):
+    
+    #
+    # Break a host variable reference into the variable name and a list of access steps. Each step
+    # is a tuple of (attribute flag, key, offset of the step in the text). Only name.attr, name[0]
+    # and name['key'] steps are allowed - None is returned for anything else.
+    #
+    
+    found = _pathName.match(varName)
+    if (found == None): return None
+    
+    name = found.group(0)
+    steps = []
+    pos = found.end()
+    end = len(varName)
+    
+    while pos < end:
+        found = _pathScan.match(varName,pos)
+        if (found == None): return None
+        attr, key = found.group(1), found.group(2)
+        if (attr != None):
+            if (attr[:2] == "__"): return None                # Keep away from the Python internals
+            steps.append((True,attr,pos))
+        elif (key[0] in ("'",'"')):
+            steps.append((False,key[1:-1],pos))
         else:
-            encoded_sql = encoded_sql + ch
+            steps.append((False,int(key),pos))
+        pos = found.end()
+        
+    return (name,steps)
+
+def resolvePath(varName,local_ns):
+    
+    #
+    # Find the value of a host variable by direct lookup - no code is evaluated. The namespace passed
+    # to the magic is checked first and then the IPython user namespace. Attribute steps stop at a
+    # string or number so that :schema.TABLE still works, and the text that was not used is returned
+    # along with the value. A KeyError is raised if the variable cannot be found.
+    #
+    
+    global _paths
+    
+    path = _paths.get(varName,False)
+    if (path == False):
+        path = compilePath(varName)
+        if (len(_paths) >= _pathsSize): _paths.clear()
+        _paths[varName] = path
+        
+    if (path == None): raise KeyError(varName)
+    
+    name, steps = path
     
-    if (inVar == True):
-        varValue, varType = getContents(varName,True,local_ns) # We assume the end of a line is quoted
-        if (varValue == None):                 
-            encoded_sql = encoded_sql + ":" + varName  
+    if (local_ns != None and name in local_ns):
+        value = local_ns[name]
+    else:
+        user_ns = userNamespace()
+        if (name not in user_ns): raise KeyError(varName)
+        value = user_ns[name]
+        
+    for isAttr, key, offset in steps:
+        if (isAttr == True):
+            if (isinstance(value,(str,int,float)) == True):
+                return value, varName[offset:]
+            try:
+                value = getattr(value,key)
+            except AttributeError:
+                return value, varName[offset:]
         else:
-            if (varType == STRING):
-                encoded_sql = encoded_sql + varValue
-            elif (varType == NUMBER):
-                encoded_sql = encoded_sql + str(varValue)
-            elif (varType == LIST):
-                flag_quotes = True
-                start = True
-                for v in varValue:
-                    if (start == False):
-                        encoded_sql = encoded_sql + ","
-                    if (isinstance(v,int) == True):         # Integer value 
-                        encoded_sql = encoded_sql + str(v)
-                    elif (isinstance(v,float) == True):
-                        encoded_sql = encoded_sql + str(v)
-                    else:
-                        try:
-                            if (v.find('0x') == 0):               # Just guessing this is a hex value
-                                encoded_sql = encoded_sql + v
-                            else:
-                                encoded_sql = encoded_sql + addquotes(v,flag_quotes)              # String
-                        except:
-                            encoded_sql = encoded_sql + addquotes(str(v),flag_quotes)                                 
-                    start = False
+            try:
+                value = value[key]
+            except (LookupError,TypeError):
+                raise KeyError(varName)
+            
+    return value, ""
 
-    return sql_cmd, encoded_sql
+def resolveVariable(varName,local_ns):
+    
+    # Return the value of a host variable where the entire path must be used
+    
+    value, rest = resolvePath(varName,local_ns)
+    if (rest != ""): raise KeyError(varName)
+    
+    return value
 
 def getContents(varName,flag_quotes,local_ns):
     
     #
-    # Get the contents of the variable name that is passed to the routine. Only simple
-    # variables are checked, i.e. arrays and lists are not parsed
+    # Get the contents of the variable name that is passed to the routine. None is returned
+    # if the variable cannot be found.
+    #
+    
+    try:
+        value = resolveVariable(varName,local_ns)
+    except KeyError:
+        return(None,0)
+    
+    return formatContents(value,flag_quotes)
+
+def formatContents(value,flag_quotes):
+    
+    #
+    # Format a value for the SQL statement and return it along with its type
     #
     
     STRING = 0
@@ -1415,11 +2750,6 @@ def getContents(varName,flag_quotes,local_ns):
     RAW = 3
     DICT = 4
     
-    try:
-        value = eval(varName,None,local_ns) # globals()[varName] # eval(varName)
-    except:
-        return(None,STRING)
-    
     if (isinstance(value,dict) == True):          # Check to see if this is JSON dictionary
         return(addquotes(value,flag_quotes),STRING)
 
@@ -1469,9 +2799,7 @@ def checkOption(args_in, option, vFalse=False, vTrue=True):
     return args_out, found
 
 
-def findProc(procname):
-    
-    global _hdbc, _hdbi, _connected, _runtime
+def findProc(ctx, procname):
     
     # Split the procedure name into schema.procname if appropriate
     upper_procname = procname.upper()
@@ -1483,7 +2811,7 @@ def findProc(procname):
     schema = "%"
 
     try:
-        stmt = ibm_db.procedures(_hdbc, None, schema, proc) 
+        stmt = ibm_db.procedures(ctx.hdbc, None, schema, proc) 
         if (stmt == False):                         # Error executing the code
             errormsg("Procedure " + procname + " not found in the system catalog.")
             return None
@@ -1515,21 +2843,19 @@ def getColumns(stmt):
                 
     except Exception as err:
         db2_error(False)
-        return None
+        return None, None
 
-def parseCall(hdbc, inSQL, local_ns):
+def parseCall(ctx, inSQL):
     
-    global _hdbc, _hdbi, _connected, _runtime, _environment
+    global _environment
  
     # Check to see if we are connected first
-    if (_connected == False):                                      # Check if you are connected 
-        db2_doConnect()
-        if _connected == False: return None
+    if (ctx.connect() == False): return None
     
     remainder = inSQL.strip()
     procName, procArgs = parseCallArgs(remainder[5:]) # Assume that CALL ... is the format
 
-    resultsets = findProc(procName)
+    resultsets = findProc(ctx, procName)
     if (resultsets == None): return None
     
     argvalues = []
@@ -1540,8 +2866,9 @@ def parseCall(hdbc, inSQL, local_ns):
             if (len(varname) > 0):
                 if (varname[0] == ":"):
                     checkvar = varname[1:]
-                    varvalue = getContents(checkvar,True,local_ns)
-                    if (varvalue == None):
+                    try:
+                        varvalue = resolveVariable(checkvar,ctx.local_ns)
+                    except KeyError:
                         errormsg("Variable " + checkvar + " is not defined.")
                         return None
                     argvalues.append(varvalue)
@@ -1560,11 +2887,13 @@ def parseCall(hdbc, inSQL, local_ns):
 
         if (len(procArgs) > 0):
             argtuple = tuple(argvalues)
-            result = ibm_db.callproc(_hdbc,procName,argtuple)
+            result = ibm_db.callproc(ctx.hdbc,procName,argtuple)
             stmt = result[0]
         else:
-            result = ibm_db.callproc(_hdbc,procName)
+            result = ibm_db.callproc(ctx.hdbc,procName)
             stmt = result
+            
+        cacheInvalidate(ctx)                            # The procedure may have changed the saved results
         
         if (resultsets == 1 and stmt != None):
 
@@ -1574,25 +2903,11 @@ def parseCall(hdbc, inSQL, local_ns):
             rows = []
             rowlist = ibm_db.fetch_tuple(stmt)
             while ( rowlist ) :
-                row = []
-                colcount = 0
-                for col in rowlist:
-                    try:
-                        if (types[colcount] in ["int","bigint"]):
-                            row.append(int(col))
-                        elif (types[colcount] in ["decimal","real"]):
-                            row.append(float(col))
-                        elif (types[colcount] in ["date","time","timestamp"]):
-                            row.append(str(col))
-                        else:
-                            row.append(col)
-                    except:
-                        row.append(col)
-                    colcount += 1
-                rows.append(row)
+                rows.append(rowlist)
                 rowlist = ibm_db.fetch_tuple(stmt)
+            rows = convertColumns(rows, columnConverters(ctx, types, getScales(stmt, types)))
             
-            if flag(["-r","-array"]):
+            if ctx.flag(["-r","-array"]):
                 rows.insert(0,columns)
                 if len(procArgs) > 0:
                     allresults = []
@@ -1603,9 +2918,9 @@ def parseCall(hdbc, inSQL, local_ns):
                 else:
                     return rows
             else:
-                df = pandas.DataFrame.from_records(rows,columns=columns)
-                if flag("-grid") or _settings['display'] == 'GRID':
-                    if (_environment['qgrid'] == False):
+                df = temporalFrame(ctx, pandas.DataFrame.from_records(rows,columns=columns), types)
+                if ctx.flag("-grid") or ctx.settings['display'] == 'GRID':
+                    if (gridAvailable() == False):
                         with pandas.option_context('display.max_rows', None, 'display.max_columns', None):  
                             pdisplay(df)
                     else:
@@ -1616,7 +2931,7 @@ def parseCall(hdbc, inSQL, local_ns):
                             
                     return                             
                 else:
-                    if flag(["-a","-all"]) or _settings["maxrows"] == -1 : # All of the rows
+                    if ctx.flag(["-a","-all"]) or ctx.settings["maxrows"] == -1 : # All of the rows
                         with pandas.option_context('display.max_rows', None, 'display.max_columns', None): 
                             pdisplay(df)
                     else:
@@ -1632,14 +2947,11 @@ def parseCall(hdbc, inSQL, local_ns):
                 return None
             
     except Exception as err:
-        db2_error(False)
+        db2_error(False,ctx=ctx)
         return None
 
-def parsePExec(hdbc, inSQL):
+def parsePExec(ctx, inSQL):
      
-    import ibm_db    
-    global _stmt, _stmtID, _stmtSQL, sqlcode
-    
     cParms = inSQL.split()
     parmCount = len(cParms)
     if (parmCount == 0): return(None)                          # Nothing to do but this shouldn't happen
@@ -1661,52 +2973,50 @@ def parsePExec(hdbc, inSQL):
                 sql = sql.replace(found,markers)
                 findparm = re.search(pattern,sql)
             
-            stmt = ibm_db.prepare(hdbc,sql) # Check error code here
+            recordStart("prepare", sql)
+            stmt = ibm_db.prepare(ctx.hdbc,sql) # Check error code here
             if (stmt == False): 
-                db2_error(False)
+                db2_error(False,ctx=ctx)
                 return(False)
             
             stmttext = str(stmt).strip()
             stmtID = stmttext[33:48].strip()
             
-            if (stmtID in _stmtID) == False:
-                _stmt.append(stmt)              # Prepare and return STMT to caller
-                _stmtID.append(stmtID)
-            else:
-                stmtIX = _stmtID.index(stmtID)
-                _stmt[stmtiX] = stmt
+            if (ctx.recorded != None):                           # Replays map EXECUTE to this ID
+                ctx.recorded["stmtid"] = stmtID
+            
+            ctx.addStatement(stmtID, stmt, sql)    # Prepare and return STMT to caller
                  
             return(stmtID)
         
         except Exception as err:
-            print(err)
-            db2_error(False)
+            errormsg(str(err))
+            db2_error(True,ctx=ctx)
             return(False)
 
     if (keyword == "EXECUTE"):                                  # Execute the prepare statement
         if (parmCount < 2): return(False)                    # No stmtID available
         
         stmtID = cParms[1].strip()
-        if (stmtID in _stmtID) == False:
+        stmt = ctx.findStatement(stmtID)
+        if (stmt == None):
             errormsg("Prepared statement not found or invalid.")
             return(False)
 
-        stmtIX = _stmtID.index(stmtID)
-        stmt = _stmt[stmtIX]
-
         try:        
 
             if (parmCount == 2):                           # Only the statement handle available
+                recordStart("execute", None, None, stmtID)
                 result = ibm_db.execute(stmt)               # Run it
             elif (parmCount == 3):                          # Not quite enough arguments
                 errormsg("Missing or invalid USING clause on EXECUTE statement.")
-                sqlcode = -99999
+                ctx.sqlcode = -99999
                 return(False)
             else:
                 using = cParms[2].upper()
                 if (using != "USING"):                     # Bad syntax again
                     errormsg("Missing USING clause on EXECUTE statement.")
-                    sqlcode = -99999
+                    ctx.sqlcode = -99999
                     return(False)
                 
                 uSQL = inSQL.upper()
@@ -1716,10 +3026,11 @@ def parsePExec(hdbc, inSQL):
  
                 if (len(parmset) == 0):
                     errormsg("Missing parameters after the USING clause.")
-                    sqlcode = -99999
+                    ctx.sqlcode = -99999
                     return(False)
                     
                 parms = []
+                bound = []                                  # Values bound to the markers (for recording)
 
                 parm_count = 0
                 
@@ -1761,10 +3072,12 @@ def parsePExec(hdbc, inSQL):
                         parm_datatype = "char"
 
                         # Does the variable exist?
-                        if (parm_name not in globals()):
+                        try:
+                            parm_value = resolveVariable(parm_name,ctx.local_ns)
+                        except KeyError:
                             errormsg("SQL Execute parameter " + parm_name + " not found")
-                            sqlcode = -99999
-                            return(false)                        
+                            ctx.sqlcode = -99999
+                            return(False)                        
         
                         if (len(varset) > 1):                # Type provided
                             parm_datatype = varset[1]
@@ -1780,39 +3093,188 @@ def parsePExec(hdbc, inSQL):
                     
                     try:
                         if (parm_type == VARIABLE):
-                            result = ibm_db.bind_param(stmt, parm_count, globals()[parm_name], ibm_db.SQL_PARAM_INPUT, sql_type)
+                            bound.append(parm_value)
+                            result = ibm_db.bind_param(stmt, parm_count, parm_value, ibm_db.SQL_PARAM_INPUT, sql_type)
                         else:
+                            bound.append(const[const_cnt])
                             result = ibm_db.bind_param(stmt, parm_count, const[const_cnt], ibm_db.SQL_PARAM_INPUT, sql_type)
                             
                     except:
                         result = False
                         
                     if (result == False):
-                        errormsg("SQL Bind on variable " + parm_name + " failed.")
-                        sqlcode = -99999
-                        return(false) 
+                        errormsg("SQL Bind on parameter " + str(parm_count) + " failed.")
+                        ctx.sqlcode = -99999
+                        return(False) 
                     
+                recordStart("execute", None, bound, stmtID)
                 result = ibm_db.execute(stmt) # ,tuple(parms))
                 
             if (result == False): 
                 errormsg("SQL Execute failed.")      
                 return(False)
             
-            if (ibm_db.num_fields(stmt) == 0): return(True) # Command successfully completed
+            if (ibm_db.num_fields(stmt) == 0):              # Command successfully completed
+                cacheInvalidate(ctx)
+                return(True)
                           
-            return(fetchResults(stmt))
+            return(fetchResults(stmt,ctx))
                         
         except Exception as err:
-            db2_error(False)
+            db2_error(False,ctx=ctx)
             return(False)
         
         return(False)
   
     return(False)     
 
-def fetchResults(stmt):
+# Column conversions
+#
+# Values are converted a column at a time with one function per column. DECIMAL values are FLOAT 
+# (the default), EXACT (decimal.Decimal) or SCALED (an integer holding the value times 10**scale, so 
+# 12.34 in a DECIMAL(9,2) column is 1234). Dates and times are STRING (the default) or NATIVE, which 
+# keeps the datetime values from the driver and gives datetime64 columns in a DataFrame. DataFrame
+# columns are converted as a whole with pandas.to_numeric and pandas.to_datetime, and SCALED columns 
+# are computed with numpy (scaledColumn) for both DataFrames and rows.
+
+def typeModes(ctx):
+    
+    decimalMode = ctx.flagValues.get("-decimal",ctx.settings.get("decimal","FLOAT")).upper()
+    temporalMode = ctx.flagValues.get("-temporal",ctx.settings.get("temporal","STRING")).upper()
+    
+    if (decimalMode not in _decimalModes): decimalMode = "FLOAT"
+    if (temporalMode not in _temporalModes): temporalMode = "STRING"
+    
+    return decimalMode, temporalMode
+
+def exactTypes(ctx):
+    
+    # True when the DataFrame for a query has to be built from the rows instead of with read_sql
+    
+    return typeModes(ctx) != ("FLOAT","STRING")
+
+def getScales(stmt, types):
+    
+    scales = []
+    for i in range(len(types)):
+        scale = ibm_db.field_scale(stmt,i) if types[i] == "decimal" else 0
+        scales.append(scale if scale else 0)
+        
+    return scales
+
+def toDecimal(value):
+    
+    return decimal.Decimal(str(value) if isinstance(value, float) else value)
+
+def toScaled(scale):
+    
+    convert = lambda value: int(toDecimal(value).scaleb(scale))
+    convert.scale = scale                                        # convertColumns uses scaledColumn instead
+    
+    return convert
+
+def columnConverters(ctx, types, scales):
+    
+    # The function that converts the values of each column, None for values that are used as they are
+    
+    decimalMode, temporalMode = typeModes(ctx)
+    
+    converters = []
+    for i in range(len(types)):
+        if (types[i] in ["int","bigint"]):
+            converters.append(int)
+        elif (types[i] == "real"):
+            converters.append(float)
+        elif (types[i] == "decimal"):
+            if (decimalMode == "EXACT"):
+                converters.append(toDecimal)
+            elif (decimalMode == "SCALED"):
+                converters.append(toScaled(scales[i]))
+            else:
+                converters.append(float)
+        elif (types[i] in ["date","time","timestamp"]):
+            converters.append(str if temporalMode == "STRING" else None)
+        else:
+            converters.append(None)
+            
+    return converters
+
+def convertColumns(rows, converters):
+    
+    # Convert a list of row tuples column by column. Values that cannot be converted are left as they are.
+    
+    if (len(rows) == 0): return []
+    
+    columns = list(zip(*rows))
+    for i in range(len(columns)):
+        convert = converters[i] if i < len(converters) else None
+        if (convert == None): continue
+        try:
+            scale = getattr(convert, "scale", None)         # SCALED DECIMAL columns are done by numpy
+            scaled = scaledColumn(columns[i], scale) if (scale != None) else None
+            if (scaled != None):
+                values = scaled[0].astype(object)
+                values[scaled[1]] = None
+                columns[i] = values.tolist()
+            else:
+                columns[i] = [None if value is None else convert(value) for value in columns[i]]
+        except Exception as err:
+            converted = []
+            for value in columns[i]:
+                try:
+                    converted.append(None if value is None else convert(value))
+                except:
+                    converted.append(value)
+            columns[i] = converted
+            
+    return [list(row) for row in zip(*columns)]
+
+def scaledColumn(values, scale):
+    
+    #
+    # A SCALED DECIMAL column computed for the whole column with numpy. Returns an int64 array and a 
+    # mask of the nulls. A double holds every integer below 2**53 exactly, so rounding value * 10**scale
+    # gives the exact result while the scaled values stay well below that. None is returned for columns
+    # with larger values (or NaN and Infinity), which are converted one value at a time with Decimal.
+    #
+    
+    array = numpy.array(values, dtype=object)
+    missing = pandas.isna(array)
+    if (missing.any()): array[missing] = 0
+    
+    scaled = array.astype("float64") * (10.0 ** scale)
+    if ((numpy.abs(scaled) < 2.0 ** 50).all() == False): return None
+    
+    return numpy.rint(scaled).astype("int64"), missing
+
+def temporalFrame(ctx, df, types):
+    
+    # NATIVE dates and timestamps become datetime64 columns
+    
+    if (typeModes(ctx)[1] == "NATIVE"):
+        for i in range(min(len(types),len(df.columns))):
+            if (types[i] in ["date","timestamp"]):
+                try:
+                    df.isetitem(i, pandas.to_datetime(df.iloc[:,i]))
+                except Exception as err:
+                    pass
+                
+    return df
+
+def fetchJSON(stmt):
+    
+    # The first column of every row parsed as a JSON document (-j)
+    
+    json_results = []
+    while( ibm_db.fetch_row(stmt) ):
+        jsonVal = ibm_db.result(stmt,0)
+        json_results.append(json.loads(jsonVal))
+        
+    return json_results
+
+def fetchResults(stmt,ctx=None):
      
-    global sqlcode
+    if (ctx == None): ctx = currentContext()
     
     rows = []
     columns, types = getColumns(stmt)
@@ -1821,9 +3283,9 @@ def fetchResults(stmt):
     is_array = True
     
     # Check what type of data we want returned - array or json
-    if (flag(["-r","-array"]) == False):
+    if (ctx.flag(["-r","-array"]) == False):
         # See if we want it in JSON format, if not it remains as an array
-        if (flag("-json") == True):
+        if (ctx.flag("-json") == True):
             is_array = False
     
     # Set column names to lowercase for JSON records
@@ -1834,65 +3296,1520 @@ def fetchResults(stmt):
     if (is_array == True):
         rows.append(columns)
         
+    results = []
     result = ibm_db.fetch_tuple(stmt)
-    rowcount = 0
     while (result):
+        results.append(result)
+        result = ibm_db.fetch_tuple(stmt)
+        
+    rowcount = len(results)
+    results = convertColumns(results, columnConverters(ctx, types, getScales(stmt, types)))
+    
+    if (is_array == True):
+        rows.extend(results)
+    else:
+        rows.extend([dict(zip(columns,row)) for row in results])
         
-        rowcount += 1
+    if (rowcount == 0): 
+        ctx.sqlcode = 100        
+    else:
+        ctx.sqlcode = 0
         
-        if (is_array == True):
-            row = []
-        else:
-            row = {}
+    return rows
             
-        colcount = 0
-        for col in result:
-            try:
-                if (types[colcount] in ["int","bigint"]):
-                    if (is_array == True):
-                        row.append(int(col))
-                    else:
-                        row[columns[colcount]] = int(col)
-                elif (types[colcount] in ["decimal","real"]):
-                    if (is_array == True):
-                        row.append(float(col))
-                    else:
-                        row[columns[colcount]] = float(col)
-                elif (types[colcount] in ["date","time","timestamp"]):
-                    if (is_array == True):
-                        row.append(str(col))
-                    else:
-                        row[columns[colcount]] = str(col)
-                else:
-                    if (is_array == True):
-                        row.append(col)
-                    else:
-                        row[columns[colcount]] = col
-                        
-            except:
-                if (is_array == True):
-                    row.append(col)
-                else:
-                    row[columns[colcount]] = col
+
+# Fetching with driver block fetch
+#
+# When a FETCHSIZE or PREFETCH option is in effect, result sets are read directly with ibm_db so that
+# the statement attributes can be set: SQL_ATTR_BLOCK_FOR_NROWS is the number of rows the driver asks
+# for in one network request and SQL_ATTR_ROWCOUNT_PREFETCH returns the row count ahead of the data.
+# With versions of ibm_db that do not have SQL_ATTR_BLOCK_FOR_NROWS, OPTION FETCHSIZE is refused and
+# nothing is tuned. Only queries that do not change anything are tuned (tunable), since tuning runs 
+# the statement once for every size in _fetchSizes.
+
+def blockFetch():
+    
+    return hasattr(ibm_db,"SQL_ATTR_BLOCK_FOR_NROWS")
+
+def tunable(sql):
+    
+    # A plain query: no FINAL/NEW/OLD TABLE around a data change and no NEXT VALUE FOR a sequence
+    
+    return _tuneSelect.match(sql) != None and _tuneUnsafe.search(_chunkQuotes.sub(" ",sql)) == None
+
+def fingerprint(sql):
+    
+    # Statements that only differ in their constants or spacing share a fingerprint
+    
+    def normalize(found):
+        return " " if found.group(0).isspace() else "?"
+    
+    text = _fingerprintScan.sub(normalize, sql.strip()).upper()
+    
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def fetchTuning():
+    
+    global _fetchTuning
+    
+    if (_fetchTuning == None):
+        try:
+            with open("db2fetch.pickle",'rb') as f:
+                _fetchTuning = pickle.load(f)
+        except:
+            _fetchTuning = {}
+            
+    return _fetchTuning
+
+def saveFetchTuning():
+    
+    try:
+        with open("db2fetch.pickle",'wb') as f:
+            pickle.dump(_fetchTuning,f)
+    except:
+        errormsg("Failed trying to write the fetch size tuning information.")
+
+def fetchOptions(ctx, sql, fetchsize=None):
+    
+    #
+    # The statement attributes to use for a query. None is returned when the driver defaults apply.
+    # With FETCHSIZE AUTO the size that was found to be the fastest for the statement is used and a 
+    # statement that has not been seen before is tuned first.
+    #
+    
+    if (fetchsize == None):
+        fetchsize = ctx.settings.get("fetchsize",0)
+        if (fetchsize == "AUTO" or ctx.flag("-autotune")):
+            fetchsize = fetchTuning().get(fingerprint(sql))
+            if (fetchsize == None or ctx.flag("-autotune")):
+                fetchsize = autotuneFetch(ctx, sql)
+            
+    options = {}
+    if (fetchsize != None and fetchsize > 0 and blockFetch()):
+        options[ibm_db.SQL_ATTR_BLOCK_FOR_NROWS] = fetchsize
+    if (ctx.settings.get("prefetch",False) == True):
+        options[ibm_db.SQL_ATTR_ROWCOUNT_PREFETCH] = ibm_db.SQL_ROWCOUNT_PREFETCH_ON
+        
+    if (len(options) == 0): return None
+    
+    return options
+
+def autotuneFetch(ctx, sql):
+    
+    #
+    # Run the query with each of the fetch sizes in _fetchSizes (reading at most _fetchTuneRows rows)
+    # and remember the size that gave the most rows per second. Returns None if the query fails.
+    #
+    
+    timings = []
+    
+    if (blockFetch() == False):
+        if ctx.flag("-autotune") and ctx.flag(["-q","-quiet"]) == False:
+            errormsg("This version of ibm_db cannot set the fetch size, so it cannot be tuned.")
+        return None
+    
+    if (tunable(sql) == False):                               # Running it again would change data
+        if ctx.flag("-autotune") and ctx.flag(["-q","-quiet"]) == False:
+            errormsg("Only a query that does not change data or use a sequence can be tuned.")
+        return None
+    
+    try:
+        stmt = ibm_db.prepare(ctx.hdbc, sql)                  # Compile once before timing anything
+        if (stmt == False or ibm_db.execute(stmt) == False): return None
+        ibm_db.fetch_tuple(stmt)
+        ibm_db.free_result(stmt)
+        
+        for fetchsize in _fetchSizes:
+            start = time.time()
+            stmt = ibm_db.prepare(ctx.hdbc, sql, {ibm_db.SQL_ATTR_BLOCK_FOR_NROWS : fetchsize})
+            if (stmt == False or ibm_db.execute(stmt) == False): return None
+            rows = 0
+            while (rows < _fetchTuneRows and ibm_db.fetch_tuple(stmt)): 
+                rows += 1
+            ibm_db.free_result(stmt)
+            elapsed = max(time.time() - start, 1e-9)
+            timings.append((rows / elapsed, fetchsize))
+            
+    except Exception as err:
+        return None
+    
+    rate, best = max(timings)
+    
+    tuning = fetchTuning()
+    tuning[fingerprint(sql)] = best
+    saveFetchTuning()
+    
+    if (ctx.flag(["-q","-quiet"]) == False):
+        success("Fetch size " + str(best) + " is the fastest for this statement (" + 
+                ", ".join(["%d: %.0f rows/s" % (size, r) for r, size in sorted(timings, key=lambda t: t[1])]) + ")")
+    
+    return best
+
+def fetchBatches(stmt, batchsize):
+    
+    # Read the rows of an executed statement in lists of batchsize rows
+    
+    batch = []
+    row = ibm_db.fetch_tuple(stmt)
+    while (row):
+        batch.append(row)
+        if (len(batch) >= batchsize):
+            yield batch
+            batch = []
+        row = ibm_db.fetch_tuple(stmt)
+        
+    if (len(batch) > 0): yield batch
+
+def fetchFrame(ctx, sql, options):
+    
+    # Run a query with the statement attributes in options and return the answer set as a DataFrame
+    
+    stmt = ibm_db.prepare(ctx.hdbc, sql, options)
+    if (stmt == False or ibm_db.execute(stmt) == False):
+        raise Exception("Unable to run the statement")
+    
+    columns, types = getColumns(stmt)
+    batchsize = 1024
+    if blockFetch():
+        batchsize = options.get(ibm_db.SQL_ATTR_BLOCK_FOR_NROWS,1024)
+    
+    rows = []
+    for batch in fetchBatches(stmt, batchsize):
+        rows.extend(batch)
+        
+    return frameRows(ctx, rows, columns, types, getScales(stmt, types))
+
+def frameRows(ctx, rows, columns, types, scales, index=None):
+    
+    # Turn rows from fetch_tuple into a DataFrame, converting the DECIMAL and temporal columns as a whole
+    
+    decimalMode, temporalMode = typeModes(ctx)
+    
+    df = pandas.DataFrame.from_records(rows, columns=columns, index=index)
+    
+    for i in range(len(columns)):
+        try:
+            if (types[i] == "real" or (types[i] == "decimal" and decimalMode == "FLOAT")):
+                df.isetitem(i, pandas.to_numeric(df.iloc[:,i]))
+            elif (types[i] == "decimal" and decimalMode == "EXACT"):
+                df.isetitem(i, df.iloc[:,i].map(toDecimal, na_action="ignore"))
+            elif (types[i] == "decimal" and decimalMode == "SCALED"):
+                scaled = scaledColumn(df.iloc[:,i].to_numpy(dtype=object), scales[i])
+                if (scaled != None):
+                    df.isetitem(i, pandas.arrays.IntegerArray(scaled[0], scaled[1]))
+                else:                                       # Not through map, which makes large values floats
+                    convert = toScaled(scales[i])
+                    values = [None if pandas.isna(value) else convert(value) for value in df.iloc[:,i].to_numpy(dtype=object)]
+                    try:
+                        df.isetitem(i, pandas.array(values, dtype="Int64"))
+                    except OverflowError:                   # Beyond int64, kept as Python integers
+                        df.isetitem(i, pandas.Series(values, index=df.index, dtype=object))
+        except Exception as err:
+            pass
+        
+    if (decimalMode == "SCALED"):
+        df.attrs["scale"] = {columns[i] : scales[i] for i in range(len(columns)) if types[i] == "decimal"}
+            
+    return temporalFrame(ctx, df, types)
+
+def columnInfo(stmt):
+    
+    # Name, type, precision and scale of each column of a prepared statement
+    
+    info = []
+    try:
+        for i in range(ibm_db.num_fields(stmt)):
+            info.append((ibm_db.field_name(stmt,i), ibm_db.field_type(stmt,i), 
+                         ibm_db.field_precision(stmt,i), ibm_db.field_scale(stmt,i)))
+    except Exception as err:
+        pass
+    
+    return info
+
+def formatBytes(size):
+    
+    for unit in ["bytes","KB","MB","GB"]:
+        if (size < 1024 or unit == "GB"): break
+        size = size / 1024.0
+        
+    return ("%d " % size if unit == "bytes" else "%.1f " % size) + unit
+    
+def compactFrame(ctx, df, stmt=None):
+    
+    #
+    # -compact or OPTION COMPACT ON. Reduce the memory used by a DataFrame:
+    #   - CHAR columns (every value is as long as the column) have the trailing blanks removed
+    #   - Strings with few distinct values become categoricals
+    #   - SMALLINT and INTEGER columns use int16 and int32 (Int16/Int32 when there are nulls), or a larger
+    #     type when the values do not fit
+    # The column types come from the prepared statement when it is available.
+    #
+    
+    before = int(df.memory_usage(deep=True).sum())
+    info = columnInfo(stmt) if stmt != None else []
+    
+    for i in range(len(df.columns)):
+        column = df.iloc[:,i]
+        coltype, precision = (info[i][1], info[i][2]) if i < len(info) else (None, 0)
+        
+        try:
+            if (coltype == "int" or pandas.api.types.is_integer_dtype(column)):
+                if (coltype != "int"):
+                    column = pandas.to_numeric(column, downcast="integer")
+                else:                                     # The smallest type the values fit in
+                    dtypes = ["int16","int32","int64"] if precision <= 5 else ["int32","int64"]
+                    low, high = column.min(), column.max()
+                    while (len(dtypes) > 1 and pandas.notna(low) and 
+                           (low < numpy.iinfo(dtypes[0]).min or high > numpy.iinfo(dtypes[0]).max)):
+                        dtypes.pop(0)
+                    dtype = dtypes[0]
+                    if (column.isnull().any()): dtype = dtype.capitalize()
+                    column = column.astype(dtype)
                     
-            colcount += 1
+            elif (pandas.api.types.is_string_dtype(column) and pandas.api.types.infer_dtype(column, skipna=True) == "string"):
+                values = column.dropna()
+                if (precision and len(values) > 0 and (values.str.len() == precision).all()):
+                    column = column.str.rstrip(" ")
+                if (column.nunique() <= len(column) * _compactRatio):
+                    column = column.astype("category")
+                    
+        except Exception as err:
+            continue                                          # Leave the column as it was
         
-        rows.append(row)
-        result = ibm_db.fetch_tuple(stmt)
+        df.isetitem(i, column)
         
-    if (rowcount == 0): 
-        sqlcode = 100        
+    after = int(df.memory_usage(deep=True).sum())
+    df.attrs["compact"] = {"before": before, "after": after}
+    
+    if (ctx.flag(["-q","-quiet"]) == False and before > 0):
+        success("Result compacted from " + formatBytes(before) + " to " + formatBytes(after) + 
+                " (" + str(int(round(100.0 * (before - after) / before))) + "% saved)")
+        
+    return df
+
+class PagedResult(object):
+    
+    #
+    # The answer set of a -page query. The statement stays open on a scrollable cursor and only the 
+    # rows that are asked for are fetched: result[1000:1100] or result.page(10) read one window of rows
+    # and len(result) runs a COUNT(*) of the query the first time it is needed (only slices with a 
+    # negative or open end, or a step, count the rows so they can be resolved like a list, and a slice
+    # with a step only reads the pages its rows are on, in either direction). The last _pageCacheSize
+    # pages that were read are kept so that moving back and forth does not go to the server again. 
+    # close() (or leaving a with block, or dropping the result) frees the cursor.
+    #
+    
+    def __init__(self, ctx, sql, pagesize=None):
+        
+        self.ctx = ctx
+        self.hdbc = ctx.hdbc
+        self.sql = sql
+        self.pagesize = pagesize if pagesize != None else ctx.settings.get("pagesize",100)
+        self.pages = {}
+        self.rows = None
+        
+        self.stmt = ibm_db.prepare(self.hdbc, sql, {ibm_db.SQL_ATTR_CURSOR_TYPE : ibm_db.SQL_CURSOR_KEYSET_DRIVEN})
+        if (self.stmt == False or ibm_db.execute(self.stmt) == False):
+            raise Exception("Unable to open a cursor for the statement")
+        
+        self.columns, self.types = getColumns(self.stmt)
+        self.scales = getScales(self.stmt, self.types)
+        
+    def __len__(self):
+        
+        if (self.rows == None):
+            count = ibm_db.exec_immediate(self.hdbc, "SELECT COUNT(*) FROM (" + self.sql + ") AS PAGED")
+            if (count == False):
+                raise Exception("Unable to count the rows in the answer set")
+            self.rows = int(ibm_db.fetch_tuple(count)[0])
+            ibm_db.free_result(count)
+            
+        return self.rows
+    
+    def fetchPage(self, n):
+        
+        # Rows of page n (starting at 0), from the cache when the page was read recently
+        
+        if (n in self.pages):
+            rows = self.pages.pop(n)
+            self.pages[n] = rows                                  # Most recently used goes last
+            return rows
+        
+        rows = []
+        if (self.rows == None or n * self.pagesize < self.rows):
+            row = ibm_db.fetch_tuple(self.stmt, n * self.pagesize + 1)
+            while (row):
+                rows.append(row)
+                if (len(rows) == self.pagesize): break
+                row = ibm_db.fetch_tuple(self.stmt)
+                
+            if (len(rows) < self.pagesize and (len(rows) > 0 or n == 0)):
+                self.rows = n * self.pagesize + len(rows)         # Found the end of the answer set
+        
+        self.pages[n] = rows
+        if (len(self.pages) > _pageCacheSize):
+            del self.pages[next(iter(self.pages))]
+            
+        return rows
+    
+    def window(self, start, stop):
+        
+        # DataFrame of rows start to stop - 1
+        
+        rows = []
+        if (stop > start):
+            first = start // self.pagesize
+            for n in range(first, (stop - 1) // self.pagesize + 1):
+                page = self.fetchPage(n)
+                rows.extend(page)
+                if (len(page) < self.pagesize): break
+            rows = rows[start - first * self.pagesize : stop - first * self.pagesize]
+            
+        return frameRows(self.ctx, rows, self.columns, self.types, self.scales, index=range(start, start + len(rows)))
+    
+    def page(self, n):
+        
+        return self.window(n * self.pagesize, (n + 1) * self.pagesize)
+    
+    def select(self, positions):
+        
+        # DataFrame of the rows at the positions (in that order), reading only the pages they are on
+        
+        rows = []
+        index = []
+        for position in positions:
+            page = self.fetchPage(position // self.pagesize)
+            offset = position % self.pagesize
+            if (offset < len(page)):
+                rows.append(page[offset])
+                index.append(position)
+                
+        return frameRows(self.ctx, rows, self.columns, self.types, self.scales, index=index)
+    
+    def __getitem__(self, key):
+        
+        if isinstance(key, slice):
+            if (key.step == None or key.step == 1):               # result[1000:1100] needs no COUNT(*)
+                start = 0 if key.start == None else key.start
+                if (start >= 0 and key.stop != None and key.stop >= 0): return self.window(start, key.stop)
+            start, stop, step = key.indices(len(self))
+            if (step == 1): return self.window(start, stop)
+            return self.select(range(start, stop, step))          # Every n-th row or in reverse
+        
+        if (key < 0): key = key + len(self)
+        df = self.window(key, key + 1)
+        if (len(df) == 0): raise IndexError("row " + str(key) + " is outside of the answer set")
+        
+        return df.iloc[0]
+    
+    def __iter__(self):
+        
+        n = 0
+        while True:
+            df = self.page(n)
+            if (len(df) == 0): return
+            for i in range(len(df)): yield df.iloc[i]
+            n += 1
+            
+    def close(self):
+        
+        if (getattr(self, "stmt", None) not in (None, False)):
+            try:
+                ibm_db.free_result(self.stmt)
+            except:
+                pass
+        self.stmt = None
+        self.pages = {}
+        
+    def __enter__(self):
+        
+        return self
+    
+    def __exit__(self, *args):
+        
+        self.close()
+        return False
+    
+    def __del__(self):
+        
+        self.close()
+        
+    def describe(self):
+        
+        first = self.fetchPage(0)
+        if (len(first) == 0):
+            return "No rows found"
+        elif (self.rows != None):
+            return "Rows 1 to " + str(len(first)) + " of " + str(self.rows)
+        else:
+            return "Rows 1 to " + str(len(first)) + " (use len() to count the answer set)"
+    
+    def __repr__(self):
+        
+        return self.page(0).to_string() + "\n" + self.describe()
+    
+    def _repr_html_(self):
+        
+        return self.page(0)._repr_html_() + "<p>" + self.describe() + "</p>"
+
+class GridSource(object):
+    
+    #
+    # Data source for the GRID display of a query. Only the rows in the visible window are fetched, 
+    # together with the next few windows (_gridPrefetch) so that scrolling does not wait on the server.
+    # Sorting and filtering are done by Db2: the query is wrapped in a SELECT with the ORDER BY and 
+    # WHERE clauses and a new cursor is opened. The filter is a condition that is placed in the WHERE
+    # clause as it is typed, so it is checked first (gridFilter) to make sure it cannot end the clause.
+    #
+    
+    def __init__(self, ctx, sql):
+        
+        self.ctx = ctx
+        self.sql = sql
+        self.visible = max(_display["maxVisibleRows"], 5)
+        self.sort = None
+        self.descending = False
+        self.where = ""
+        self.result = PagedResult(ctx, sql, self.visible * _gridPrefetch)
+        self.columns = self.result.columns
+        
+    def query(self, sort, descending, where):
+        
+        if (sort == None and where == ""): return self.sql
+        
+        sql = "SELECT * FROM (" + self.sql + ") AS GRID"
+        if (where != ""):
+            sql = sql + " WHERE " + where
+        if (sort != None):
+            sql = sql + ' ORDER BY "' + sort.replace('"','""') + '"' + (" DESC" if descending else "")
+            
+        return sql
+        
+    def reopen(self, sort=None, descending=False, where=""):
+        
+        # Returns an error message if the new query fails, in which case the old cursor is kept
+        
+        message = gridFilter(where)
+        if (message != None): return message
+        
+        try:
+            result = PagedResult(self.ctx, self.query(sort, descending, where), self.visible * _gridPrefetch)
+        except Exception as err:
+            return ibm_db.stmt_errormsg()
+        
+        self.result.close()
+        self.result = result
+        self.sort, self.descending, self.where = sort, descending, where
+        
+        return None
+        
+    def window(self, start=0):
+        
+        return self.result[start:start + self.visible]
+    
+    def describe(self, start=0):
+        
+        rows = len(self.result)
+        if (rows == 0): return "No rows found"
+        
+        return "Rows " + str(start + 1) + " to " + str(min(start + self.visible, rows)) + " of " + str(rows)
+    
+    def widget(self):
+        
+        import ipywidgets as widgets
+        
+        table = widgets.HTML()
+        status = widgets.Label()
+        position = widgets.IntSlider(value=0, min=0, max=max(len(self.result) - 1, 0), step=1, description="Row", continuous_update=False)
+        sort = widgets.Dropdown(options=[""] + list(self.columns), value="", description="Sort")
+        order = widgets.ToggleButtons(options=["ASC","DESC"], value="ASC")
+        where = widgets.Text(value="", placeholder="WHERE condition", description="Filter", continuous_update=False)
+        
+        def refresh(change=None):
+            table.value = self.window(position.value)._repr_html_()
+            status.value = self.describe(position.value)
+        
+        def requery(change=None):
+            message = self.reopen(sort.value if sort.value != "" else None, order.value == "DESC", where.value.strip())
+            if (message != None):
+                status.value = message
+                return
+            position.max = max(len(self.result) - 1, 0)
+            if (position.value == 0):
+                refresh()
+            else:
+                position.value = 0                                # Triggers a refresh
+                
+        position.observe(refresh, names="value")
+        sort.observe(requery, names="value")
+        order.observe(requery, names="value")
+        where.observe(requery, names="value")
+        refresh()
+        
+        return widgets.VBox([widgets.HBox([sort, order, where]), table, position, status])
+        
+def gridFilter(where):
+    
+    # An error message if the filter of a grid is more than a single condition: another statement, a
+    # comment, a parenthesis that closes the query it is added to, a subquery or a clause of its own
+    
+    text = _gridLiteral.sub(" ", where)
+    if ("'" in text or '"' in text):
+        return "The filter has a string or a quoted name that is not closed."
+    if (";" in text or "--" in text or "/*" in text):
+        return "The filter must be a single condition without a ; or comments."
+    
+    depth = 0
+    for c in text:
+        if (c == "("): depth += 1
+        if (c == ")"): depth -= 1
+        if (depth < 0): break
+    if (depth != 0):
+        return "The parentheses in the filter do not match."
+    
+    found = _gridKeyword.search(text)
+    if (found != None):
+        return "The filter cannot contain " + found.group(1).upper() + ". Use a condition on the columns of the result."
+    
+    return None
+        
+def showGrid(ctx, sql):
+    
+    #
+    # GRID display of a query. Without ipywidgets only the first window of rows is displayed rather
+    # than the entire answer set, with a message that paging is not available.
+    #
+    
+    source = GridSource(ctx, sql)
+    
+    if (widgetsAvailable() == True):
+        pdisplay(source.widget())
+    else:
+        df = source.window(0)
+        if (_environment["jupyter"] == True):
+            pdisplay(df)
+        else:
+            with pandas.option_context('display.max_rows', None, 'display.max_columns', None):
+                print(df.to_string())
+        print(source.describe())
+        if (ctx.flag(["-q","-quiet"]) == False):
+            print("Install the ipywidgets package to page, sort and filter the grid. Use -page to read more of the rows.")
+        source.result.close()
+
+# EXPORT TO file.csv|file.jsonl|file.parquet [OPTIONS name=value ...] SELECT ...
+#
+# The rows are written to the file as they are fetched, one batch at a time, so the answer set is never
+# held in memory. Adding .gz to a CSV or JSON lines file name compresses it (COMPRESSION=gzip adds .gz
+# to the name). Values are converted the same way for both text formats, and DECIMAL values are 
+# written as JSON numbers rather than strings. The options are:
+#   BATCH=n           Rows fetched and written at a time (10000)
+#   ROWGROUP=n        Rows in each Parquet row group (the batch size)
+#   COMPRESSION=name  gzip or none for CSV and JSON lines, snappy, gzip, zstd or none for Parquet
+#   DELIMITER=c       Column delimiter for CSV files (,)
+#   HEADER=ON|OFF     Write the column names as the first line of a CSV file (ON)
+# Parquet files need the pyarrow package. EXPORT TO file OF DEL|IXF ... is the Db2 EXPORT utility and 
+# is run on the server with SYSPROC.ADMIN_CMD.
+
+def parseExport(ctx, inSQL, cell=None):
+    
+    if (ctx.connect() == False):
+        errormsg('A CONNECT statement must be issued before issuing SQL statements.')
+        return
+    
+    ctx.chunk = None
+    inSQL = renderStatement(ctx,inSQL)[1]                        # Large lists are loaded on the connection
+    
+    found = _exportSyntax.match(inSQL)
+    if (found == None):
+        errormsg("EXPORT TO requires a file name followed by the SELECT statement.")
+        return
+    
+    filename = found.group(1).strip("'\"")
+    rest = found.group(2)
+    
+    if (rest.upper().startswith("OF ")):                          # Db2 EXPORT utility
+        return adminCommand(ctx, inSQL.strip())
+    
+    options = {}
+    if (rest.upper().startswith("OPTIONS")):
+        rest = rest[7:]
+        option = _exportOption.match(rest)
+        while (option != None):
+            options[option.group(1).upper()] = option.group(2).strip("'")
+            rest = rest[option.end():]
+            option = _exportOption.match(rest)
+            
+    sql = rest.strip()
+    if (sql == "" and cell != None):                              # %%sql EXPORT TO file with the query in the cell
+        sql = renderStatement(ctx,cell.strip())[1].strip()
+    if (sql == ""):
+        errormsg("No SELECT statement was provided for the EXPORT.")
+        return
+    if (ctx.chunk != None):
+        errormsg("EXPORT cannot be used with a list that is run in chunks. Use OPTION LISTMODE TEMP or INLINE.")
+        return
+    
+    name = filename.lower()
+    compression = options.get("COMPRESSION", "gzip" if name.endswith(".gz") else None)
+    if (name.endswith(".gz")): name = name[:-3]
+    
+    if (name.endswith(".parquet")):
+        exportType = "parquet"
+    elif (name.endswith(".csv")):
+        exportType = "csv"
+    elif (name.endswith(".jsonl") or name.endswith(".json")):
+        exportType = "jsonl"
+    else:
+        errormsg("The EXPORT file name must end in .parquet, .csv or .jsonl (with .gz for compression).")
+        return
+    
+    if (exportType != "parquet" and compression != None):        # The file name says if a text file is compressed
+        compression = compression.lower()
+        if (compression not in ("gzip","none")):
+            errormsg("COMPRESSION must be gzip or none for CSV and JSON lines files.")
+            return
+        if (compression == "gzip" and filename.lower().endswith(".gz") == False): 
+            filename = filename + ".gz"
+        elif (compression == "none" and filename.lower().endswith(".gz")):
+            errormsg("COMPRESSION=none cannot be used with a file name that ends in .gz.")
+            return
+    
+    try:
+        batchsize = int(options.get("BATCH",_exportBatch))
+        rowgroup = int(options.get("ROWGROUP",batchsize))
+    except Exception as err:
+        errormsg("Invalid BATCH or ROWGROUP value provided.")
+        return
+    
+    start = time.time()
+    if ctx.flag("-partitions"):                                   # Partitions are fetched in parallel
+        plan = partitionPlan(ctx, sql)
+        if (plan == None): return
+        stmt = ibm_db.prepare(ctx.hdbc, sql)                      # Only used for the column information
+        if (stmt == False):
+            db2_error(ctx.flag(["-q","-quiet"]),ctx=ctx)
+            return
+        results = []
+        batches = (rows for index, rows in partitionBatches(ctx, sql, plan, batchsize, results))
     else:
-        sqlcode = 0
+        stmt = ibm_db.prepare(ctx.hdbc, sql, fetchOptions(ctx, sql, batchsize))
+        if (stmt == False or ibm_db.execute(stmt) == False):
+            db2_error(ctx.flag(["-q","-quiet"]),ctx=ctx)
+            return
+        batches = fetchBatches(stmt, batchsize)
+    
+    columns, types = getColumns(stmt)
+    scales = getScales(stmt, types)
+    
+    try:
+        if (exportType == "parquet"):
+            rows = exportParquet(ctx, stmt, batches, filename, columns, types, scales, rowgroup, compression)
+        else:
+            rows = exportText(ctx, batches, filename, exportType, columns, types, scales, compression, options)
+        if ctx.flag("-partitions"): partitionErrors(ctx, results)
+    except Exception as err:
+        ibm_db.free_result(stmt)
+        errormsg("EXPORT to " + filename + " failed: " + str(err))
+        return
+    
+    ibm_db.free_result(stmt)
+    if (rows == None): return
+    
+    ctx.sqlcode = 0 if rows > 0 else 100
+    elapsed = max(time.time() - start, 1e-9)
+    if (ctx.flag(["-q","-quiet"]) == False):
+        success("Exported " + str(rows) + " rows to " + filename + " (" + formatBytes(os.path.getsize(filename)) + 
+                ") in " + "%.2f" % elapsed + " seconds, " + "%.0f" % (rows / elapsed) + " rows/s")
         
     return rows
+
+def jsonValue(value):
+    
+    # A converted value as JSON text. Types JSON does not have are written as the text the CSV file has.
+    
+    if (value is None or isinstance(value, (bool,int,float,str))):
+        return json.dumps(value)
+    if (isinstance(value, decimal.Decimal) and value.is_finite()):
+        return str(value)
+    
+    return json.dumps(str(value))
+
+def exportText(ctx, batches, filename, exportType, columns, types, scales, compression, options):
+    
+    converters = columnConverters(ctx, types, scales)
+    keys = [json.dumps(str(column)) + ": " for column in columns]
+    
+    if (compression not in (None,"none","NONE")):
+        f = gzip.open(filename, "wt", newline="", encoding="utf-8")
+    else:
+        f = open(filename, "w", newline="", encoding="utf-8")
+        
+    rows = 0
+    with f:
+        if (exportType == "csv"):
+            writer = csv.writer(f, delimiter=options.get("DELIMITER",","))
+            if (options.get("HEADER","ON").upper() != "OFF"): 
+                writer.writerow(columns)
+        for batch in batches:
+            batch = convertColumns(batch, converters)
+            if (exportType == "csv"):
+                writer.writerows(batch)
+            else:
+                f.writelines(["{" + ", ".join([key + jsonValue(value) for key, value in zip(keys,row)]) + "}\n" for row in batch])
+            rows += len(batch)
             
+    return rows
+
+def exportParquet(ctx, stmt, batches, filename, columns, types, scales, rowgroup, compression):
+    
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        errormsg("The pyarrow package is needed to EXPORT to a Parquet file. Use pip install pyarrow.")
+        return None
+    
+    writer = None
+    rows = 0
+    try:
+        for batch in batches:
+            df = frameRows(ctx, batch, columns, types, scales)
+            if (writer == None):
+                table = pyarrow.Table.from_pandas(df, schema=parquetSchema(pyarrow, stmt, df, types, scales), preserve_index=False)
+                writer = pyarrow.parquet.ParquetWriter(filename, table.schema, compression=compression or "snappy")
+            else:
+                table = pyarrow.Table.from_pandas(df, schema=writer.schema, preserve_index=False)
+            writer.write_table(table, row_group_size=rowgroup)
+            rows += len(batch)
+            
+        if (writer == None):                                      # No rows, write the columns only
+            df = frameRows(ctx, [], columns, types, scales)
+            table = pyarrow.Table.from_pandas(df, preserve_index=False)
+            writer = pyarrow.parquet.ParquetWriter(filename, table.schema, compression=compression or "snappy")
+    finally:
+        if (writer != None): writer.close()
+        
+    return rows
+
+def parquetSchema(pyarrow, stmt, df, types, scales):
+    
+    # The schema from the first batch, with the DECIMAL precision taken from the column rather than the values
+    
+    schema = pyarrow.Schema.from_pandas(df, preserve_index=False)
+    for i in range(len(types)):
+        if (types[i] == "decimal" and pyarrow.types.is_decimal(schema.field(i).type)):
+            precision = ibm_db.field_precision(stmt,i)
+            schema = schema.set(i, schema.field(i).with_type(pyarrow.decimal128(precision, scales[i])))
+            
+    return schema
+
+def adminCommand(ctx, command):
+    
+    # Run a Db2 command such as EXPORT ... OF DEL on the server
+    
+    stmt = ibm_db.prepare(ctx.hdbc, "CALL SYSPROC.ADMIN_CMD(?)")
+    if (stmt == False or ibm_db.execute(stmt, (command,)) == False):
+        db2_error(ctx.flag(["-q","-quiet"]),ctx=ctx)
+        return
+    
+    result = ibm_db.fetch_tuple(stmt)
+    if (ctx.flag(["-q","-quiet"]) == False):
+        if (result):
+            success("Rows exported: " + str(result[0]))
+        else:
+            success("Command completed.")
+            
+    return
+
+# Partitioned queries
+#
+# -partitions n -by column splits a query into n ranges of the column and fetches every range on its own
+# connection at the same time. The split points are spread evenly between the MIN and MAX of a numeric
+# column, or come from NTILE quantiles for other columns (and for numeric ones with -quantiles). 
+# -bounds v1,v2,... supplies the split points instead. The connections are kept in a pool for the next 
+# partitioned query. Since the partitions run on other connections they do not see changes that were 
+# not committed yet, so there is a warning when AUTOCOMMIT is OFF.
+
+def poolAcquire(ctx):
+    
+    # An idle connection to the database of the context, or a new one. The special registers that were
+    # set in the session (SET SCHEMA ...) are set on it as well.
+    
+    key = db2_dsn(ctx.settings)
+    hdbc = None
+    
+    with _poolLock:
+        idle = _pool.get(key, [])
+        while (len(idle) > 0 and hdbc == None):
+            hdbc = idle.pop()
+            try:
+                if (ibm_db.active(hdbc) == False): hdbc = None
+            except:
+                hdbc = None
+                
+    if (hdbc == None):
+        handles = db2_connect(ctx.settings,True)
+        if (handles == None): return None
+        hdbc = handles[0]
+        
+    for sql in list(ctx.session()["registers"].values()):
+        try:
+            ibm_db.exec_immediate(hdbc, sql)
+        except:
+            pass
+        
+    return hdbc
+
+def poolRelease(ctx, hdbc):
+    
+    key = db2_dsn(ctx.settings)
+    
+    with _poolLock:
+        idle = _pool.setdefault(key, [])
+        if (len(idle) < _poolSize):
+            idle.append(hdbc)
+            return
+        
+    try:
+        ibm_db.close(hdbc)
+    except:
+        pass
+
+def partitionPlan(ctx, sql):
+    
+    # A list of (condition, parameters) for the partitions, or None if the partitions cannot be worked out
+    
+    column = ctx.flagValues.get("-by","").strip()
+    if (column == ""):
+        errormsg("The -partitions option needs a column to split the query on (-by column).")
+        return None
+    if (_partitionColumn.match(column) == None):
+        errormsg("The -by value must be the name of a column of the query: " + column)
+        return None
+    
+    try:
+        count = int(ctx.flagValues.get("-partitions","0"))
+    except:
+        count = 0
+    if (count < 1 or count > _partitionMax):
+        errormsg("The number of -partitions must be between 1 and " + str(_partitionMax) + ".")
+        return None
+    
+    if ctx.flag("-bounds"):
+        bounds = [bound.strip().strip("'") for bound in ctx.flagValues.get("-bounds","").split(",") if bound.strip() != ""]
+    else:
+        bounds = partitionBounds(ctx, sql, column, count)
+        if (bounds == None): return None
+        
+    plan = []
+    for i in range(len(bounds) + 1):
+        if (len(bounds) == 0):
+            plan.append(("", ()))
+        elif (i == 0):
+            plan.append((column + " < ? OR " + column + " IS NULL", (bounds[0],)))
+        elif (i == len(bounds)):
+            plan.append((column + " >= ?", (bounds[-1],)))
+        else:
+            plan.append((column + " >= ? AND " + column + " < ?", (bounds[i-1], bounds[i])))
+            
+    return plan
+
+def partitionBounds(ctx, sql, column, count):
+    
+    if (count == 1): return []
+    
+    try:
+        if (ctx.flag("-quantiles") == False):
+            stmt = ibm_db.exec_immediate(ctx.hdbc, "SELECT MIN(" + column + "), MAX(" + column + ") FROM (" + sql + ") AS PART")
+            if (stmt == False):
+                db2_error(ctx.flag(["-q","-quiet"]),ctx=ctx)
+                return None
+            low, high = ibm_db.fetch_tuple(stmt)
+            if (low == None): return []                              # No rows
+            if isinstance(low, (int, float, decimal.Decimal)) and isinstance(high, (int, float, decimal.Decimal)):
+                bounds = []
+                for i in range(1, count):
+                    if isinstance(low, int) and isinstance(high, int):
+                        bound = low + (high - low) * i // count
+                    else:
+                        bound = low + (high - low) * i / count
+                    if (bound > low and (len(bounds) == 0 or bound > bounds[-1])): bounds.append(bound)
+                return bounds
+            
+        stmt = ibm_db.exec_immediate(ctx.hdbc, 
+            "SELECT MIN(" + column + ") FROM (SELECT " + column + ", NTILE(" + str(count) + ") OVER (ORDER BY " + column + ") AS TILE " +
+            "FROM (" + sql + ") AS PART WHERE " + column + " IS NOT NULL) AS TILES GROUP BY TILE ORDER BY TILE")
+        if (stmt == False):
+            db2_error(ctx.flag(["-q","-quiet"]),ctx=ctx)
+            return None
+        bounds = []
+        row = ibm_db.fetch_tuple(stmt)
+        while (row):
+            bounds.append(row[0])
+            row = ibm_db.fetch_tuple(stmt)
+        return [bound for i, bound in enumerate(bounds) if i > 0 and bound != bounds[i-1]]
+    
+    except Exception as err:
+        db2_error(ctx.flag(["-q","-quiet"]),ctx=ctx)
+        return None
+
+def partitionTarget(ctx, sql, params, batchsize, index, batches, stop, result):
+    
+    start = time.time()
+    hdbc = poolAcquire(ctx)
+    
+    try:
+        if (hdbc == None):
+            result["error"] = "Unable to connect."
+        elif (loadLists(ctx, hdbc) == False):                 # Temporary tables are per connection
+            result["error"] = "Unable to create the temporary tables for the large lists: " + ibm_db.stmt_errormsg()
+        else:
+            stmt = ibm_db.prepare(hdbc, sql, fetchOptions(ctx, sql, batchsize))
+            if (stmt == False or ibm_db.execute(stmt, params) == False):
+                result["error"] = ibm_db.stmt_errormsg()
+            else:
+                for rows in fetchBatches(stmt, batchsize):
+                    if stop.is_set(): break
+                    batches.put((index, rows))
+                    result["rows"] += len(rows)
+                ibm_db.free_result(stmt)
+    except Exception as err:
+        result["error"] = str(err)
+    finally:
+        if (hdbc != None): poolRelease(ctx, hdbc)
+        result["elapsed"] = time.time() - start
+        batches.put((index, None))                           # This partition is done
+
+def partitionBatches(ctx, sql, plan, batchsize, results):
+    
+    #
+    # Run the partitions on their own connections and yield (partition, rows) as the batches arrive.
+    # A dictionary for every partition with its rows, time and error is added to results.
+    #
+    
+    batches = queue.Queue(maxsize=len(plan) * 2)             # Keeps the batches in memory to a few
+    stop = threading.Event()
+    
+    for index in range(len(plan)):
+        condition, params = plan[index]
+        query = sql if (condition == "") else "SELECT * FROM (" + sql + ") AS PART WHERE " + condition
+        result = {"partition" : index, "condition" : condition, "bounds" : params, "rows" : 0, "elapsed" : 0, "error" : ""}
+        results.append(result)
+        t = threading.Thread(target=partitionTarget, args=(ctx, query, params, batchsize, index, batches, stop, result))
+        t.daemon = True
+        t.start()
+        
+    running = len(plan)
+    try:
+        while (running > 0):
+            index, rows = batches.get()
+            if (rows == None):
+                running -= 1
+            else:
+                yield index, rows
+    finally:
+        stop.set()                                           # Let the threads finish if we stopped early
+        while (running > 0):
+            index, rows = batches.get()
+            if (rows == None): running -= 1
+
+def partitionErrors(ctx, results):
+    
+    errors = [result for result in results if result["error"] != ""]
+    if (len(errors) > 0):
+        raise Exception("Partition " + str(errors[0]["partition"] + 1) + " (" + errors[0]["condition"] + "): " + errors[0]["error"])
+
+def runPartitions(ctx, sql):
+    
+    statements = list(splitSQL(sql,"@" if ctx.flag(["-d","-delim"]) else ";"))
+    if (len(statements) != 1):
+        errormsg("The -partitions option runs a single query, but " + str(len(statements)) + " statements were supplied.")
+        return None
+    
+    if (ctx.session()["autocommit"] == False and ctx.flag(["-q","-quiet"]) == False):
+        errormsg("Warning: AUTOCOMMIT is OFF. The partitions run on other connections and do not see changes that were not committed.")
+    
+    ctx.chunk = None
+    sqlType, sql = renderStatement(ctx,checkMacro(statements[0]))
+    if (ctx.chunk != None):
+        errormsg("The -partitions option cannot be used with a list that is run in chunks. Use OPTION LISTMODE TEMP or INLINE.")
+        return None
+    
+    plan = partitionPlan(ctx, sql)
+    if (plan == None): return None
+    
+    stmt = ibm_db.prepare(ctx.hdbc, sql)                      # Column information for the DataFrame
+    if (stmt == False):
+        db2_error(ctx.flag(["-q","-quiet"]),ctx=ctx)
+        return None
+    columns, types = getColumns(stmt)
+    scales = getScales(stmt, types)
+    
+    start = time.time()
+    results = []
+    parts = [[] for i in range(len(plan))]
+    
+    try:
+        for index, rows in partitionBatches(ctx, sql, plan, _exportBatch, results):
+            parts[index].extend(rows)
+        partitionErrors(ctx, results)
+    except Exception as err:
+        ctx.sqlcode = -99999
+        ctx.sqlerror = str(err)
+        errormsg(ctx.sqlerror)
+        return None
+    
+    rows = []
+    for part in parts: rows.extend(part)                      # In the order of the partitions
+    parts = None
+    
+    elapsed = max(time.time() - start, 1e-9)
+    df = frameRows(ctx, rows, columns, types, scales)
+    ctx.sqlcode = 0 if len(df) > 0 else 100
+    
+    try:
+        df.attrs["partitions"] = pandas.DataFrame([[r["partition"] + 1, r["condition"], r["bounds"], r["rows"], r["elapsed"]] for r in results],
+                                                  columns=["PARTITION","CONDITION","BOUNDS","ROWS","ELAPSED"])
+    except:
+        pass                                                    # Older versions of pandas have no attrs
+    
+    if (ctx.flag(["-q","-quiet"]) == False):
+        success("%d partitions: %d rows in %.3f seconds (%.0f rows/s)" % (len(plan), len(df), elapsed, len(df) / elapsed))
+        
+    if (len(df) > 0 and (ctx.flag("-compact") or ctx.settings.get("compact",False) == True)):
+        df = compactFrame(ctx,df,stmt)
+        
+    return df
+
+# Materialized results
+#
+# -materialize name -watermark column runs a query and keeps the result under the name, along with the
+# highest value of the watermark column (a date or an increasing id). -refresh name fetches only the rows
+# above the watermark and adds them to the result. With -lookback n the rows from n days (or n for a 
+# numeric watermark) before the watermark are fetched again and replace the ones that are kept, for data
+# that can still change after it is first loaded. The results are saved in the db2materialize directory
+# so they are still available after the kernel is restarted.
+
+def materializeFile(name):
+    
+    return os.path.join(_materializePath, name + ".pickle")
+
+def findMaterialized(name):
+    
+    entry = _materialized.get(name)
+    if (entry == None):
+        try:
+            with open(materializeFile(name),'rb') as f:
+                entry = pickle.load(f)
+            _materialized[name] = entry
+        except:
+            return None
+        
+    return entry
+
+def saveMaterialized(entry):
+    
+    try:
+        if (os.path.isdir(_materializePath) == False): os.makedirs(_materializePath)
+        with open(materializeFile(entry["name"]),'wb') as f:
+            pickle.dump(entry,f)
+    except Exception as err:
+        errormsg("Failed trying to save the materialized result " + entry["name"] + ": " + str(err))
+
+def materializeFetch(ctx, sql, params=()):
+    
+    # The DataFrame of the query or None after reporting the error
+    
+    try:
+        stmt = ibm_db.prepare(ctx.hdbc, sql, fetchOptions(ctx, sql, _exportBatch))
+        if (stmt == False or ibm_db.execute(stmt, params) == False):
+            db2_error(ctx.flag(["-q","-quiet"]),ctx=ctx)
+            return None
+        
+        columns, types = getColumns(stmt)
+        rows = []
+        for batch in fetchBatches(stmt, _exportBatch):
+            rows.extend(batch)
+        ibm_db.free_result(stmt)
+        
+        return frameRows(ctx, rows, columns, types, getScales(stmt, types))
+    
+    except Exception as err:
+        db2_error(ctx.flag(["-q","-quiet"]),ctx=ctx)
+        return None
+
+def watermarkValue(df, column):
+    
+    # Highest value of the watermark column as a value that can be bound to a parameter marker
+    
+    values = df[column].dropna()
+    if (len(values) == 0): return None
+    
+    value = values.max()
+    if hasattr(value, "to_pydatetime"): return value.to_pydatetime()
+    if hasattr(value, "item"): return value.item()             # numpy types
+    
+    return value
+
+def lookbackValue(value, lookback):
+    
+    if isinstance(value, (int, float, decimal.Decimal)):
+        return value - lookback
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value - datetime.timedelta(days=lookback)
+    
+    moment = pandas.Timestamp(value) - pandas.Timedelta(days=lookback)
+    
+    return moment.strftime("%Y-%m-%d") if len(str(value)) == 10 else str(moment)
+
+def keepBefore(ctx, df, column, bound):
+    
+    #
+    # The rows of df whose watermark is below bound (or missing), which the lookback rows do not replace.
+    # Dates and timestamps are compared as timestamps: with TEMPORAL STRING the column holds the text 
+    # Db2 returned, which does not sort like the bound lookbackValue made, and with NATIVE a DATE column
+    # holds dates that cannot be compared with a datetime.
+    #
+    
+    values = df[column]
+    decimalMode, temporalMode = typeModes(ctx)
+    
+    if (isinstance(bound, (datetime.date, datetime.datetime)) or (temporalMode == "STRING" and isinstance(bound, str))):
+        values = pandas.to_datetime(values, errors="coerce")
+        bound = pandas.Timestamp(bound)
+        
+    return df[df[column].isnull() | (values < bound)]
+
+def runMaterialize(ctx, sql):
+    
+    name = ctx.flagValues.get("-materialize","").strip().upper()
+    column = ctx.flagValues.get("-watermark","").strip()
+    if (name == "" or column == ""):
+        errormsg("The -materialize option needs a name and a watermark column (-materialize name -watermark column).")
+        return None
+    
+    ctx.chunk = None
+    sqlType, sql = renderStatement(ctx,checkMacro(sql.strip()))
+    if (ctx.chunk != None):
+        errormsg("The -materialize option cannot be used with a list that is run in chunks. Use OPTION LISTMODE TEMP or INLINE.")
+        return None
+    if (len(ctx.listTables) > 0):                               # -refresh would not find the temporary table
+        errormsg("The -materialize option cannot be used with a list in a temporary table. Use OPTION LISTMODE INLINE.")
+        return None
+    
+    df = materializeFetch(ctx, sql)
+    if (df is None): return None
+    
+    found = [col for col in df.columns if col.upper() == column.upper()]
+    if (len(found) == 0):
+        errormsg("The watermark column " + column + " is not in the answer set.")
+        return None
+    
+    entry = {
+        "name"      : name,
+        "sql"       : sql,
+        "column"    : found[0],
+        "lookback"  : ctx.flagValues.get("-lookback"),
+        "profile"   : ctx.profile["name"] if ctx.profile != None else None,
+        "watermark" : watermarkValue(df, found[0]),
+        "modes"     : typeModes(ctx),                             # -refresh converts the new rows the same way
+        "refreshed" : time.time(),
+        "frame"     : df
+    }
+    _materialized[name] = entry
+    saveMaterialized(entry)
+    
+    ctx.sqlcode = 0 if len(df) > 0 else 100
+    if (ctx.flag(["-q","-quiet"]) == False):
+        success(name + ": " + str(len(df)) + " rows, watermark " + str(entry["watermark"]))
+        
+    return df
+
+def refreshMaterialized(ctx):
+    
+    name = ctx.flagValues.get("-refresh","").strip().upper()
+    entry = findMaterialized(name)
+    if (entry == None):
+        errormsg("No materialized result called " + name + ". Use -materialize " + name + " -watermark column to create it.")
+        return None
+    
+    if (ctx.flag("-conn") == False and entry["profile"] != None):
+        if (ctx.useProfile(entry["profile"]) == False):
+            errormsg("Connection profile " + entry["profile"] + " not found. Use CONNECT AS " + entry["profile"] + " to create it.")
+            return None
+        
+    if (ctx.connect() == False):
+        errormsg('A CONNECT statement must be issued before issuing SQL statements.')
+        return None
+    
+    decimalMode, temporalMode = entry.get("modes", typeModes(ctx))
+    ctx.flagValues.setdefault("-decimal", decimalMode)
+    ctx.flagValues.setdefault("-temporal", temporalMode)
+    
+    df = entry["frame"]
+    column = entry["column"]
+    lookback = ctx.flagValues.get("-lookback", entry["lookback"])
+    watermark = entry["watermark"]
+    where = "SELECT * FROM (" + entry["sql"] + ") AS MAT WHERE " + '"' + column.replace('"','""') + '"'
+    
+    if (watermark == None):                                       # Nothing was kept, so fetch all of it
+        bound = None
+        new = materializeFetch(ctx, entry["sql"])
+    elif (lookback != None):
+        try:
+            bound = lookbackValue(watermark, float(lookback) if "." in str(lookback) else int(lookback))
+        except Exception as err:
+            errormsg("Invalid -lookback value provided.")
+            return None
+        new = materializeFetch(ctx, where + " >= ?", (bound,))
+    else:
+        bound = watermark
+        new = materializeFetch(ctx, where + " > ?", (bound,))
+    
+    if (new is None): return None
+    
+    start = len(df)
+    if (bound == None):
+        df = new
+    else:
+        if (lookback != None):                                    # The lookback rows replace the ones we kept
+            df = keepBefore(ctx, df, column, bound)
+        df = pandas.concat([df, new], ignore_index=True)
+        
+    entry["frame"] = df
+    entry["watermark"] = watermarkValue(df, column) if len(df) > 0 else watermark
+    entry["refreshed"] = time.time()
+    saveMaterialized(entry)
+    
+    ctx.sqlcode = 0 if len(new) > 0 else 100
+    if (ctx.flag(["-q","-quiet"]) == False):
+        success(name + ": " + str(len(new)) + " rows fetched, " + str(len(df)) + " rows in total (" + str(len(df) - start) + 
+                " new), watermark " + str(entry["watermark"]))
+        
+    return df
+
+# On-disk result cache
+#
+# With OPTION CACHE ON (or -cache for one statement) the DataFrame of a query is saved in CACHEDIR and
+# the next time the same statement is run on the same connection the saved copy is returned instead.
+# The key is made from the statement text (host variables are already replaced with their values), 
+# the connection, the special registers that were set and the DECIMAL and TEMPORAL modes. Results are
+# saved as Parquet files when pyarrow is installed and as pickles otherwise, and index.json lists them.
+# When the files are larger than CACHESIZE MB the least recently used results are removed, and a 
+# result that is older than CACHETTL seconds (an hour by default) is fetched again. The cache is 
+# checked before connecting, so a saved result does not need the database at all. Running anything 
+# other than a query (INSERT, UPDATE, CALL, ...) or a ROLLBACK removes the saved results of that 
+# database. -nocache runs the statement and replaces the saved result. CACHE LIST shows the saved 
+# results and CACHE CLEAR removes them.
+
+def cacheEnabled(ctx):
+    
+    if ctx.flag("-cache"): return True
+    
+    return _settings.get("cache",False) == True or ctx.flag("-nocache")
+
+def cacheDir():
+    
+    return _settings.get("cachedir","db2cache")
+
+def cacheIndex():
+    
+    global _cacheIndex, _cacheIndexDir
+    
+    if (_cacheIndex == None or _cacheIndexDir != cacheDir()):
+        _cacheIndexDir = cacheDir()
+        try:
+            with open(os.path.join(_cacheIndexDir,"index.json"),"r") as f:
+                _cacheIndex = json.load(f)
+        except:
+            _cacheIndex = {}
+            
+    return _cacheIndex
+
+def saveCacheIndex():
+    
+    try:
+        if (os.path.isdir(cacheDir()) == False): os.makedirs(cacheDir())
+        with open(os.path.join(cacheDir(),"index.json"),"w") as f:
+            json.dump(_cacheIndex,f)
+    except Exception as err:
+        errormsg("Failed trying to write the result cache index: " + str(err))
+        
+def cacheDatabase(ctx):
+    
+    settings = ctx.settings
+    
+    return settings["hostname"] + ":" + str(settings["port"]) + "/" + settings["database"].upper()
+
+def cacheKey(ctx, sql):
+    
+    #
+    # Large lists in temporary tables are part of the key through the digest of their values, and the
+    # special registers that were set on the connection (SET SCHEMA, SET CURRENT PATH, ...) because 
+    # they change what the same statement returns
+    #
+    
+    connection = [ctx.profile["name"] if ctx.profile != None else "", cacheDatabase(ctx), ctx.settings["uid"]]
+    lists = [ctx.lists[varName]["digest"] for varName in ctx.listTables]
+    registers = sorted(ctx.session()["registers"].items())
+    
+    return hashlib.sha1(json.dumps([sql.strip(), connection, lists, registers, list(typeModes(ctx))]).encode("utf-8")).hexdigest()
+
+def cacheRemove(index, key):
+    
+    entry = index.pop(key, None)
+    if (entry != None):
+        try:
+            os.remove(os.path.join(cacheDir(), entry["file"]))
+        except:
+            pass
+
+def cacheGet(ctx, sql):
+    
+    # The cached DataFrame for the statement or None
+    
+    if ctx.flag("-nocache"): return None
+    
+    index = cacheIndex()
+    key = cacheKey(ctx, sql)
+    entry = index.get(key)
+    if (entry == None): return None
+    
+    ttl = _settings.get("cachettl",3600)
+    if (ttl > 0 and time.time() - entry["created"] > ttl):  # Too old to use
+        cacheRemove(index, key)
+        saveCacheIndex()
+        return None
+    
+    filename = os.path.join(cacheDir(), entry["file"])
+    try:
+        if (entry["file"].endswith(".parquet")):
+            df = pandas.read_parquet(filename)
+        else:
+            df = pandas.read_pickle(filename)
+    except Exception as err:
+        cacheRemove(index, key)
+        saveCacheIndex()
+        return None
+    
+    entry["used"] = time.time()
+    saveCacheIndex()
+    
+    if (ctx.flag(["-q","-quiet"]) == False):
+        success("Result from the cache, saved %d seconds ago" % (time.time() - entry["created"]))
+        
+    return df
+
+def cachePut(ctx, sql, df):
+    
+    index = cacheIndex()
+    key = cacheKey(ctx, sql)
+    cacheRemove(index, key)
+    
+    try:
+        if (os.path.isdir(cacheDir()) == False): os.makedirs(cacheDir())
+        try:
+            import pyarrow
+            filename = key + ".parquet"
+            df.to_parquet(os.path.join(cacheDir(), filename))
+        except Exception as err:                                 # No pyarrow or types Parquet cannot hold
+            if (os.path.exists(os.path.join(cacheDir(), key + ".parquet"))):
+                os.remove(os.path.join(cacheDir(), key + ".parquet"))   # Partly written file
+            filename = key + ".pickle"
+            df.to_pickle(os.path.join(cacheDir(), filename))
+    except Exception as err:
+        errormsg("Failed trying to save the result in the cache: " + str(err))
+        return
+    
+    now = time.time()
+    index[key] = {
+        "file"    : filename,
+        "sql"     : sql.strip(),
+        "profile" : ctx.profile["name"] if ctx.profile != None else "",
+        "database": cacheDatabase(ctx),
+        "rows"    : len(df),
+        "bytes"   : os.path.getsize(os.path.join(cacheDir(), filename)),
+        "created" : now,
+        "used"    : now
+    }
+    
+    limit = _settings.get("cachesize",1024) * 1024 * 1024     # Remove the least recently used results
+    total = sum([entry["bytes"] for entry in index.values()])
+    for old in sorted(index, key=lambda k: index[k]["used"]):
+        if (limit == 0 or total <= limit or old == key): break
+        total = total - index[old]["bytes"]
+        cacheRemove(index, old)
+        
+    saveCacheIndex()
+
+def cacheInvalidate(ctx):
+    
+    # A statement that is not a query ran, so the saved results of its database may be out of date
+    
+    with _cacheLock:
+        index = cacheIndex()
+        if (len(index) == 0): return
+        database = cacheDatabase(ctx)
+        keys = [key for key, entry in index.items() if entry.get("database",database) == database]
+        if (len(keys) == 0): return
+        for key in keys:
+            cacheRemove(index, key)
+        saveCacheIndex()
+
+def cacheLookup(ctx, sql):
+    
+    #
+    # The saved result of a %sql call that is a single query going to a DataFrame, found before 
+    # connecting or preparing anything. None when the call cannot use the cache or nothing is saved.
+    #
+    
+    if (cacheEnabled(ctx) == False or ctx.flag("-nocache")): return None
+    if ctx.flag(["-t","-page","-grid","-r","-array","-j","-json","-partitions","-materialize"]): return None
+    if (ctx.settings["display"] == "GRID"): return None
+    
+    statements = list(splitSQL(sql,"@" if ctx.flag(["-d","-delim"]) else ";"))
+    if (len(statements) != 1): return None
+    
+    ctx.chunk = None                                    # Macros were expanded by the caller
+    sqlType, sql = sqlParser(statements[0],ctx)
+    if (sqlType not in ("SELECT","WITH","VALUES") or ctx.chunk != None): return None
+    
+    return cacheGet(ctx,sql)
+
+def parseCache(ctx, sql):
+    
+    cParms = sql.split()
+    command = cParms[1].upper() if len(cParms) > 1 else "LIST"
+    index = cacheIndex()
+    
+    if (command == "CLEAR"):
+        count = len(index)
+        for key in list(index):
+            cacheRemove(index, key)
+        saveCacheIndex()
+        if (ctx.flag(["-q","-quiet"]) == False):
+            success("Removed " + str(count) + " results from the cache.")
+        return
+    
+    elif (command == "LIST"):
+        rows = [[entry["sql"], entry["profile"], entry["rows"], formatBytes(entry["bytes"]), 
+                 time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry["created"])),
+                 time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry["used"]))] 
+                for entry in sorted(index.values(), key=lambda entry: -entry["used"])]
+        if (len(rows) == 0):
+            if (ctx.flag(["-q","-quiet"]) == False): errormsg("The result cache is empty.")
+            return
+        return pandas.DataFrame(rows, columns=["SQL","PROFILE","ROWS","SIZE","CREATED","USED"])
+    
+    else:
+        errormsg("Use CACHE LIST or CACHE CLEAR.")
+        return
 
-def parseCommit(sql):
+def parseCommit(ctx, sql):
     
-    global _hdbc, _hdbi, _connected, _runtime, _stmt, _stmtID, _stmtSQL
-
-    if (_connected == False): return                        # Nothing to do if we are not connected
+    if (ctx.connected() == False): return                   # Nothing to do if we are not connected
+    
+    ctx.connect()
     
     cParms = sql.split()
     if (len(cParms) == 0): return                           # Nothing to do but this shouldn't happen
@@ -1901,28 +4818,27 @@ def parseCommit(sql):
     
     if (keyword == "COMMIT"):                               # Commit the work that was done
         try:
-            result = ibm_db.commit (_hdbc)                  # Commit the connection
+            result = ibm_db.commit (ctx.hdbc)              # Commit the connection
             if (len(cParms) > 1):
                 keyword = cParms[1].upper()
                 if (keyword == "HOLD"):
                     return
             
-            del _stmt[:]
-            del _stmtID[:]
+            ctx.clearStatements()
 
         except Exception as err:
-            db2_error(False)
+            db2_error(False,ctx=ctx)
         
         return
         
     if (keyword == "ROLLBACK"):                             # Rollback the work that was done
         try:
-            result = ibm_db.rollback(_hdbc)                  # Rollback the connection
-            del _stmt[:]
-            del _stmtID[:]            
+            result = ibm_db.rollback(ctx.hdbc)              # Rollback the connection
+            ctx.clearStatements()
+            cacheInvalidate(ctx)                            # Results saved since the last commit are gone
 
         except Exception as err:
-            db2_error(False)
+            db2_error(False,ctx=ctx)
         
         return
     
@@ -1934,105 +4850,759 @@ def parseCommit(sql):
         
         try:
             if (op == "OFF"):
-                ibm_db.autocommit(_hdbc, False)
+                ibm_db.autocommit(ctx.hdbc, False)
+                ctx.session()["autocommit"] = False
             elif (op == "ON"):
-                ibm_db.autocommit (_hdbc, True)
+                ibm_db.autocommit (ctx.hdbc, True)
+                ctx.session()["autocommit"] = True
             return    
         
         except Exception as err:
-            db2_error(False)
+            db2_error(False,ctx=ctx)
             return 
         
     return
 
-def setFlags(inSQL):
+def setFlags(inSQL,ctx=None):
     
-    global _flags
+    if (ctx == None): ctx = currentContext()
     
-    _flags = [] # Delete all of the current flag settings
+    _flags = [] # Flags found at the start of the statement
+    values = {} # Values of the flags that take one (-conn name)
     
     pos = 0
-    end = len(inSQL)-1
+    end = len(inSQL)
     inFlag = False
-    ignore = False
     outSQL = ""
-    flag = ""
+    spaces = 0
+    flag = []
     
-    while (pos <= end):
+    while (pos < end):
         ch = inSQL[pos]
-        if (ignore == True):   
-            outSQL = outSQL + ch
+        if (inFlag == True):
+            if (ch != " "):
+                flag.append(ch)
+            else:
+                name = "".join(flag)
+                _flags.append(name)
+                inFlag = False
+                if (name in _valueFlags):               # The next word is the value of the flag
+                    while (pos + 1 < end and inSQL[pos+1] == " "): pos += 1
+                    valueEnd = inSQL.find(" ",pos+1)
+                    if (valueEnd == -1): valueEnd = end
+                    values[name] = inSQL[pos+1:valueEnd]
+                    pos = valueEnd - 1
         else:
-            if (inFlag == True):
-                if (ch != " "):
-                    flag = flag + ch
-                else:
-                    _flags.append(flag)
-                    inFlag = False
+            if (ch == "-"):
+                flag = ["-"]
+                inFlag = True
+            elif (ch == ' '):
+                spaces += 1
             else:
-                if (ch == "-"):
-                    flag = "-"
-                    inFlag = True
-                elif (ch == ' '):
-                    outSQL = outSQL + ch
-                else:
-                    outSQL = outSQL + ch
-                    ignore = True
+                outSQL = " " * spaces + inSQL[pos:]   # The rest of the string is the SQL
+                break
         pos += 1
         
     if (inFlag == True):
-        _flags.append(flag)
+        _flags.append("".join(flag))
+        
+    if (pos == end):                                # No SQL found after the flags
+        outSQL = " " * spaces
+        
+    ctx.flags = set(_flags)
+    ctx.flagValues = values
         
     return outSQL
 
 def flag(inflag):
     
-    global _flags
+    # Check the flags of the %sql call that is running on this thread
+    
+    return currentContext().flag(inflag)
 
-    if isinstance(inflag,list):
-        for x in inflag:
-            if (x in _flags):
-                return True
-        return False
+def splitSQL(lines, delimiter):
+    
+    #
+    # Split a script into statements and yield them one at a time, so the first statement can run
+    # before the rest of the script has been read. The input can be a string or any iterable of 
+    # lines (an open file, a StringIO). Quoted strings and identifiers are kept intact, -- and /* */ 
+    # comments are removed, and the delimiter is ignored inside compound statements (BEGIN ... END)
+    # so that SQL PL bodies stay in one piece. Line breaks outside of quotes become blanks.
+    #
+    
+    if (isinstance(lines,str)): lines = io.StringIO(lines)
+    
+    scan = _stmtScan.get(delimiter)
+    if (scan == None):
+        scan = re.compile("'|\"|--|/\\*|" + re.escape(delimiter) + "|[A-Za-z_][A-Za-z0-9_$#]*")
+        _stmtScan[delimiter] = scan
+    
+    statement = []
+    quoteCH = ""
+    inComment = False
+    depth = 0                                                   # BEGIN/CASE blocks that are open
+    pendingEnd = False                                          # Last keyword was END
+    
+    for line in lines:
+        pos = 0
+        end = len(line)
+        while pos < end:
+            if (quoteCH != ""):                                 # Inside a quote (may span lines)
+                close = line.find(quoteCH,pos)
+                if (close == -1):
+                    statement.append(line[pos:])
+                    break
+                statement.append(line[pos:close+1])
+                quoteCH = ""
+                pos = close + 1
+                continue
+            if (inComment == True):                             # Inside a /* */ comment
+                close = line.find("*/",pos)
+                if (close == -1):
+                    break
+                inComment = False
+                statement.append(" ")
+                pos = close + 2
+                continue
+            found = scan.search(line,pos)
+            if (found == None):
+                statement.append(line[pos:].translate(_blankLines))
+                break
+            statement.append(line[pos:found.start()].translate(_blankLines))
+            token = found.group(0)
+            pos = found.end()
+            if (token in ("'",'"')):
+                quoteCH = token
+                statement.append(token)
+            elif (token == "--"):                               # Ignore the rest of the line
+                statement.append(" ")
+                break
+            elif (token == "/*"):
+                inComment = True
+            elif (token == delimiter):
+                if (pendingEnd == True):
+                    depth = max(0,depth-1)
+                    pendingEnd = False
+                if (depth > 0):                                 # Part of a compound statement
+                    statement.append(token)
+                    continue
+                sql = "".join(statement).strip()
+                statement = []
+                if (sql != ""): yield sql
+            else:                                               # A word - look for block keywords
+                statement.append(token)
+                keyword = token.upper()
+                if (pendingEnd == True):
+                    pendingEnd = False
+                    if (keyword in ("IF","WHILE","LOOP","FOR","REPEAT")): continue
+                    depth = max(0,depth-1)
+                    if (keyword == "CASE"): continue            # END CASE closes a CASE statement
+                if (keyword in ("BEGIN","CASE")):
+                    depth = depth + 1
+                elif (keyword == "END"):
+                    pendingEnd = True
+                
+    sql = "".join(statement).strip()
+    if (sql != ""): yield sql
+
+# Run SQL script files
+#
+# %sql -f file.sql reads the file a line at a time and runs each statement as soon as the splitter
+# returns it, so large DDL and migration scripts never have to be loaded into memory. Wildcards
+# can be used to run several files in name order.
+
+def runScript(ctx, pattern):
+    
+    import glob
+    
+    if (pattern == ""):
+        errormsg("No file name supplied for the -f option.")
+        return None
+    
+    files = sorted(glob.glob(os.path.expanduser(pattern)))
+    if (len(files) == 0):
+        errormsg("No files found that match " + pattern)
+        return None
+    
+    quiet = ctx.flag(["-q","-quiet"])
+    stopOnError = not ctx.flag("-continue")
+    if ctx.flag(["-d","-delim"]):
+        delimiter = "@"
     else:
-        if (inflag in _flags):
-            return True
+        delimiter = ";"
+        
+    report = []
+    errors = 0
+    stopped = False
+    start_time = time.time()
+    
+    for fname in files:
+        try:
+            f = open(fname,"r")
+        except Exception as err:
+            errormsg("Unable to open " + fname + ": " + str(err))
+            errors += 1
+            if (stopOnError == True): break
+            continue
+        
+        with f:
+            count = 0
+            for sqlin in splitSQL(f, delimiter):
+                count += 1
+                stmt_start = time.time()
+                ctx.retry = False
+                ok, rows = runScriptStatement(ctx, sqlin, quiet)
+                if (ok == False and retryStatement(ctx, quiet) == True):
+                    ok, rows = runScriptStatement(ctx, sqlin, quiet)
+                elapsed = time.time() - stmt_start
+                report.append([os.path.basename(fname), count, sqlin, ctx.sqlcode, rows, elapsed])
+                if (quiet == False):
+                    text = " ".join(sqlin.split())
+                    if (len(text) > 60): text = text[:57] + "..."
+                    print("{0} [{1}] {2:.3f}s {3}".format(os.path.basename(fname), count, elapsed, text))
+                if (ok == False):
+                    errors += 1
+                    if (stopOnError == True):
+                        stopped = True
+                        break
+        if (stopped == True): break
+    
+    if (quiet == False):
+        status = "Script stopped after an error. " if stopped else ""
+        success("{0}{1} statements run from {2} file(s) with {3} error(s) in {4:.3f}s.".format(
+                status, len(report), len(files), errors, time.time() - start_time))
+    
+    return pandas.DataFrame(report, columns=["FILE","STATEMENT","SQL","SQLCODE","ROWS","ELAPSED"])
+
+def runScriptStatement(ctx, sqlin, quiet):
+    
+    # Run one statement from a script. Returns a success flag and the number of rows affected or returned
+    
+    ctx.resetStatus()
+    
+    sqlin = checkMacro(sqlin)
+    ctx.chunk = None
+    sqlType, sql = sqlParser(sqlin, ctx)
+    if (sql.strip() == ""): return True, 0
+    
+    if (sqlType == "CONNECT"):                                  # connect to sample; in the shipped scripts
+        return (parseConnect(sql, ctx.local_ns) == True), 0     # The connection it named (CONNECT AS)
+    elif (sqlType in ("COMMIT","ROLLBACK","AUTOCOMMIT")):
+        recordStart("commit", sql, ctx=ctx)
+        parseCommit(ctx, sql)
+        return (ctx.sqlcode >= 0), 0
+    
+    if (ctx.connect() == False):
+        errormsg('A CONNECT statement must be issued before issuing SQL statements.')
+        return False, 0
+    
+    ctx.chunk = None
+    sqlType, sql = renderStatement(ctx, sqlin)                  # Large lists are loaded on the connection
+    
+    if ctx.flag(["-e","-echo"]): debug(sql,False)
+    
+    try:
+        if (ctx.chunk != None):                                 # Large list run in chunks
+            stmts = chunkResults(ctx, sqlin, lambda sql: ibm_db.exec_immediate(ctx.hdbc, sql))
+            if (False in stmts):
+                db2_error(quiet,ctx=ctx)
+                return False, 0
+            stmt = stmts[0]
         else:
-            return False
+            stmt = ibm_db.prepare(ctx.hdbc, sql)
+            if (stmt == False):
+                db2_error(quiet,ctx=ctx)
+                return False, 0
+            if (ibm_db.execute(stmt) == False):
+                db2_error(quiet,ctx=ctx)
+                return False, 0
+            stmts = [stmt]
+        
+        if (ibm_db.num_fields(stmt) == 0):
+            trackSession(ctx, sql)
+            cacheInvalidate(ctx)
+            return True, sum([ibm_db.num_rows(s) for s in stmts])
+        
+        rows = fetchResults(stmt,ctx)
+        skip = 1 if (len(rows) > 0 and isinstance(rows[0],list)) else 0
+        for s in stmts[1:]:
+            rows.extend(fetchResults(s,ctx)[skip:])           # Column names are only needed once
+        if (len(rows) > 0 and isinstance(rows[0],list)):      # First row of an array has the column names
+            df = pandas.DataFrame.from_records(rows[1:],columns=rows[0])
+        else:
+            df = pandas.DataFrame(rows)
+        if (quiet == False and len(df) > 0):
+            pdisplay(df)
+        return True, len(df)
+    
+    except Exception as err:
+        db2_error(quiet,ctx=ctx)
+        return False, 0
 
-def splitSQL(inputString, delimiter):
-     
-    pos = 0
-    arg = ""
-    results = []
-    quoteCH = ""
+# Fan-out execution
+#
+# -fanout prof1,prof2,... runs the same statements on every named profile at the same time, one thread
+# per profile, and returns one DataFrame with a SOURCE column that holds the profile name. Targets 
+# that fail are reported and the rows of the others are still returned. The per-target timings and
+# errors are kept in the attrs["fanout"] DataFrame of the result.
+
+def fanoutTarget(ctx, name, sql, result):
+    
+    tctx = ExecContext(ctx.local_ns)                           # Every target has its own status
+    tctx.flags = ctx.flags
+    tctx.flagValues = ctx.flagValues
+    setContext(tctx)
     
-    inSQL = inputString.strip()
-    if (len(inSQL) == 0): return(results)       # Not much to do here - no args found
+    start = time.time()
+    
+    try:
+        if (tctx.useProfile(name) == False):
+            result["error"] = "Connection profile " + name + " not found."
+        elif (tctx.profile["connected"] == False and profileConnect(tctx.profile,True) == False) or (tctx.connect() == False):
+            result["error"] = tctx.sqlerror if (tctx.sqlerror != "") else "Unable to connect."
+        else:
+            delimiter = "@" if tctx.flag(["-d","-delim"]) else ";"
+            for sqlin in retryStatements(tctx, splitSQL(sql,delimiter)):
+                sqlin = checkMacro(sqlin)
+                tctx.chunk = None
+                sqlType, stmt_sql = renderStatement(tctx,sqlin)
+                if (stmt_sql.strip() == ""): continue
+                stmt = ibm_db.prepare(tctx.hdbc,stmt_sql)
+                if (stmt == False):
+                    db2_error(True,ctx=tctx)
+                    if (tctx.retry == True): continue       # Run again on the new connection
+                    break
+                if (ibm_db.num_fields(stmt) == 0):
+                    if (tctx.chunk != None):                    # Large list run in chunks
+                        counts = chunkResults(tctx,sqlin,lambda sql: ibm_db.num_rows(ibm_db.exec_immediate(tctx.hdbc,sql)))
+                        result["rows"] += sum(counts)
+                    else:
+                        if (ibm_db.execute(stmt) == False):
+                            db2_error(True,ctx=tctx)
+                            if (tctx.retry == True): continue   # Run again on the new connection
+                            break
+                        result["rows"] += ibm_db.num_rows(stmt)
+                        trackSession(tctx,stmt_sql)
+                    cacheInvalidate(tctx)
+                else:
+                    if (tctx.chunk != None):
+                        frames = chunkResults(tctx,sqlin,lambda sql: pandas.read_sql(sql,tctx.hdbi))
+                        result["frame"] = pandas.concat(frames,ignore_index=True)
+                    else:
+                        result["frame"] = pandas.read_sql(stmt_sql,tctx.hdbi)
+                    result["rows"] = len(result["frame"])
+            if (tctx.sqlcode < 0): result["error"] = tctx.sqlerror
             
-    while pos < len(inSQL):
-        ch = inSQL[pos]
-        pos += 1
-        if (ch in ('"',"'")):                   # Is this a quote characters?
-            arg = arg + ch                      # Keep appending the characters to the current arg
-            if (ch == quoteCH):                 # Is this quote character we are in
-                quoteCH = ""
-            elif (quoteCH == ""):               # Create the quote
-                quoteCH = ch
-            else:
-                None
-        elif (quoteCH != ""):                   # Still in a quote
-            arg = arg + ch
-        elif (ch == delimiter):                 # Is there a delimiter?
-            results.append(arg)
-            arg = ""
+    except Exception as err:
+        db2_error(True,ctx=tctx)
+        result["error"] = tctx.sqlerror if (tctx.sqlcode != 0) else str(err)
+        
+    recordEnd(tctx)                                             # The last statement of this target
+    result["sqlcode"] = tctx.sqlcode
+    result["sqlstate"] = tctx.sqlstate
+    result["elapsed"] = time.time() - start
+    
+def runFanout(ctx, sql):
+    
+    names = []
+    for name in ctx.flagValues.get("-fanout","").split(","):
+        name = name.strip().upper()
+        if (name != "" and name not in names): names.append(name)
+        
+    if (len(names) == 0):
+        errormsg("No connection profiles supplied for the -fanout option.")
+        return None
+    
+    if (len(_warmups) > 0): waitWarmup()
+    
+    results = []
+    threads = []
+    start = time.time()
+    
+    for name in names:
+        result = {"source" : name, "rows" : 0, "elapsed" : 0, "error" : "", "frame" : None, "sqlcode" : 0, "sqlstate" : "0"}
+        results.append(result)
+        t = threading.Thread(target=fanoutTarget, args=(ctx, name, sql, result))
+        t.daemon = True
+        threads.append(t)
+        t.start()
+        
+    for t in threads:
+        t.join()
+        
+    wall = time.time() - start
+    quiet = ctx.flag(["-q","-quiet"])
+    
+    frames = []
+    for result in results:
+        if (result["error"] != ""):
+            if (ctx.sqlcode == 0):                              # Report the first failure in sqlcode
+                ctx.sqlcode = result["sqlcode"] if (result["sqlcode"] != 0) else -99999
+                ctx.sqlstate = result["sqlstate"]
+                ctx.sqlerror = result["error"]
+            if (quiet == False): errormsg(result["source"] + ": " + result["error"])
+        else:
+            if (quiet == False): 
+                success("%s: %d rows in %.3f seconds" % (result["source"], result["rows"], result["elapsed"]))
+            if (result["frame"] is not None):
+                df = result["frame"]
+                column = "SOURCE"
+                while (column in df.columns): column = "_" + column
+                df.insert(0, column, result["source"])
+                frames.append(df)
+                
+    if (quiet == False):
+        success("%d of %d targets completed in %.3f seconds" % (len([r for r in results if r["error"] == ""]), len(results), wall))
+                
+    if (len(frames) == 0): return None
+    
+    df = pandas.concat(frames, ignore_index=True, sort=False)
+    if (len(df) == 0 and ctx.sqlcode == 0): ctx.sqlcode = 100
+    
+    try:
+        df.attrs["fanout"] = pandas.DataFrame([[r["source"], r["rows"], r["elapsed"], r["error"]] for r in results],
+                                              columns=["SOURCE","ROWS","ELAPSED","ERROR"])
+    except:
+        pass                                                    # Older versions of pandas have no attrs
+    
+    return df
+
+# Session recording and workload replay
+#
+# RECORD START <file> writes every statement that is run through %sql, including the ones of -f scripts
+# and of each -fanout target (along with the values bound to EXECUTE statements, the time it was issued
+# relative to the start of the recording and how long it took) to a file with one JSON record per line. REPLAY <file> runs the same workload again, 
+# optionally as several concurrent sessions or at a faster rate, and compares the latency and 
+# throughput against the original recording.
+
+def recordValue(value):
+    
+    # Values are written as JSON so anything that is not a simple type is saved as a string
+    
+    if (value == None or isinstance(value,(bool,int,float,str))):
+        return value
+    else:
+        return str(value)
+
+def recordStart(kind, sql, parms=None, stmtID=None, ctx=None):
+    
+    # Each context times its own statement so the -fanout targets can be recorded at the same time
+    
+    if (_recording["file"] == None): return
+    
+    if (ctx == None): ctx = currentContext()
+    recordEnd(ctx)                                          # Close off the previous statement
+    
+    now = time.time()
+    ctx.recorded = {
+        "kind"   : kind,
+        "offset" : round(now - _recording["start"],6),
+        "sql"    : sql,
+        "stmtid" : stmtID,
+        "parms"  : None if parms == None else [recordValue(v) for v in parms],
+        "_start" : now
+    }
+    
+def recordEnd(ctx=None):
+    
+    global _recording
+    
+    if (ctx == None): ctx = currentContext()
+    event = ctx.recorded
+    if (event == None): return
+    
+    ctx.recorded = None
+    event["elapsed"] = round(time.time() - event.pop("_start"),6)
+    event["sqlcode"] = ctx.sqlcode
+    
+    with _recordLock:
+        if (_recording["file"] == None): return              # Stopped while the statement ran
+        try:
+            _recording["file"].write(json.dumps(event) + "\n")
+            _recording["file"].flush()
+            _recording["count"] += 1
+        except Exception as err:
+            errormsg("Unable to write to the recording file: " + str(err))
+
+def parseRecord(inSQL):
+    
+    global _recording
+    
+    cParms = inSQL.split()
+    
+    if (len(cParms) < 2 or cParms[1].upper() == "STATUS"):
+        if (_recording["file"] == None):
+            print("Recording is off.")
+        else:
+            print("Recording to " + _recording["name"] + ": " + str(_recording["count"]) + " statements.")
+        return
+    
+    keyword = cParms[1].upper()
+    
+    if (keyword == "START"):
+        if (len(cParms) < 3):
+            errormsg("No file name supplied for RECORD START.")
+            return
+        if (_recording["file"] != None):
+            recordStop()
+        fname = inSQL.split(None,2)[2].strip()
+        try:
+            f = open(fname,"w")
+            f.write(json.dumps({"kind" : "session", "database" : _settings["database"], 
+                                "hostname" : _settings["hostname"], "started" : time.time()}) + "\n")
+        except Exception as err:
+            errormsg("Unable to create the recording file " + fname + ": " + str(err))
+            return
+        _recording["file"] = f
+        _recording["name"] = fname
+        _recording["start"] = time.time()
+        _recording["count"] = 0
+        currentContext().recorded = None
+        success("Recording to " + fname + ".")
+        
+    elif (keyword == "STOP"):
+        if (_recording["file"] == None):
+            errormsg("No recording is active.")
+            return
+        count = _recording["count"]
+        name = recordStop()
+        success("Recording stopped. " + str(count) + " statements written to " + name + ".")
+        
+    else:
+        errormsg("Unknown RECORD option. Use RECORD START <file>, RECORD STOP or RECORD STATUS.")
+        
+def recordStop():
+    
+    global _recording
+    
+    recordEnd()
+    with _recordLock:
+        name = _recording["name"]
+        try:
+            _recording["file"].close()
+        except:
+            pass
+        _recording["file"] = None
+        _recording["name"] = ""
+    return name
+
+def loadRecording(fname):
+    
+    events = []
+    with open(fname,"r") as f:
+        for line in f:
+            line = line.strip()
+            if (line == ""): continue
+            event = json.loads(line)
+            if (event.get("kind") in ("sql","prepare","execute","commit")):
+                events.append(event)
+    return events
+
+def replaySession(events, settings, rate, startAt, results):
+    
+    # Run one copy of the recorded workload on its own connection. Statement latencies are
+    # appended to the shared results list (list.append is atomic so no lock is needed).
+    
+    latencies = []
+    errors = 0
+    prepared = {}
+    
+    try:
+        hdbc = ibm_db.connect(db2_dsn(settings), "", "")
+    except Exception as err:
+        results.append({"latencies" : [], "errors" : len(events), "message" : str(err)})
+        return
+    
+    for event in events:
+        
+        delay = startAt + event["offset"] / rate - time.time()    # Keep the original inter-arrival time
+        if (delay > 0): time.sleep(delay)
+        
+        kind = event["kind"]
+        start = time.time()
+        try:
+            if (kind == "sql"):
+                stmt = ibm_db.exec_immediate(hdbc, event["sql"])
+                if (stmt == False):
+                    errors += 1
+                    continue
+                if (ibm_db.num_fields(stmt) > 0):
+                    while (ibm_db.fetch_tuple(stmt)): pass
+                ibm_db.free_result(stmt)
+            elif (kind == "prepare"):
+                stmt = ibm_db.prepare(hdbc, event["sql"])
+                if (stmt == False):
+                    errors += 1
+                    continue
+                prepared[event["stmtid"]] = stmt
+            elif (kind == "execute"):
+                stmt = prepared.get(event["stmtid"])
+                if (stmt == None):
+                    errors += 1
+                    continue
+                if (event["parms"] == None):
+                    result = ibm_db.execute(stmt)
+                else:
+                    result = ibm_db.execute(stmt, tuple(event["parms"]))
+                if (result == False):
+                    errors += 1
+                    continue
+                if (ibm_db.num_fields(stmt) > 0):
+                    while (ibm_db.fetch_tuple(stmt)): pass
+            elif (kind == "commit"):
+                keyword = event["sql"].split()
+                if (keyword[0].upper() == "COMMIT"):
+                    ibm_db.commit(hdbc)
+                elif (keyword[0].upper() == "ROLLBACK"):
+                    ibm_db.rollback(hdbc)
+                elif (len(keyword) > 1):
+                    ibm_db.autocommit(hdbc, keyword[1].upper() == "ON")
+        except Exception as err:
+            errors += 1
+            continue
+        
+        latencies.append(time.time() - start)
+        
+    try:
+        ibm_db.close(hdbc)
+    except:
+        pass
+    
+    results.append({"latencies" : latencies, "errors" : errors, "message" : ""})
+
+def latencySummary(latencies):
+    
+    if (len(latencies) == 0): return [0, 0, 0, 0]
+    
+    ordered = sorted(latencies)
+    count = len(ordered)
+    return [sum(ordered) / count, 
+            ordered[int(0.50 * (count-1))], 
+            ordered[int(0.95 * (count-1))], 
+            ordered[-1]]
+
+def parseReplay(inSQL):
+    
+    cParms = inSQL.split()
+    if (len(cParms) < 2):
+        errormsg("Syntax: REPLAY <file> [CONCURRENCY n] [RATE x] [PROFILE name]")
+        return None
+    
+    fname = cParms[1]
+    concurrency = 1
+    rate = 1.0
+    settings = _settings
+    
+    cnt = 2
+    while cnt < len(cParms):
+        keyword = cParms[cnt].upper()
+        if (keyword in ("CONCURRENCY","RATE") and cnt+1 < len(cParms)):
+            try:
+                if (keyword == "CONCURRENCY"):
+                    concurrency = max(1,int(cParms[cnt+1]))
+                else:
+                    rate = float(cParms[cnt+1])
+                    if (rate <= 0): raise ValueError(rate)
+            except:
+                errormsg("Invalid " + keyword + " value provided.")
+                return None
+            cnt = cnt + 2
+        elif (keyword == "PROFILE" and cnt+1 < len(cParms)):
+            profile = _profiles.get(cParms[cnt+1].upper())
+            if (profile == None):
+                errormsg("Connection profile " + cParms[cnt+1] + " not found.")
+                return None
+            settings = profile["settings"]
+            cnt = cnt + 2
         else:
-            arg = arg + ch
+            errormsg("Unknown REPLAY option: " + cParms[cnt])
+            return None
             
-    if (arg != ""):
-        results.append(arg)
+    if (len(settings["database"]) == 0):
+        errormsg('A CONNECT statement must be issued before a workload can be replayed.')
+        return None
+    
+    try:
+        events = loadRecording(fname)
+    except Exception as err:
+        errormsg("Unable to read the recording " + fname + ": " + str(err))
+        return None
+    
+    if (len(events) == 0):
+        errormsg("The recording " + fname + " does not contain any statements.")
+        return None
+    
+    results = []
+    threads = []
+    startAt = time.time() + 0.1                               # Give every session the same starting line
+    for i in range(concurrency):
+        t = threading.Thread(target=replaySession, args=(events, settings, rate, startAt, results))
+        t.daemon = True
+        threads.append(t)
+        t.start()
+    for t in threads:
+        t.join()
+    wall = max(time.time() - startAt, 1e-9)
+    
+    for r in results:
+        if (r["message"] != ""): errormsg("Replay session failed: " + r["message"])
+    
+    # Compare against the original recording
+    
+    recorded = [e.get("elapsed",0) for e in events]
+    recordedWall = max(events[-1]["offset"] + events[-1].get("elapsed",0), 1e-9)
+    replayed = []
+    errors = 0
+    for r in results:
+        replayed.extend(r["latencies"])
+        errors += r["errors"]
         
-    return(results)
+    summary = pandas.DataFrame([
+        ["RECORDED", 1, len(recorded), sum(1 for e in events if e.get("sqlcode",0) < 0), 
+            recordedWall, len(recorded) / recordedWall] + latencySummary(recorded),
+        ["REPLAY", concurrency, len(replayed), errors, 
+            wall, len(replayed) / wall] + latencySummary(replayed)],
+        columns=["RUN","SESSIONS","STATEMENTS","ERRORS","ELAPSED","STMTS_PER_SEC",
+                 "AVG_LATENCY","P50_LATENCY","P95_LATENCY","MAX_LATENCY"])
+    
+    return summary
+
+def showFrame(ctx, df, stmt=None):
+    
+    #
+    # Display the DataFrame of a query. Returns the DataFrame when it is the result of the call, True 
+    # when it was shown as a grid, False when it has no rows and None when it could not be displayed.
+    #
+    
+    if (len(df) > 0 and (ctx.flag("-compact") or ctx.settings.get("compact",False) == True)):
+        df = compactFrame(ctx,df,stmt)
+                    
+    if (len(df) == 0):
+        ctx.sqlcode = 100
+        if (ctx.flag(["-q","-quiet"]) == False): 
+            errormsg("No rows found")
+        return False
+                    
+    if ctx.flag("-grid") or ctx.settings['display'] == 'GRID':   # Check to see if we can display the results
+        if (gridAvailable() == False):
+            with pandas.option_context('display.max_rows', None, 'display.max_columns', None):  
+                print(df.to_string())
+        else:
+            try:
+                pdisplay(qgrid.show_grid(df))
+            except:
+                errormsg("Grid cannot be used to display data with duplicate column names. Use option -a or %sql OPTION DISPLAY PANDAS instead.")
+                return None
+        return True
+    else:
+        if ctx.flag(["-a","-all"]) or ctx.settings["maxrows"] == -1 : # All of the rows
+            pandas.options.display.max_rows = None
+            pandas.options.display.max_columns = None
+            return df # print(df.to_string())
+        else:
+            pandas.options.display.max_rows = ctx.settings["maxrows"]
+            pandas.options.display.max_columns = None
+            return df # pdisplay(df) # print(df.to_string())
 
 @magics_class
 class DB2(Magics):
@@ -2040,6 +5610,23 @@ class DB2(Magics):
     @needs_local_scope    
     @line_cell_magic
     def sql(self, line, cell=None, local_ns=None):
+        
+        # Each call runs in its own execution context. The status of the call is copied to the global
+        # sqlcode, sqlstate, sqlerror and sqlelapsed variables when it is done.
+        
+        ctx = ExecContext(local_ns)
+        previous = setContext(ctx)
+        start_time = time.time()
+        
+        try:
+            return self.execSQL(ctx, line, cell)
+        finally:
+            recordEnd(ctx)                                        # Finish timing a recorded statement
+            ctx.sqlelapsed = time.time() - start_time
+            publishStatus(ctx)
+            setContext(previous)
+    
+    def execSQL(self, ctx, line, cell=None):
             
         # Before we event get started, check to see if you have connected yet. Without a connection we 
         # can't do anything. You may have a connection request in the code, so if that is true, we run those,
@@ -2047,37 +5634,42 @@ class DB2(Magics):
         
         # If your statement is not a connect, and you haven't connected, we need to do it for you
     
-        global _settings, _environment
-        global _hdbc, _hdbi, _connected, _runtime, sqlstate, sqlerror, sqlcode, sqlelapsed
+        global _environment
              
         # If you use %sql (line) we just run the SQL. If you use %%SQL the entire cell is run.
         
         flag_cell = False
         flag_output = False
-        sqlstate = "0"
-        sqlerror = ""
-        sqlcode = 0
-        sqlelapsed = 0
-        
-        start_time = time.time()
-        end_time = time.time()
+        local_ns = ctx.local_ns
               
         # Macros gets expanded before anything is done
                 
-        SQL1 = setFlags(line.strip())  
+        SQL1 = setFlags(line.strip(),ctx)  
+        
+        if ctx.flag("-conn"):                                     # Use a connection profile
+            name = ctx.flagValues.get("-conn","")
+            if (ctx.useProfile(name) == False):
+                errormsg("Connection profile " + name + " not found. Use CONNECT AS " + name + " to create it.")
+                return
+        
+        if ctx.flag("-f"):                                        # Run the statements in a script file
+            return(runScript(ctx, SQL1.strip()))
+        
+        if ctx.flag("-refresh"):                                  # Bring a materialized result up to date
+            return(refreshMaterialized(ctx))
+        
         SQL1 = checkMacro(SQL1)                                   # Update the SQL if any macros are in there
         SQL2 = cell    
         
-        if flag("-sampledata"):                                   # Check if you only want sample data loaded
-            if (_connected == False):
-                if (db2_doConnect() == False):
-                    errormsg('A CONNECT statement must be issued before issuing SQL statements.')
-                    return                              
+        if ctx.flag("-sampledata"):                               # Check if you only want sample data loaded
+            if (ctx.connect() == False):
+                errormsg('A CONNECT statement must be issued before issuing SQL statements.')
+                return                              
                 
-            db2_create_sample(flag(["-q","-quiet"]))
+            db2_create_sample(ctx.flag(["-q","-quiet"]))
             return  
         
-        if SQL1 == "?" or flag(["-h","-help"]):                   # Are you asking for help
+        if SQL1 == "?" or ctx.flag(["-h","-help"]):               # Are you asking for help
             sqlhelp()
             return
         
@@ -2089,7 +5681,7 @@ class DB2(Magics):
             connected_help()
             return        
         
-        sqlType,remainder = sqlParser(SQL1,local_ns)              # What type of command do you have?
+        sqlType,remainder = sqlParser(SQL1,ctx)                   # What type of command do you have?
                 
         if (sqlType == "CONNECT"):                                # A connect request 
             parseConnect(SQL1,local_ns)
@@ -2098,20 +5690,31 @@ class DB2(Magics):
             result = setMacro(SQL2,remainder)
             return
         elif (sqlType == "OPTION"):
-            setOptions(SQL1)
+            setOptions(SQL1,ctx)
             return 
         elif (sqlType == 'COMMIT' or sqlType == 'ROLLBACK' or sqlType == 'AUTOCOMMIT'):
-            parseCommit(remainder)
+            recordStart("commit", remainder)
+            parseCommit(ctx, remainder)
             return
-        elif (sqlType == "PREPARE"):
-            pstmt = parsePExec(_hdbc, remainder)
-            return(pstmt)
-        elif (sqlType == "EXECUTE"):
-            result = parsePExec(_hdbc, remainder)
+        elif (sqlType == "RECORD"):
+            parseRecord(SQL1)
+            return
+        elif (sqlType == "REPLAY"):
+            return(parseReplay(SQL1))
+        elif (sqlType == "PREPARE" or sqlType == "EXECUTE"):
+            if (ctx.connect() == False):
+                errormsg('A CONNECT statement must be issued before issuing SQL statements.')
+                return
+            sqlType, remainder = renderStatement(ctx, SQL1)
+            result = parsePExec(ctx, remainder)
             return(result)    
         elif (sqlType == "CALL"):
-            result = parseCall(_hdbc, remainder, local_ns)
+            result = parseCall(ctx, remainder)
             return(result)
+        elif (sqlType == "EXPORT"):
+            return(parseExport(ctx, SQL1, SQL2))
+        elif (sqlType == "CACHE"):
+            return(parseCache(ctx, remainder))
         else:
             pass        
  
@@ -2120,133 +5723,186 @@ class DB2(Magics):
         if (sql == ""): sql = SQL2
         
         if (sql == ""): return                                   # Nothing to do here
+        
+        if ctx.flag("-fanout"):                                  # Run on several profiles at once
+            return(runFanout(ctx, sql))
+        
+        df = cacheLookup(ctx, sql)                               # A saved result does not need a connection
+        if (df is not None):
+            shown = showFrame(ctx,df)
+            if (shown is False and ctx.flag(["-q","-quiet"]) == False): print("Command completed.")
+            return(shown if isinstance(shown,pandas.DataFrame) else None)
     
-        if (_connected == False):
-            if (db2_doConnect() == False):
-                errormsg('A CONNECT statement must be issued before issuing SQL statements.')
-                return      
+        if (ctx.connect() == False):
+            errormsg('A CONNECT statement must be issued before issuing SQL statements.')
+            return      
         
-        if _settings["maxrows"] == -1:                                 # Set the return result size
+        if ctx.flag("-partitions"):                              # Split the query over several connections
+            return(runPartitions(ctx, sql))
+        
+        if ctx.flag("-materialize"):                             # Keep the result for -refresh
+            return(runMaterialize(ctx, sql))
+        
+        if ctx.settings["maxrows"] == -1:                              # Set the return result size
             pandas.reset_option('display.max_rows')
         else:
-            pandas.options.display.max_rows = _settings["maxrows"]
+            pandas.options.display.max_rows = ctx.settings["maxrows"]
       
-        runSQL = re.sub('.*?--.*$',"",sql,flags=re.M)
-        remainder = runSQL.replace("\n"," ") 
-        if flag(["-d","-delim"]):
-            sqlLines = splitSQL(remainder,"@")
+        if ctx.flag(["-d","-delim"]):
+            sqlLines = splitSQL(sql,"@")                          # Statements are split as they are run
         else:
-            sqlLines = splitSQL(remainder,";")
+            sqlLines = splitSQL(sql,";")
         flag_cell = True
                       
         # For each line figure out if you run it as a command (db2) or select (sql)
 
-        for sqlin in sqlLines:          # Run each command
+        for sqlin in retryStatements(ctx, sqlLines):          # Run each command (again after a reconnect)
             
             sqlin = checkMacro(sqlin)                                 # Update based on any macros
 
-            sqlType, sql = sqlParser(sqlin,local_ns)                           # Parse the SQL  
+            ctx.chunk = None
+            sqlType, sql = renderStatement(ctx,sqlin)                          # Parse the SQL  
             if (sql.strip() == ""): continue
-            if flag(["-e","-echo"]): debug(sql,False)
+            if ctx.flag(["-e","-echo"]): debug(sql,False)
                 
-            if flag("-t"):
-                cnt = sqlTimer(_hdbc, _settings["runtime"], sql)            # Given the sql and parameters, clock the time
-                if (cnt >= 0): print("Total iterations in %s second(s): %s" % (_settings["runtime"],cnt))                
+            if ctx.flag("-t"):
+                cnt = sqlTimer(ctx, ctx.settings["runtime"], sql)           # Given the sql and parameters, clock the time
+                if (cnt >= 0): print("Total iterations in %s second(s): %s" % (ctx.settings["runtime"],cnt))                
                 return(cnt)
  
             else:
         
                 try:                                                  # See if we have an answer set
-                    stmt = ibm_db.prepare(_hdbc,sql)
+                    stmt = ibm_db.prepare(ctx.hdbc,sql)
                     if (ibm_db.num_fields(stmt) == 0):                # No, so we just execute the code
-                        result = ibm_db.execute(stmt)                 # Run it                            
-                        if (result == False):                         # Error executing the code
-                            db2_error(flag(["-q","-quiet"])) 
-                            continue
+                        if (ctx.chunk != None):                       # Large list run in chunks
+                            counts = chunkResults(ctx,sqlin,lambda sql: ibm_db.num_rows(ibm_db.exec_immediate(ctx.hdbc,sql)))
+                            rowcount = sum(counts)
+                        else:
+                            result = ibm_db.execute(stmt)             # Run it                            
+                            if (result == False):                     # Error executing the code
+                                db2_error(ctx.flag(["-q","-quiet"]),ctx=ctx) 
+                                continue
                             
-                        rowcount = ibm_db.num_rows(stmt)    
+                            rowcount = ibm_db.num_rows(stmt)    
+                            trackSession(ctx,sql)
+                        
+                        cacheInvalidate(ctx)                          # Saved results may have changed
                     
-                        if (rowcount == 0 and flag(["-q","-quiet"]) == False):
+                        if (rowcount == 0 and ctx.flag(["-q","-quiet"]) == False):
                             errormsg("No rows found.")     
                             
                         continue                                      # Continue running
                     
-                    elif flag(["-r","-array","-j","-json"]):                     # raw, json, format json
+                    elif ctx.flag("-page"):                          # Lazy paged result
+                        if (ctx.chunk != None):
+                            errormsg("The -page option cannot be used with a list that is run in chunks.")
+                            return
+                        try:
+                            return PagedResult(ctx,sql)
+                        except Exception as err:
+                            db2_error(ctx.flag(["-q","-quiet"]),ctx=ctx)
+                            if (ctx.retry == True): continue  # Run again on the new connection
+                            return
+                    
+                    elif (ctx.flag("-grid") or ctx.settings['display'] == 'GRID') and ctx.chunk == None and \
+                          ctx.flag(["-r","-array","-j","-json"]) == False:
+                        try:                                          # Grid that fetches rows on demand
+                            showGrid(ctx,sql)
+                        except Exception as err:
+                            db2_error(ctx.flag(["-q","-quiet"]),ctx=ctx)
+                            if (ctx.retry == True): continue  # Run again on the new connection
+                        return
+                    
+                    elif ctx.flag(["-r","-array","-j","-json"]):                     # raw, json, format json
                         row_count = 0
                         resultSet = []
+                        options = fetchOptions(ctx,sql)
+                        if (options != None):                 # Prepare again with FETCHSIZE and PREFETCH
+                            stmt = ibm_db.prepare(ctx.hdbc,sql,options)
                         try:
                             result = ibm_db.execute(stmt)             # Run it
                             if (result == False):                         # Error executing the code
-                                db2_error(flag(["-q","-quiet"]))  
+                                db2_error(ctx.flag(["-q","-quiet"]),ctx=ctx)  
+                                if (ctx.retry == True): continue  # Run again on the new connection
                                 return
                                 
-                            if flag("-j"):                          # JSON single output
-                                row_count = 0
-                                json_results = []
-                                while( ibm_db.fetch_row(stmt) ):
-                                    row_count = row_count + 1
-                                    jsonVal = ibm_db.result(stmt,0)
-                                    jsonDict = json.loads(jsonVal)
-                                    json_results.append(jsonDict)
-                                    flag_output = True                                    
+                            if ctx.flag("-j"):                          # JSON single output
+                                if (ctx.chunk != None):               # Large list run in chunks
+                                    results = chunkResults(ctx,sqlin,lambda sql: fetchJSON(ibm_db.exec_immediate(ctx.hdbc,sql)))
+                                    json_results = [value for result in results for value in result]
+                                else:
+                                    json_results = fetchJSON(stmt)
                                 
-                                if (row_count == 0): sqlcode = 100
+                                if (len(json_results) == 0): ctx.sqlcode = 100
                                 return(json_results)
                             
+                            elif (ctx.chunk != None):                 # Large list run in chunks
+                                results = chunkResults(ctx,sqlin,lambda sql: fetchResults(ibm_db.exec_immediate(ctx.hdbc,sql),ctx))
+                                rows = results[0]
+                                skip = 1 if ctx.flag(["-r","-array"]) else 0  # Column names are only needed once for arrays
+                                for result in results[1:]: rows.extend(result[skip:])
+                                return(rows)
+                            
                             else:
-                                return(fetchResults(stmt))
+                                return(fetchResults(stmt,ctx))
                                   
                         except Exception as err:
-                            db2_error(flag(["-q","-quiet"]))
+                            db2_error(ctx.flag(["-q","-quiet"]),ctx=ctx)
+                            if (ctx.retry == True): continue  # Run again on the new connection
                             return
                             
                     else:
                         
                         try:
-                            df = pandas.read_sql(sql,_hdbi)
+                            cached = cacheEnabled(ctx) and ctx.chunk == None
+                            df = cacheGet(ctx,sql) if cached else None
+                            if (df is None):
+                                options = fetchOptions(ctx,sql)           # FETCHSIZE and PREFETCH
+                                if (options == None and exactTypes(ctx)): options = {}
+                                if (options != None):
+                                    read = lambda sql: fetchFrame(ctx,sql,options)
+                                else:
+                                    read = lambda sql: pandas.read_sql(sql,ctx.hdbi)
+                                if (ctx.chunk != None):                   # Large list run in chunks
+                                    frames = chunkResults(ctx,sqlin,read)
+                                    df = pandas.concat(frames,ignore_index=True)
+                                else:
+                                    df = read(sql)
+                                if (cached): cachePut(ctx,sql,df)
           
                         except Exception as err:
-                            db2_error(False)
+                            db2_error(False,ctx=ctx)
+                            if (ctx.retry == True): continue  # Run again on the new connection
                             return
-                    
-                        if (len(df) == 0):
-                            sqlcode = 100
-                            if (flag(["-q","-quiet"]) == False): 
-                                errormsg("No rows found")
-                            continue                    
-                    
+                        
+                        shown = showFrame(ctx,df,stmt)
+                        if (shown is None): return
+                        if (shown is False): continue
                         flag_output = True
-                        if flag("-grid") or _settings['display'] == 'GRID':   # Check to see if we can display the results
-                            if (_environment['qgrid'] == False):
-                                with pandas.option_context('display.max_rows', None, 'display.max_columns', None):  
-                                    print(df.to_string())
-                            else:
-                                try:
-                                    pdisplay(qgrid.show_grid(df))
-                                except:
-                                    errormsg("Grid cannot be used to display data with duplicate column names. Use option -a or %sql OPTION DISPLAY PANDAS instead.")
-                                    return 
-                        else:
-                            if flag(["-a","-all"]) or _settings["maxrows"] == -1 : # All of the rows
-                                pandas.options.display.max_rows = None
-                                pandas.options.display.max_columns = None
-                                return df # print(df.to_string())
-                            else:
-                                pandas.options.display.max_rows = _settings["maxrows"]
-                                pandas.options.display.max_columns = None
-                                return df # pdisplay(df) # print(df.to_string())
+                        if (shown is not True): return(shown)
  
                 except:
-                    db2_error(flag(["-q","-quiet"]))
+                    db2_error(ctx.flag(["-q","-quiet"]),ctx=ctx)
                     continue # return
                 
-        end_time = time.time()
-        sqlelapsed = end_time - start_time
-        if (flag_output == False and flag(["-q","-quiet"]) == False): print("Command completed.")
-            
-# Register the Magic extension in Jupyter    
-ip = get_ipython()          
-ip.register_magics(DB2)
-load_settings()
+        if (flag_output == False and ctx.flag(["-q","-quiet"]) == False): print("Command completed.")
+            
+# Register the Magic extension in Jupyter. %load_ext db2 calls load_ipython_extension and running
+# the file with %run registers the magic directly.
+
+def load_ipython_extension(ip):
+    
+    checkEnvironment(ip)
+    ip.register_magics(DB2)
+    load_settings()
+    startWarmup()
    
-success("Db2 Extensions Loaded.")
\ No newline at end of file
+    success("Db2 Extensions Loaded.")
+    
+if __name__ == "__main__":
+    
+    # %run copies the globals of this file, placeholders included, into the notebook. A placeholder 
+    # finds the module in sys.modules when it was already imported, so nothing is imported here.
+    
+    load_ipython_extension(get_ipython())
@@ -0,0 +1,73 @@
+#
+# Benchmark running macros. The macros of db2-extras.py and a cell that calls a macro on every line
+# are run with the compiled form (compileMacro/runMacro) and with the original interpreter in
+# legacy.py, which split and tokenized the macro text on every call.
+#
+#   python tests/bench_macro.py [calls]
+#
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import db2
+import legacy
+import test_macros
+
+_row = """
+if {argc} < 2
+    exit Syntax: ROW table value
+endif
+var table {^1}
+if {2} = 'null'
+    insert into {table} values (null)
+else
+    insert into {table} values ('{*2}')
+endif
+"""
+
+
+def timed(function, calls):
+
+    start = time.perf_counter()
+    for _ in range(calls):
+        function()
+    return time.perf_counter() - start
+
+
+def main(argv):
+
+    calls = int(argv[1]) if len(argv) > 1 else 2000
+    db2.debug = legacy.debug                                 # exit and echo are not displayed
+
+    macros = test_macros.extras()
+    cases = [
+        ("LIST", macros["LIST"], "LIST TABLES FOR SCHEMA db2inst1"),
+        ("DESCRIBE", macros["DESCRIBE"], "DESCRIBE TABLE employee"),
+        ("ROW", _row, "ROW employee some value here"),
+    ]
+
+    print("%-10s %12s %12s %12s %8s" % ("macro", "compile (ms)", "new (us)", "old (us)", "speedup"))
+    for name, script, line in cases:
+        tokens = db2.parseArgs(line, None)
+        start = time.perf_counter()
+        code = db2.compileMacro(script)
+        compiling = time.perf_counter() - start
+        new = timed(lambda: db2.runMacro(code, line, tokens), calls)
+        old = timed(lambda: legacy.runMacro(script, line, tokens), calls)
+        print("%-10s %12.3f %12.2f %12.2f %7.1fx" % (name, compiling * 1000, new / calls * 1e6, old / calls * 1e6, old / new))
+
+    # A cell that calls a macro on every line, the way checkMacro runs it
+
+    code = db2.compileMacro(_row)
+    lines = ["ROW employee value %d" % i for i in range(calls)]
+    new = timed(lambda: [db2.runMacro(code, line, db2.parseArgs(line, None)) for line in lines], 1)
+    old = timed(lambda: [legacy.runMacro(_row, line, legacy.parseArgs(line, None)) for line in lines], 1)
+    print("%d line cell: new %.4f s, old %.4f s, %.1fx" % (calls, new, old, old / new))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
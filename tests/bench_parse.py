@@ -0,0 +1,88 @@
+#
+# Benchmark the parsers that run on every %sql call with large generated inputs (long IN lists,
+# thousands of INSERT statements, macro lines with many placeholders). Each parser is timed against
+# the original version in legacy.py, along with the peak memory it allocates. The growth column is
+# how much longer the new parser takes on an input eight times larger; about 8 means linear time.
+#
+#   python tests/bench_parse.py [size in KB]
+#
+
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import db2
+import legacy
+
+_vars = {"0": "macro", "1": "employee", "2": "empno", "3": "a", "4": "b", "5": "c", "argc": "5"}
+
+
+def inputs(size):
+
+    # Return {name: (new, old, text)} with every text about size characters long
+
+    def repeat(piece):
+        return piece * max(1, size // len(piece))
+
+    ctx = db2.ExecContext()
+    return {
+        "parseArgs": (lambda text: db2.parseArgs(text, _vars),
+                      lambda text: legacy.parseArgs(text, _vars),
+                      repeat("tok 'a quoted, string' \"it's\" {1}  ")),
+        "splitargs": (db2.splitargs,
+                      legacy.splitargs,
+                      "(" + repeat("100, 'a,b', 'it''s', 1.5, name, ") + "0)"),
+        "subvars":   (lambda text: db2.subvars(text, _vars),
+                      lambda text: legacy.subvars(text, _vars),
+                      repeat("select {2} from {^1} where x in ({*3}) and ")),
+        "setFlags":  (lambda text: db2.setFlags(text, ctx),
+                      legacy.setFlags,
+                      repeat("-q ") + "select * from employee where name in (" + repeat("'a', ") + "'b')"),
+        "splitSQL":  (lambda text: list(db2.splitSQL(text, ";")),
+                      lambda text: legacy.splitSQL(text, ";"),
+                      repeat("insert into t values (1,'a;b',\"c\");\n")),
+    }
+
+
+def measure(function, text, repeat=3):
+
+    # Best elapsed time of a few runs and the peak memory allocated by one run
+
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(text)
+        elapsed = time.perf_counter() - start
+        if (best == None or elapsed < best): best = elapsed
+
+    tracemalloc.start()
+    function(text)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return best, peak
+
+
+def main(argv):
+
+    size = int(argv[1]) * 1024 if len(argv) > 1 else 256 * 1024
+
+    larger = inputs(size * 8)
+
+    print("%-10s %10s %10s %10s %10s %8s %8s" % ("parser", "new (s)", "old (s)", "new peak", "old peak", "speedup",
+                                                 "growth"))
+    for name, (new, old, text) in inputs(size).items():
+        newTime, newPeak = measure(new, text)
+        oldTime, oldPeak = measure(old, text, repeat=1)
+        largeTime, _ = measure(new, larger[name][2])
+        print("%-10s %10.4f %10.4f %9dK %9dK %7.1fx %7.1fx" % (name, newTime, oldTime, newPeak // 1024,
+                                                              oldPeak // 1024, oldTime / max(newTime, 1e-9),
+                                                              largeTime / max(newTime, 1e-9)))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
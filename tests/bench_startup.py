@@ -0,0 +1,86 @@
+#
+# Benchmark the start-up cost of the extension, which every new kernel pays. Each measurement runs in
+# a fresh interpreter: importing db2.py, and importing it and loading the extension the way
+# %load_ext db2 does. The time to import IPython (which db2.py needs before anything else) and pandas
+# is shown as well, since the module used to import pandas and ibm_db as soon as it was loaded.
+#
+#   python tests/bench_startup.py [runs]
+#
+
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_import = """
+import time
+start = time.perf_counter()
+import db2
+print(time.perf_counter() - start)
+"""
+
+_load = """
+import time
+start = time.perf_counter()
+import db2
+class Shell(object):
+    config = {}
+    def register_magics(self, magics): pass
+db2.load_ipython_extension(Shell())
+print(time.perf_counter() - start)
+"""
+
+_ipython = """
+import time
+start = time.perf_counter()
+import IPython.core.magic
+print(time.perf_counter() - start)
+"""
+
+_pandas = """
+import time
+start = time.perf_counter()
+import pandas
+print(time.perf_counter() - start)
+"""
+
+_modules = """
+import sys
+import db2
+print(",".join(name for name in ["pandas", "numpy", "ibm_db", "ibm_db_dbi", "qgrid"] if name in sys.modules))
+"""
+
+
+def run(code, cwd):
+
+    env = dict(os.environ)
+    env["PYTHONPATH"] = _root + os.pathsep + env.get("PYTHONPATH", "")
+    result = subprocess.run([sys.executable, "-c", code], cwd=cwd, env=env, capture_output=True, text=True)
+    if (result.returncode != 0):
+        raise RuntimeError(result.stderr.strip())
+    lines = result.stdout.strip().splitlines()
+    return lines[-1] if len(lines) > 0 else ""
+
+
+def main(argv):
+
+    runs = int(argv[1]) if len(argv) > 1 else 10
+
+    with tempfile.TemporaryDirectory() as cwd:                  # No db2connect.pickle from a real session
+        for name, code in [("import db2", _import), ("%load_ext db2", _load), ("import IPython", _ipython),
+                           ("import pandas", _pandas)]:
+            try:
+                times = [float(run(code, cwd)) for _ in range(runs)]
+            except RuntimeError as err:
+                print("%-14s not available: %s" % (name, str(err).splitlines()[-1]))
+                continue
+            print("%-14s median %7.1f ms   min %7.1f ms" % (name, statistics.median(times) * 1000, min(times) * 1000))
+
+        print("Heavy modules imported by import db2: " + (run(_modules, cwd) or "none"))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
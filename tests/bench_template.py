@@ -0,0 +1,52 @@
+#
+# Benchmark macro variable substitution. A line with many placeholders is substituted by the old
+# subvars in legacy.py, by compiling it once (compileTemplate), and by rendering the cached template
+# again, which is what runMacro does for every line it runs after the first.
+#
+#   python tests/bench_template.py [placeholders]
+#
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import db2
+import legacy
+
+_vars = {"0": "macro", "1": "employee", "2": "empno", "3": "it's", "argc": "3", "name": "dept"}
+
+
+def timed(function, repeat=3):
+
+    # Best elapsed time of a few runs
+
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if (best == None or elapsed < best): best = elapsed
+    return best
+
+
+def main(argv):
+
+    count = int(argv[1]) if len(argv) > 1 else 50000
+    text = "select {2}, {^1}, '{*3}', {name} from t where " * (count // 4)
+
+    compiling = timed(lambda: db2.compileTemplate(text))
+    template = db2.compileTemplate(text)
+    render = timed(lambda: db2.renderTemplate(template, _vars))
+    old = timed(lambda: legacy.subvars(text, _vars), repeat=1)
+
+    print("%d placeholders" % (count // 4 * 4))
+    print("old subvars      %10.4f s" % old)
+    print("compileTemplate  %10.4f s" % compiling)
+    print("renderTemplate   %10.4f s  %7.1fx" % (render, old / max(render, 1e-9)))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+# db2.py is a single module at the top of the repository
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("IPython")
+
+import db2
+
+
+@pytest.fixture
+def ctx():
+    return db2.ExecContext()
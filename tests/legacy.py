@@ -0,0 +1,404 @@
+#
+# The original character-at-a-time parsers from db2.py. They are kept here unchanged (apart from
+# setFlags returning its flags instead of setting a global) so the tests can check that the linear
+# time versions give the same results, and so the benchmarks have something to compare against.
+# runMacro is the interpreter that ran the macro text on every call, before macros were compiled.
+#
+
+messages = []                                   # What echo and exit displayed (debug in db2.py)
+
+def debug(message,error=False):
+    messages.append((message,error))
+
+def parseArgs(argin,_vars):
+
+    quoteChar = ""
+    inQuote = False
+    inArg = True
+    args = []
+    arg = ''
+    
+    for ch in argin.lstrip():
+        if (inQuote == True):
+            if (ch == quoteChar):
+                inQuote = False   
+                arg = arg + ch #z
+            else:
+                arg = arg + ch
+        elif (ch == "\"" or ch == "\'"): # Do we have a quote
+            quoteChar = ch
+            arg = arg + ch #z
+            inQuote = True
+        elif (ch == " "):
+            if (arg != ""):
+                arg = subvars(arg,_vars)
+                args.append(arg)
+            else:
+                args.append("null")
+            arg = ""
+        else:
+            arg = arg + ch
+                
+    if (arg != ""):
+        arg = subvars(arg,_vars)
+        args.append(arg)   
+               
+    return(args)
+
+def runMacro(script,in_sql,tokens):
+    
+    result = ""
+    runIT = True 
+    code = script.split("\n")
+    level = 0
+    runlevel = [True,False,False,False,False,False,False,False,False,False]
+    ifcount = 0
+    _vars = {}
+    
+    for i in range(0,len(tokens)):
+        vstr = str(i)
+        _vars[vstr] = tokens[i]
+        
+    if (len(tokens) == 0):
+        _vars["argc"] = "0"
+    else:
+        _vars["argc"] = str(len(tokens)-1)
+          
+    for line in code:
+        line = line.strip()
+        if (line == "" or line == "\n"): continue
+        if (line[0] == "#"): continue    # A comment line starts with a # in the first position of the line
+        args = parseArgs(line,_vars)     # Get all of the arguments
+        if (args[0] == "if"):
+            ifcount = ifcount + 1
+            if (runlevel[level] == False): # You can't execute this statement
+                continue
+            level = level + 1    
+            if (len(args) < 4):
+                print("Macro: Incorrect number of arguments for the if clause.")
+                return insql
+            arg1 = args[1]
+            arg2 = args[3]
+            if (len(arg2) > 2):
+                ch1 = arg2[0]
+                ch2 = arg2[-1:]
+                if (ch1 in ['"',"'"] and ch1 == ch2):
+                    arg2 = arg2[1:-1].strip()
+               
+            op   = args[2]
+            if (op in ["=","=="]):
+                if (arg1 == arg2):
+                    runlevel[level] = True
+                else:
+                    runlevel[level] = False                
+            elif (op in ["<=","=<"]):
+                if (arg1 <= arg2):
+                    runlevel[level] = True
+                else:
+                    runlevel[level] = False                
+            elif (op in [">=","=>"]):                    
+                if (arg1 >= arg2):
+                    runlevel[level] = True
+                else:
+                    runlevel[level] = False                                       
+            elif (op in ["<>","!="]):                    
+                if (arg1 != arg2):
+                    runlevel[level] = True
+                else:
+                    runlevel[level] = False  
+            elif (op in ["<"]):
+                if (arg1 < arg2):
+                    runlevel[level] = True
+                else:
+                    runlevel[level] = False                
+            elif (op in [">"]):
+                if (arg1 > arg2):
+                    runlevel[level] = True
+                else:
+                    runlevel[level] = False                
+            else:
+                print("Macro: Unknown comparison operator in the if statement:" + op)
+
+                continue
+
+        elif (args[0] in ["exit","echo"] and runlevel[level] == True):
+            msg = ""
+            for msgline in args[1:]:
+                if (msg == ""):
+                    msg = subvars(msgline,_vars)
+                else:
+                    msg = msg + " " + subvars(msgline,_vars)
+            if (msg != ""): 
+                if (args[0] == "echo"):
+                    debug(msg,error=False)
+                else:
+                    debug(msg,error=True)
+            if (args[0] == "exit"): return ''
+       
+        elif (args[0] == "pass" and runlevel[level] == True):
+            pass
+
+        elif (args[0] == "var" and runlevel[level] == True):
+            value = ""
+            for val in args[2:]:
+                if (value == ""):
+                    value = subvars(val,_vars)
+                else:
+                    value = value + " " + subvars(val,_vars)
+            value.strip()
+            _vars[args[1]] = value 
+
+        elif (args[0] == 'else'):
+
+            if (ifcount == level):
+                runlevel[level] = not runlevel[level]
+                
+        elif (args[0] == 'return' and runlevel[level] == True):
+            return(result)
+
+        elif (args[0] == "endif"):
+            ifcount = ifcount - 1
+            if (ifcount < level):
+                level = level - 1
+                if (level < 0):
+                    print("Macro: Unmatched if/endif pairs.")
+                    return ''
+                
+        else:
+            if (runlevel[level] == True):
+                if (result == ""):
+                    result = subvars(line,_vars)
+                else:
+                    result = result + "\n" + subvars(line,_vars)
+                    
+    return(result)
+
+def subvars(script,_vars):
+    
+    if (_vars == None): return script
+    
+    remainder = script
+    result = ""
+    done = False
+    
+    while done == False:
+        bv = remainder.find("{")
+        if (bv == -1):
+            done = True
+            continue
+        ev = remainder.find("}")
+        if (ev == -1):
+            done = True
+            continue
+        result = result + remainder[:bv]
+        vvar = remainder[bv+1:ev]
+        remainder = remainder[ev+1:]
+        
+        upper = False
+        allvars = False
+        if (vvar[0] == "^"):
+            upper = True
+            vvar = vvar[1:]
+        elif (vvar[0] == "*"):
+            vvar = vvar[1:]
+            allvars = True
+        else:
+            pass
+        
+        if (vvar in _vars):
+            if (upper == True):
+                items = _vars[vvar].upper()
+            elif (allvars == True):
+                try:
+                    iVar = int(vvar)
+                except:
+                    return(script)
+                items = ""
+                sVar = str(iVar)
+                while sVar in _vars:
+                    if (items == ""):
+                        items = _vars[sVar]
+                    else:
+                        items = items + " " + _vars[sVar]
+                    iVar = iVar + 1
+                    sVar = str(iVar)
+            else:
+                items = _vars[vvar]
+        else:
+            if (allvars == True):
+                items = ""
+            else:
+                items = "null"                
+                 
+        result = result + items
+                
+    if (remainder != ""):
+        result = result + remainder
+        
+    return(result)
+
+def splitargs(arguments):
+    
+    import types
+    
+    # String the string and remove the ( and ) characters if they at the beginning and end of the string
+    
+    results = []
+    
+    step1 = arguments.strip()
+    if (len(step1) == 0): return(results)       # Not much to do here - no args found
+    
+    if (step1[0] == '('):
+        if (step1[-1:] == ')'):
+            step2 = step1[1:-1]
+            step2 = step2.strip()
+        else:
+            step2 = step1
+    else:
+        step2 = step1
+            
+    # Now we have a string without brackets. Start scanning for commas
+            
+    quoteCH = ""
+    pos = 0
+    arg = ""
+    args = []
+            
+    while pos < len(step2):
+        ch = step2[pos]
+        if (quoteCH == ""):                     # Are we in a quote?
+            if (ch in ('"',"'")):               # Check to see if we are starting a quote
+                quoteCH = ch
+                arg = arg + ch
+                pos += 1
+            elif (ch == ","):                   # Are we at the end of a parameter?
+                arg = arg.strip()
+                args.append(arg)
+                arg = ""
+                inarg = False 
+                pos += 1
+            else:                               # Continue collecting the string
+                arg = arg + ch
+                pos += 1
+        else:
+            if (ch == quoteCH):                 # Are we at the end of a quote?
+                arg = arg + ch                  # Add the quote to the string
+                pos += 1                        # Increment past the quote
+                quoteCH = ""                    # Stop quote checking (maybe!)
+            else:
+                pos += 1
+                arg = arg + ch
+
+    if (quoteCH != ""):                         # So we didn't end our string
+        arg = arg.strip()
+        args.append(arg)
+    elif (arg != ""):                           # Something left over as an argument
+        arg = arg.strip()
+        args.append(arg)
+    else:
+        pass
+    
+    results = []
+    
+    for arg in args:
+        result = []
+        if (len(arg) > 0):
+            if (arg[0] in ('"',"'")):
+                value = arg[1:-1]
+                isString = True
+                isNumber = False
+            else:
+                isString = False 
+                isNumber = False 
+                try:
+                    value = eval(arg)
+                    if (type(value) == int):
+                        isNumber = True
+                    elif (isinstance(value,float) == True):
+                        isNumber = True
+                    else:
+                        value = arg
+                except:
+                    value = arg
+
+        else:
+            value = ""
+            isString = False
+            isNumber = False
+            
+        result = [value,isString,isNumber]
+        results.append(result)
+        
+    return results
+
+def setFlags(inSQL):
+    
+    _flags = [] # Delete all of the current flag settings
+    
+    pos = 0
+    end = len(inSQL)-1
+    inFlag = False
+    ignore = False
+    outSQL = ""
+    flag = ""
+    
+    while (pos <= end):
+        ch = inSQL[pos]
+        if (ignore == True):   
+            outSQL = outSQL + ch
+        else:
+            if (inFlag == True):
+                if (ch != " "):
+                    flag = flag + ch
+                else:
+                    _flags.append(flag)
+                    inFlag = False
+            else:
+                if (ch == "-"):
+                    flag = "-"
+                    inFlag = True
+                elif (ch == ' '):
+                    outSQL = outSQL + ch
+                else:
+                    outSQL = outSQL + ch
+                    ignore = True
+        pos += 1
+        
+    if (inFlag == True):
+        _flags.append(flag)
+        
+    return outSQL, _flags
+
+def splitSQL(inputString, delimiter):
+     
+    pos = 0
+    arg = ""
+    results = []
+    quoteCH = ""
+    
+    inSQL = inputString.strip()
+    if (len(inSQL) == 0): return(results)       # Not much to do here - no args found
+            
+    while pos < len(inSQL):
+        ch = inSQL[pos]
+        pos += 1
+        if (ch in ('"',"'")):                   # Is this a quote characters?
+            arg = arg + ch                      # Keep appending the characters to the current arg
+            if (ch == quoteCH):                 # Is this quote character we are in
+                quoteCH = ""
+            elif (quoteCH == ""):               # Create the quote
+                quoteCH = ch
+            else:
+                None
+        elif (quoteCH != ""):                   # Still in a quote
+            arg = arg + ch
+        elif (ch == delimiter):                 # Is there a delimiter?
+            results.append(arg)
+            arg = ""
+        else:
+            arg = arg + ch
+            
+    if (arg != ""):
+        results.append(arg)
+        
+    return(results)
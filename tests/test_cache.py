@@ -0,0 +1,85 @@
+import time
+
+import pytest
+
+import db2
+
+pandas = pytest.importorskip("pandas")
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch, ctx):
+
+    # An empty cache directory and a quiet context on a known database
+
+    monkeypatch.setitem(db2._settings, "cachedir", str(tmp_path))
+    monkeypatch.setitem(db2._settings, "database", "SAMPLE")
+    monkeypatch.setitem(db2._settings, "cachettl", 3600)
+    monkeypatch.setitem(db2._settings, "cachesize", 1024)
+    monkeypatch.setitem(db2._session, "registers", {})
+    monkeypatch.setattr(db2, "_cacheIndex", None)
+    ctx.flags = {"-q"}
+    return ctx
+
+
+def frame(n):
+    return pandas.DataFrame({"ID": list(range(n)), "NAME": ["name %d" % i for i in range(n)]})
+
+
+def test_fingerprint():
+    assert db2.fingerprint("select * from t where id = 1") == db2.fingerprint("SELECT *  FROM t WHERE id = 42")
+    assert db2.fingerprint("select * from t where name = 'a'") == db2.fingerprint("select * from t where name = 'bcd'")
+    assert db2.fingerprint("select * from t where id = 1") != db2.fingerprint("select * from u where id = 1")
+
+
+def test_cacheKey(cache):
+    key = db2.cacheKey(cache, "select * from t")
+    assert db2.cacheKey(cache, "  select * from t ") == key
+    assert db2.cacheKey(cache, "select * from u") != key
+
+    cache.flagValues = {"-decimal": "EXACT"}
+    assert db2.cacheKey(cache, "select * from t") != key
+    cache.flagValues = {}
+
+    db2.trackSession(cache, "SET SCHEMA OTHER")
+    assert db2.cacheKey(cache, "select * from t") != key
+    db2._session["registers"].clear()
+    assert db2.cacheKey(cache, "select * from t") == key
+
+
+def test_round_trip(cache):
+    df = frame(10)
+    db2.cachePut(cache, "select * from t", df)
+    assert db2.cacheGet(cache, "select * from t").equals(df)
+    assert db2.cacheGet(cache, "select * from u") is None
+
+    db2.trackSession(cache, "SET CURRENT SCHEMA OTHER")     # Another schema, another result
+    assert db2.cacheGet(cache, "select * from t") is None
+
+
+def test_ttl(cache):
+    db2.cachePut(cache, "select * from t", frame(10))
+    key = db2.cacheKey(cache, "select * from t")
+    db2.cacheIndex()[key]["created"] = time.time() - 7200
+    assert db2.cacheGet(cache, "select * from t") is None
+    assert key not in db2.cacheIndex()
+
+
+def test_lru(cache):
+    db2.cachePut(cache, "select 1", frame(1000))
+    size = db2.cacheIndex()[db2.cacheKey(cache, "select 1")]["bytes"]
+    db2._settings["cachesize"] = size * 2.5 / (1024 * 1024)   # Room for two results
+
+    db2.cachePut(cache, "select 2", frame(1000))
+    db2.cacheGet(cache, "select 1")                          # select 2 is now the least recently used
+    db2.cachePut(cache, "select 3", frame(1000))
+
+    assert db2.cacheGet(cache, "select 1") is not None
+    assert db2.cacheGet(cache, "select 2") is None
+    assert db2.cacheGet(cache, "select 3") is not None
+
+
+def test_invalidate(cache):
+    db2.cachePut(cache, "select * from t", frame(10))
+    db2.cacheInvalidate(cache)
+    assert db2.cacheGet(cache, "select * from t") is None
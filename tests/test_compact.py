@@ -0,0 +1,74 @@
+import pytest
+
+import db2
+
+pandas = pytest.importorskip("pandas")
+
+
+@pytest.fixture
+def quiet(ctx):
+    ctx.flags = {"-q"}
+    return ctx
+
+
+def compact(monkeypatch, ctx, df, info):
+
+    # compactFrame with the column types of a prepared statement
+
+    monkeypatch.setattr(db2, "columnInfo", lambda stmt: info)
+    return db2.compactFrame(ctx, df, "stmt")
+
+
+@pytest.mark.parametrize("values, precision, dtype", [
+    ([1, -32768, 32767], 5, "int16"),
+    ([1, 40000], 5, "int32"),
+    ([1, -40000], 5, "int32"),
+    ([1, 2 ** 31 - 1], 10, "int32"),
+    ([1, 2 ** 31], 10, "int64"),
+    ([1, 2 ** 40], 5, "int64"),
+])
+def test_integer_range(monkeypatch, quiet, values, precision, dtype):
+
+    # A column is never made smaller than its values, even when the precision says it could be
+
+    df = compact(monkeypatch, quiet, pandas.DataFrame({"A": values}), [("A", "int", precision, 0)])
+    assert str(df["A"].dtype) == dtype
+    assert df["A"].tolist() == values
+
+
+@pytest.mark.parametrize("values, precision, dtype", [
+    ([None, 7], 5, "Int16"),
+    ([None, 3000000000], 10, "Int64"),
+    ([None, None], 10, "Int32"),
+])
+def test_integer_nulls(monkeypatch, quiet, values, precision, dtype):
+
+    # read_sql gives float64 for an INTEGER column with nulls
+
+    df = compact(monkeypatch, quiet, pandas.DataFrame({"A": values}, dtype="float64"), [("A", "int", precision, 0)])
+    assert str(df["A"].dtype) == dtype
+    assert [None if pandas.isna(v) else v for v in df["A"]] == values
+
+
+def test_integer_without_statement(quiet):
+    df = pandas.DataFrame({"A": [1, 300], "B": pandas.array([1, None], dtype="Int64"), "C": [2 ** 40, 1]})
+    df = db2.compactFrame(quiet, df)
+    assert [str(t) for t in df.dtypes] == ["int16", "Int8", "int64"]
+    assert df["B"].isna().tolist() == [False, True]
+
+
+def test_strings(monkeypatch, quiet):
+    df = pandas.DataFrame({"CODE": ["AB  ", "CD  ", "AB  ", None], "NAME": ["one", "two", "three", "four"]})
+    df = compact(monkeypatch, quiet, df, [("CODE", "string", 4, 0), ("NAME", "string", 20, 0)])
+    assert str(df["CODE"].dtype) == "category"
+    assert df["CODE"].tolist()[:3] == ["AB", "CD", "AB"] and pandas.isna(df["CODE"].tolist()[3])
+    assert df["NAME"].tolist() == ["one", "two", "three", "four"]
+    assert str(df["NAME"].dtype) != "category"
+
+
+def test_report(ctx, capsys, monkeypatch):
+    shown = []
+    monkeypatch.setattr(db2, "success", shown.append)
+    df = db2.compactFrame(ctx, pandas.DataFrame({"A": list(range(1000))}))
+    assert df.attrs["compact"]["after"] < df.attrs["compact"]["before"]
+    assert shown[0].startswith("Result compacted from ")
@@ -0,0 +1,163 @@
+import threading
+import types
+
+import pytest
+
+import db2
+
+
+def test_statements_shared_by_two_contexts(monkeypatch):
+
+    # Two %sql calls running at once prepare statements on the same connection
+
+    monkeypatch.setattr(db2, "_stmt", [])
+    monkeypatch.setattr(db2, "_stmtID", [])
+    monkeypatch.setattr(db2, "_stmtSQL", [])
+    contexts = [db2.ExecContext(), db2.ExecContext()]
+
+    def prepare(ctx, name):
+        for i in range(2000):
+            ctx.addStatement("%s%d" % (name, i % 500), ("stmt", name, i), "sql %s %d" % (name, i))
+
+    threads = [threading.Thread(target=prepare, args=(ctx, name)) for ctx, name in zip(contexts, "ab")]
+    for t in threads: t.start()
+    for t in threads: t.join()
+
+    assert len(db2._stmt) == len(db2._stmtID) == len(db2._stmtSQL) == 1000
+    for stmt, stmtID, sql in zip(db2._stmt, db2._stmtID, db2._stmtSQL):
+        assert sql == "sql %s %d" % (stmt[1], stmt[2])
+        assert stmtID == "%s%d" % (stmt[1], stmt[2] % 500)
+    assert contexts[1].findStatement("a499") == ("stmt", "a", 1999)
+
+    contexts[0].clearStatements()
+    assert contexts[1].findStatement("a499") == None
+
+
+def test_reconnect_two_contexts(monkeypatch):
+
+    # Both contexts lose the connection; only one new connection is kept and both use it
+
+    made = []
+    closed = []
+    start = threading.Barrier(2)
+
+    def connect(settings, quiet):
+        start.wait()
+        made.append(object())
+        return made[-1], "hdbi"
+
+    monkeypatch.setattr(db2, "db2_connect", connect)
+    monkeypatch.setattr(db2, "ibm_db", types.SimpleNamespace(close=closed.append))
+    monkeypatch.setattr(db2, "success", lambda message: None)
+    monkeypatch.setattr(db2, "_hdbc", "lost")
+    monkeypatch.setattr(db2, "_session", {"autocommit" : True, "registers" : {}, "reconnects" : 0, "lastUsed" : 0})
+    monkeypatch.setattr(db2, "_stmtSQL", [])
+    contexts = [db2.ExecContext(), db2.ExecContext()]
+
+    threads = [threading.Thread(target=db2.db2_reconnect, args=(ctx,)) for ctx in contexts]
+    for t in threads: t.start()
+    for t in threads: t.join()
+
+    assert len(made) == 2
+    assert contexts[0].hdbc is contexts[1].hdbc is db2._hdbc
+    assert db2._hdbc in made
+    assert closed == ["lost", [h for h in made if h is not db2._hdbc][0]]
+    assert db2._session["reconnects"] == 1
+
+
+def test_reconnect_own_connection(monkeypatch):
+
+    # A context on a connection of its own does not replace the shared one
+
+    monkeypatch.setattr(db2, "db2_connect", lambda settings, quiet: ("new", "hdbi"))
+    monkeypatch.setattr(db2, "ibm_db", types.SimpleNamespace(close=lambda hdbc: None))
+    monkeypatch.setattr(db2, "success", lambda message: None)
+    monkeypatch.setattr(db2, "_hdbc", "shared")
+    monkeypatch.setattr(db2, "_session", {"autocommit" : True, "registers" : {}, "reconnects" : 0, "lastUsed" : 0})
+    ctx = db2.ExecContext()
+    ctx.hdbc = "pooled"
+    assert db2.db2_reconnect(ctx)
+    assert ctx.hdbc == "new"
+    assert db2._hdbc == "shared"
+
+
+class Lost(object):
+
+    # Statements fail on the lost connection and run on the one the reconnect makes
+
+    def __init__(self):
+        self.ran = []
+
+    def module(self):
+        def prepare(hdbc, sql, options=None):
+            return (hdbc, sql)
+        def execute(stmt, parms=None):
+            self.ran.append(stmt)
+            return stmt[0] != "lost"
+        return types.SimpleNamespace(prepare=prepare, execute=execute, num_fields=lambda stmt: 0, num_rows=lambda stmt: 1,
+                                     close=lambda hdbc: None, exec_immediate=lambda hdbc, sql: True,
+                                     stmt_errormsg=lambda: "[IBM] SQL30081N A communication error. SQLSTATE=08001 SQLCODE=-30081")
+
+
+@pytest.fixture
+def lost(monkeypatch, tmp_path):
+    database = Lost()
+    shown = []
+    monkeypatch.setattr(db2, "ibm_db", database.module())
+    monkeypatch.setattr(db2, "db2_connect", lambda settings, quiet: ("new", "hdbi"))
+    monkeypatch.setattr(db2, "success", shown.append)
+    monkeypatch.setattr(db2, "cacheInvalidate", lambda ctx: None)
+    monkeypatch.setattr(db2.ExecContext, "connect", lambda self: True)
+    monkeypatch.setattr(db2, "_hdbc", "lost")
+    monkeypatch.setattr(db2, "_session", {"autocommit" : True, "registers" : {}, "reconnects" : 0, "lastUsed" : 0})
+    monkeypatch.setattr(db2, "_stmtSQL", [])
+    script = tmp_path / "script.sql"
+    script.write_text("DELETE FROM T;\nDELETE FROM U;\n")
+    return database, str(script), shown
+
+
+def test_retry_after_reconnect(lost):
+
+    # The statement that found the connection lost is run again once the connection is back
+
+    database, script, shown = lost
+    ctx = db2.ExecContext()
+    ctx.flags = {"-f"}
+    report = db2.runScript(ctx, script)
+    assert database.ran == [("lost", "DELETE FROM T"), ("new", "DELETE FROM T"), ("new", "DELETE FROM U")]
+    assert report["SQLCODE"].tolist() == [0, 0]
+    assert "Running the statement again." in shown
+    assert db2._session["reconnects"] == 1
+
+
+def test_no_retry_in_transaction(lost):
+
+    # With autocommit off the transaction was rolled back, so the statement is not run again
+
+    database, script, shown = lost
+    db2._session["autocommit"] = False
+    ctx = db2.ExecContext()
+    ctx.flags = {"-f", "-q"}
+    report = db2.runScript(ctx, script)
+    assert database.ran == [("lost", "DELETE FROM T")]
+    assert report["SQLCODE"].tolist() == [-30081]
+    assert db2._session["reconnects"] == 1
+
+
+def test_retry_statements(ctx):
+
+    # A statement is given again only once, even when it fails again
+
+    ctx.flags = {"-q"}
+    given = []
+    for sqlin in db2.retryStatements(ctx, ["A", "B"]):
+        given.append(sqlin)
+        ctx.sqlcode = -30081
+        ctx.retry = (sqlin == "A")
+    assert given == ["A", "A", "B"]
+
+
+def test_reconnects_listed(lost, capsys):
+    db2._session["reconnects"] = 3
+    db2.setOptions("OPTION LIST", db2.ExecContext())
+    assert "Times the connection was lost and re-established: 3" in capsys.readouterr().out
@@ -0,0 +1,101 @@
+import decimal
+
+import pytest
+
+import db2
+
+pandas = pytest.importorskip("pandas")
+
+
+def modes(ctx, decimalMode, temporalMode="STRING"):
+    ctx.flagValues = {"-decimal": decimalMode, "-temporal": temporalMode}
+    return ctx
+
+
+@pytest.mark.parametrize("value, scale", [
+    ("11258999068426.23", 2),                             # Just below 2**50 once scaled
+    ("-11258999068426.23", 2),
+    ("1125899906842623", 0),
+    ("0.000001", 6),
+    ("99999999.999999", 6),
+])
+def test_scaled_below(value, scale):
+    scaled, missing = db2.scaledColumn([value, None], scale)
+    assert str(scaled.dtype) == "int64"
+    assert int(scaled[0]) == int(decimal.Decimal(value).scaleb(scale))
+    assert missing.tolist() == [False, True]
+
+
+@pytest.mark.parametrize("value, scale", [
+    ("11258999068426.24", 2),                             # 2**50 once scaled
+    ("1125899906842624", 0),
+    ("-1125899906842624", 0),
+    ("9223372036854775807", 0),
+    ("Infinity", 0),
+])
+def test_scaled_above(value, scale):
+
+    # Values that a double might not hold exactly are left to Decimal
+
+    assert db2.scaledColumn([decimal.Decimal(value), 1], scale) == None
+
+
+def test_scaled_nulls():
+    scaled, missing = db2.scaledColumn([None, None], 2)
+    assert missing.all()
+
+
+@pytest.mark.parametrize("value", [
+    "11258999068426.23",
+    "11258999068426.24",
+    "12345678901234567.89",
+    "-92233720368547758.08",
+])
+def test_frame_scaled_exact(ctx, value):
+
+    # Either side of 2**50 the scaled value is exact, up to the end of int64
+
+    df = db2.frameRows(modes(ctx, "SCALED"), [(value,), (None,)], ["A"], ["decimal"], [2])
+    assert str(df["A"].dtype) == "Int64"
+    assert df["A"][0] == int(decimal.Decimal(value).scaleb(2))
+    assert df["A"].isna().tolist() == [False, True]
+    assert df.attrs["scale"] == {"A": 2}
+
+
+def test_frame_scaled_overflow(ctx):
+
+    # Beyond int64 the values are kept as Python integers rather than left as text
+
+    value = "123456789012345678901.50"
+    df = db2.frameRows(modes(ctx, "SCALED"), [(value,), (None,), ("1.00",)], ["A"], ["decimal"], [2])
+    assert df["A"].tolist() == [12345678901234567890150, None, 100]
+
+
+def test_frame_exact(ctx):
+    df = db2.frameRows(modes(ctx, "EXACT"), [("12345678901234567.25",), (None,)], ["A"], ["decimal"], [2])
+    assert df["A"][0] == decimal.Decimal("12345678901234567.25")
+    assert df["A"].isna().tolist() == [False, True]
+
+
+def test_frame_float(ctx):
+    df = db2.frameRows(modes(ctx, "FLOAT"), [("1.5", 1.0), (None, None)], ["A", "B"], ["decimal", "real"], [1, 0])
+    assert str(df["A"].dtype) == "float64" and str(df["B"].dtype) == "float64"
+    assert df["A"][0] == 1.5 and pandas.isna(df["A"][1])
+
+
+def test_frame_native(ctx):
+    rows = [("2024-01-05", "2024-01-05 10:30:00.123456"), (None, None)]
+    df = db2.frameRows(modes(ctx, "FLOAT", "NATIVE"), rows, ["D", "T"], ["date", "timestamp"], [0, 0])
+    assert str(df["D"].dtype).startswith("datetime64") and str(df["T"].dtype).startswith("datetime64")
+    assert df["T"][0] == pandas.Timestamp("2024-01-05 10:30:00.123456")
+    assert df["D"].isna().tolist() == [False, True]
+
+
+@pytest.mark.parametrize("value", ["11258999068426.23", "11258999068426.24", "123456789012345678901.50"])
+def test_convert_scaled(ctx, value):
+
+    # The row path (used for EXPORT) gives the same integers as the DataFrame path
+
+    converters = db2.columnConverters(modes(ctx, "SCALED"), ["decimal", "int"], [2, 0])
+    rows = db2.convertColumns([(value, "1"), (None, None)], converters)
+    assert rows == [[int(decimal.Decimal(value).scaleb(2)), 1], [None, None]]
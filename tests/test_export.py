@@ -0,0 +1,120 @@
+import csv
+import datetime
+import decimal
+import gzip
+import json
+import types
+
+import pytest
+
+import db2
+
+_columns = ["ID", "AMOUNT", "CREATED", "NAME"]
+_types = ["int", "decimal", "timestamp", "string"]
+_batches = [
+    [(1, decimal.Decimal("12345678901234567.25"), datetime.datetime(2024, 1, 5, 10, 30), "a, \"quoted\" name"),
+     (2, None, None, None)],
+    [(3, decimal.Decimal("-0.10"), datetime.datetime(2024, 2, 1), "x")],
+]
+
+
+def export(ctx, tmp_path, exportType, name, compression=None, options={}):
+    filename = str(tmp_path / name)
+    rows = db2.exportText(ctx, iter(_batches), filename, exportType, _columns, _types, [0, 2, 0, 0], compression, options)
+    assert rows == 3
+    return filename
+
+
+def test_csv(ctx, tmp_path):
+    with open(export(ctx, tmp_path, "csv", "out.csv"), newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == _columns
+    assert rows[1] == ["1", "1.2345678901234568e+16", "2024-01-05 10:30:00", "a, \"quoted\" name"]
+    assert rows[2] == ["2", "", "", ""]
+    assert len(rows) == 4
+
+
+def test_jsonl(ctx, tmp_path):
+    with open(export(ctx, tmp_path, "jsonl", "out.jsonl")) as f:
+        rows = [json.loads(line) for line in f]
+    assert rows[0] == {"ID": 1, "AMOUNT": 1.2345678901234568e+16, "CREATED": "2024-01-05 10:30:00", "NAME": "a, \"quoted\" name"}
+    assert rows[1] == {"ID": 2, "AMOUNT": None, "CREATED": None, "NAME": None}
+    assert len(rows) == 3
+
+
+def test_exact_decimals(ctx, tmp_path):
+
+    # EXACT decimals are written as numbers with every digit, in both formats
+
+    ctx.flagValues = {"-decimal": "EXACT"}
+    with open(export(ctx, tmp_path, "jsonl", "out.jsonl")) as f:
+        lines = f.read().splitlines()
+    assert '"AMOUNT": 12345678901234567.25' in lines[0]
+    assert json.loads(lines[2], parse_float=decimal.Decimal)["AMOUNT"] == decimal.Decimal("-0.10")
+
+    with open(export(ctx, tmp_path, "csv", "out.csv"), newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows[1][1] == "12345678901234567.25"
+
+
+def test_same_values(ctx, tmp_path):
+
+    # Apart from the quoting the two formats hold the same text
+
+    with open(export(ctx, tmp_path, "csv", "out.csv"), newline="") as f:
+        text = list(csv.reader(f))[1:]
+    with open(export(ctx, tmp_path, "jsonl", "out.jsonl")) as f:
+        documents = [json.loads(line) for line in f]
+    for row, document in zip(text, documents):
+        assert row == ["" if document[c] is None else str(document[c]) for c in _columns]
+
+
+def test_gzip(ctx, tmp_path):
+    filename = export(ctx, tmp_path, "csv", "out.csv.gz", "gzip", {"DELIMITER": "|", "HEADER": "OFF"})
+    with gzip.open(filename, "rt") as f:
+        assert f.readline().strip() == "1|1.2345678901234568e+16|2024-01-05 10:30:00|\"a, \"\"quoted\"\" name\""
+
+
+@pytest.fixture
+def exporting(monkeypatch, ctx):
+
+    # parseExport up to the point where the file is written
+
+    written = []
+    errors = []
+    monkeypatch.setattr(db2.ExecContext, "connect", lambda self: True)
+    monkeypatch.setattr(db2, "renderStatement", lambda ctx, sql: ("SELECT", sql))
+    monkeypatch.setattr(db2, "ibm_db", types.SimpleNamespace(prepare=lambda *args: "stmt", execute=lambda stmt: True,
+                                                             free_result=lambda stmt: None))
+    monkeypatch.setattr(db2, "fetchOptions", lambda *args: None)
+    monkeypatch.setattr(db2, "getColumns", lambda stmt: (_columns, _types))
+    monkeypatch.setattr(db2, "getScales", lambda stmt, types: [0, 0, 0, 0])
+    monkeypatch.setattr(db2, "exportText", lambda ctx, batches, filename, *args: written.append((filename, args[-2])))
+    monkeypatch.setattr(db2, "errormsg", errors.append)
+    ctx.flags = {"-q"}
+    return written, errors
+
+
+@pytest.mark.parametrize("statement, filename, compression", [
+    ("EXPORT TO out.csv SELECT * FROM T", "out.csv", None),
+    ("EXPORT TO out.csv.gz SELECT * FROM T", "out.csv.gz", "gzip"),
+    ("EXPORT TO out.csv OPTIONS COMPRESSION=gzip SELECT * FROM T", "out.csv.gz", "gzip"),
+    ("EXPORT TO out.jsonl OPTIONS COMPRESSION=GZIP SELECT * FROM T", "out.jsonl.gz", "gzip"),
+    ("EXPORT TO out.jsonl.gz OPTIONS COMPRESSION=gzip SELECT * FROM T", "out.jsonl.gz", "gzip"),
+])
+def test_compressed_name(exporting, ctx, statement, filename, compression):
+    written, errors = exporting
+    db2.parseExport(ctx, statement)
+    assert errors == []
+    assert written == [(filename, compression)]
+
+
+@pytest.mark.parametrize("statement", [
+    "EXPORT TO out.csv.gz OPTIONS COMPRESSION=none SELECT * FROM T",
+    "EXPORT TO out.csv OPTIONS COMPRESSION=zstd SELECT * FROM T",
+])
+def test_compression_refused(exporting, ctx, statement):
+    written, errors = exporting
+    db2.parseExport(ctx, statement)
+    assert written == []
+    assert "COMPRESSION" in errors[0]
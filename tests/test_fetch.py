@@ -0,0 +1,76 @@
+import types
+
+import pytest
+
+import db2
+
+
+@pytest.fixture
+def driver(monkeypatch, tmp_path, ctx):
+
+    # A stand-in for ibm_db with the statement attributes, and settings that are not saved in the tree
+
+    module = types.SimpleNamespace(SQL_ATTR_BLOCK_FOR_NROWS=2573, SQL_ATTR_ROWCOUNT_PREFETCH=2592,
+                                   SQL_ROWCOUNT_PREFETCH_ON=1)
+    monkeypatch.setattr(db2, "ibm_db", module)
+    monkeypatch.chdir(tmp_path)
+    ctx.settings = dict(db2._settings, fetchsize=0, prefetch=False)
+    return module
+
+
+@pytest.mark.parametrize("sql", [
+    "select * from employee",
+    "  WITH t AS (SELECT 1 FROM sysibm.sysdummy1) SELECT * FROM t",
+    "values 1",
+    "select 'insert', \"NEW TABLE\" from t",
+])
+def test_tunable(sql):
+    assert db2.tunable(sql)
+
+
+@pytest.mark.parametrize("sql", [
+    "select * from final table (insert into t values (1))",
+    "select * from new table (update t set x = 1)",
+    "select * from old table (delete from t)",
+    "values next value for myseq",
+    "select myseq.nextval from sysibm.sysdummy1",
+    "insert into t select * from u",
+    "call proc()",
+])
+def test_not_tunable(sql):
+    assert db2.tunable(sql) == False
+
+
+def test_fetchOptions(driver, ctx):
+    assert db2.fetchOptions(ctx, "select 1") == None
+    assert db2.fetchOptions(ctx, "select 1", 512) == {2573: 512}
+
+    ctx.settings["prefetch"] = True
+    assert db2.fetchOptions(ctx, "select 1", 512) == {2573: 512, 2592: 1}
+
+
+def test_autotune_skips_changes(driver, ctx):
+
+    # The statement is never run, so the fake driver does not need prepare
+
+    ctx.settings["fetchsize"] = "AUTO"
+    assert db2.fetchOptions(ctx, "select * from final table (insert into t values (1))") == None
+
+
+def test_fetchsize_option(driver, ctx):
+    db2.setOptions("FETCHSIZE 4096", ctx)
+    assert ctx.settings["fetchsize"] == 4096
+    db2.setOptions("FETCHSIZE -5", ctx)
+    assert ctx.settings["fetchsize"] == 0
+
+
+def test_fetchsize_unsupported(driver, ctx, monkeypatch):
+
+    # Without SQL_ATTR_BLOCK_FOR_NROWS the option is refused instead of ignored
+
+    monkeypatch.delattr(driver, "SQL_ATTR_BLOCK_FOR_NROWS")
+    db2.setOptions("FETCHSIZE 4096", ctx)
+    assert ctx.settings["fetchsize"] == 0
+    db2.setOptions("FETCHSIZE AUTO", ctx)
+    assert ctx.settings["fetchsize"] == 0
+    assert db2.fetchOptions(ctx, "select 1", 512) == None
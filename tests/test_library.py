@@ -0,0 +1,35 @@
+import os
+
+import pytest
+
+import db2
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+
+    # A MACROPATH directory with one macro and one SQL script, and another working directory
+
+    path = tmp_path / "macros"
+    path.mkdir()
+    (path / "list.macro").write_text("echo listing {1}\n")
+    (path / "select.sql").write_text("echo not a macro\n")
+    work = tmp_path / "work"
+    work.mkdir()
+    monkeypatch.chdir(work)
+    monkeypatch.setitem(db2._settings, "macropath", str(path))
+    yield path, work
+    db2._settings["macropath"] = None
+    db2.indexMacros()                                         # Forget the library
+
+
+def test_only_macro_files(library):
+    assert list(db2.indexMacros()) == ["LIST"]
+    assert db2.findMacro("SELECT") == False
+
+
+def test_cache_next_to_library(library):
+    path, work = library
+    assert db2.findMacro("LIST")
+    assert os.path.exists(path / "db2macros.pickle")
+    assert os.listdir(work) == []
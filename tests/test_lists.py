@@ -0,0 +1,48 @@
+import pytest
+
+import db2
+
+
+def slot(template, varName="ids"):
+    return [i for i, item in enumerate(template) if isinstance(item, str) == False and item[0] == varName][0]
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM EMPLOYEE WHERE ID IN (:ids)",
+    "SELECT * FROM EMPLOYEE WHERE ID IN ( :ids )",
+    "SELECT * FROM EMPLOYEE WHERE DEPT = 'OR' AND ID IN (:ids)",
+    "SELECT * FROM EMPLOYEE WHERE NOT EXISTS (SELECT 1 FROM T) AND ID IN (:ids)",
+    "WITH E AS (SELECT * FROM EMPLOYEE) SELECT * FROM E WHERE ID IN (:ids)",
+])
+def test_chunkable(sql):
+    template = db2.sqlTokenize(sql)
+    assert db2.chunkable(template, slot(template), "ids")
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM EMPLOYEE WHERE ID IN (:ids, 5)",
+    "SELECT * FROM EMPLOYEE WHERE ID IN (5, :ids)",
+    "SELECT * FROM EMPLOYEE WHERE ID IN (:ids) OR X = 1",
+    "SELECT * FROM EMPLOYEE WHERE (ID IN (:ids) OR X = 1)",
+    "SELECT * FROM EMPLOYEE WHERE NOT ID IN (:ids)",
+    "SELECT * FROM EMPLOYEE WHERE NOT (ID IN (:ids))",
+    "SELECT * FROM EMPLOYEE WHERE ID NOT IN (:ids)",
+    "SELECT * FROM EMPLOYEE WHERE ID IN (:ids) AND DEPT IN (:depts)",
+    "SELECT COUNT(*) FROM EMPLOYEE WHERE ID IN (:ids)",
+    "SELECT * FROM EMPLOYEE WHERE ID IN (:ids) ORDER BY ID",
+    "DELETE FROM EMPLOYEE WHERE ID IN (:ids)",
+    "SELECT * FROM EMPLOYEE WHERE ID IN (:ids) AND NAME <> :ids",
+])
+def test_not_chunkable(sql):
+    template = db2.sqlTokenize(sql)
+    assert db2.chunkable(template, slot(template), "ids", {"ids", "depts"}) == False
+
+
+def test_other_variables():
+
+    # A second variable only stops chunking when it holds a list
+
+    template = db2.sqlTokenize("SELECT * FROM EMPLOYEE WHERE ID IN (:ids) AND DEPT = :dept")
+    assert db2.chunkable(template, slot(template), "ids", {"ids"})
+    assert db2.listSlots(template, {"ids": [1, 2], "dept": "A00"}) == {"ids"}
+    assert db2.listSlots(template, {"ids": [1, 2], "dept": ["A00", "B01"]}) == {"ids", "dept"}
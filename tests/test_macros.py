@@ -0,0 +1,152 @@
+import os
+import re
+
+import pytest
+
+import db2
+import legacy
+
+_nested = """
+if {argc} > 0
+    select 'one or more'
+    if {1} = 'a'
+        , 'a'
+        if {2} = 'b'
+            , 'b'
+        else
+            , 'not b'
+        endif
+    else
+        , 'not a'
+        if {2} = 'b'
+            , 'b after not a'
+        endif
+    endif
+else
+    select 'none'
+endif
+from sysibm.sysdummy1
+"""
+
+_flow = """
+# A comment line
+var table {^1}
+var columns {*2}
+if {table} = ''
+    exit No table supplied
+endif
+echo Listing {table}
+select {columns} from {table}
+if {argc} < 3
+    return
+endif
+where {3} is not null
+"""
+
+
+def extras():
+
+    # The macros shipped in db2-extras.py
+
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "db2-extras.py")
+    with open(path) as f:
+        text = f.read()
+    return {name.upper(): body for name, body in re.findall(r"%%sql define (\w+)\n(.*?)(?=%%sql define|\Z)", text, re.S)}
+
+
+@pytest.fixture
+def messages(monkeypatch):
+    shown = []
+    monkeypatch.setattr(db2, "debug", lambda message, error=False: shown.append((message, error)))
+    del legacy.messages[:]
+    return shown
+
+
+def run(script, line, messages):
+    tokens = db2.parseArgs(line, None)
+    result = db2.runMacro(db2.compileMacro(script), line, tokens)
+    expected = legacy.runMacro(script, line, tokens)
+    assert result == expected
+    assert messages == legacy.messages
+    return result
+
+
+@pytest.mark.parametrize("line", ["m", "m a", "m a b", "m a c", "m x b", "m x y"])
+def test_nested(messages, line):
+    run(_nested, line, messages)
+
+
+@pytest.mark.parametrize("line", ["m", "m employee", "m employee a b", "m employee a b c"])
+def test_flow(messages, line):
+    run(_flow, line, messages)
+
+
+def test_exit(messages):
+    assert run("if {argc} = 0\n  exit missing {0}\nendif\nselect 1", "m", messages) == ""
+    assert messages == [("missing m", True)]
+
+
+def test_var(messages):
+    assert run("var x {1} and {2}\nvalues '{x}'", "m a b", messages) == "values 'a and b'"
+
+
+@pytest.mark.parametrize("line", [
+    "LIST TABLES",
+    "LIST TABLES FOR ALL",
+    "LIST TABLES FOR SCHEMA db2inst1",
+    "LIST TABLES FOR SOMETHING",
+    "LIST VIEWS",
+])
+def test_list(messages, line):
+    run(extras()["LIST"], line, messages)
+
+
+@pytest.mark.parametrize("line", ["DESCRIBE", "DESCRIBE TABLE employee", "DESCRIBE SELECT * FROM employee"])
+def test_describe(messages, line):
+    run(extras()["DESCRIBE"], line, messages)
+
+
+def test_deep_nesting(messages):
+
+    # The old interpreter stopped at 10 levels
+
+    depth = 12
+    script = "if {1} = a\n" * depth + "select 1\n" + "endif\n" * depth
+    assert db2.runMacro(db2.compileMacro(script), "m a", ["m", "a"]) == "select 1"
+    assert db2.runMacro(db2.compileMacro(script), "m b", ["m", "b"]) == ""
+
+
+@pytest.mark.parametrize("line, result", [
+    ("m 3 = 3", "equal"),
+    ("m 3 < 5", "less"),
+    ("m 3 <> 5", "different"),
+    ("m 5 > 3", "greater"),
+])
+def test_variable_operator(messages, line, result):
+
+    # The operator can come from an argument, so it is only checked when the macro runs
+
+    script = "if {1} {2} {3}\n  values '{4}'\nendif"
+    assert run(script, line + " " + result, messages) == "values '" + result + "'"
+
+
+def test_unknown_variable_operator(messages, monkeypatch):
+    errors = []
+    monkeypatch.setattr(db2, "errormsg", errors.append)
+    code = db2.compileMacro("if {1} {2} {3}\n  values 1\nendif\nvalues 2")
+    assert db2.runMacro(code, "m 1 ~ 1", ["m", "1", "~", "1"]).strip() == "values 2"
+    assert errors == ["Macro: Unknown comparison operator in the if statement: ~"]
+
+
+@pytest.mark.parametrize("script, message", [
+    ("if {1} = a\nselect 1", "Missing endif"),
+    ("else\nselect 1", "else without a matching if"),
+    ("endif", "Unmatched if/endif"),
+    ("if {1} ~ a\nendif", "Unknown comparison operator"),
+    ("if {1}\nendif", "Incorrect number of arguments"),
+    ("var", "No variable name"),
+    ("if {1} = a\n" * (db2._macroNesting + 1) + "endif\n" * (db2._macroNesting + 1), "nested more than"),
+])
+def test_errors(script, message):
+    with pytest.raises(ValueError, match=message):
+        db2.compileMacro(script)
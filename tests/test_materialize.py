@@ -0,0 +1,100 @@
+import datetime
+
+import pytest
+
+import db2
+
+pandas = pytest.importorskip("pandas")
+
+
+@pytest.fixture
+def refresh(tmp_path, monkeypatch, ctx):
+
+    #
+    # Run -refresh against a kept result without a database: every fetch returns the rows that are
+    # registered for it and the SQL and parameters are recorded
+    #
+
+    fetched = []
+    answer = {}
+
+    def fetch(ctx, sql, params=()):
+        fetched.append((sql, params))
+        return answer["new"]
+
+    monkeypatch.setattr(db2, "_materializePath", str(tmp_path))
+    monkeypatch.setattr(db2, "_materialized", {})
+    monkeypatch.setattr(db2, "materializeFetch", fetch)
+    monkeypatch.setattr(db2.ExecContext, "connect", lambda self: True)
+
+    def run(frame, new, watermark, lookback=None, modes=("FLOAT", "STRING")):
+        db2._materialized["SALES"] = {"name": "SALES", "sql": "select * from sales", "column": "TS", "lookback": lookback,
+                                      "profile": None, "watermark": watermark, "modes": modes,
+                                      "refreshed": 0, "frame": frame}
+        answer["new"] = new
+        ctx.flags = {"-refresh", "-q"}
+        ctx.flagValues = {"-refresh": "sales"}
+        return db2.refreshMaterialized(ctx)
+
+    run.fetched = fetched
+    return run
+
+
+def test_watermark(refresh):
+    kept = pandas.DataFrame({"ID": [1, 2], "TS": [10, 20]})
+    df = refresh(kept, pandas.DataFrame({"ID": [3], "TS": [30]}), 20)
+    assert list(df["ID"]) == [1, 2, 3]
+    assert refresh.fetched[0][0].endswith('WHERE "TS" > ?')
+    assert refresh.fetched[0][1] == (20,)
+    assert db2._materialized["SALES"]["watermark"] == 30
+
+
+def test_lookback_numeric(refresh):
+    kept = pandas.DataFrame({"ID": [1, 2, 3], "TS": [10, 20, None]})
+    df = refresh(kept, pandas.DataFrame({"ID": [2, 4], "TS": [21, 30]}), 20, lookback="5")
+    assert refresh.fetched[0][1] == (15,)
+    assert sorted(df["ID"]) == [1, 2, 3, 4]                    # Row 2 was replaced, the null row is kept
+    assert list(df[df["ID"] == 2]["TS"]) == [21]
+
+
+def test_lookback_strings(refresh):
+
+    # TEMPORAL STRING keeps the text Db2 returned, with fractional seconds the bound does not have
+
+    kept = pandas.DataFrame({"ID": [1, 2, 3], "TS": ["2024-01-01 10:00:00.000000", "2024-01-05 09:00:00.000000",
+                                                      "2024-01-05 11:00:00.000000"]})
+    new = pandas.DataFrame({"ID": [3, 4], "TS": ["2024-01-05 11:00:00.000000", "2024-01-06 08:00:00.000000"]})
+    df = refresh(kept, new, "2024-01-06 10:00:00.000000", lookback="1")
+    assert sorted(df["ID"]) == [1, 2, 3, 4]
+    assert len(df) == 4
+
+
+def test_lookback_dates(refresh):
+
+    # NATIVE dates against a bound that is a datetime
+
+    kept = pandas.DataFrame({"ID": [1, 2], "TS": [datetime.date(2024, 1, 1), datetime.date(2024, 1, 5)]})
+    new = pandas.DataFrame({"ID": [2, 3], "TS": [datetime.date(2024, 1, 5), datetime.date(2024, 1, 6)]})
+    df = refresh(kept, new, datetime.datetime(2024, 1, 5), lookback="2", modes=("FLOAT", "NATIVE"))
+    assert sorted(df["ID"]) == [1, 2, 3]
+
+
+def test_lookback_timestamps(refresh):
+    kept = pandas.DataFrame({"ID": [1, 2], "TS": pandas.to_datetime(["2024-01-01", "2024-01-05"])})
+    new = pandas.DataFrame({"ID": [2, 3], "TS": pandas.to_datetime(["2024-01-05", "2024-01-07"])})
+    df = refresh(kept, new, datetime.datetime(2024, 1, 5), lookback="1", modes=("FLOAT", "NATIVE"))
+    assert sorted(df["ID"]) == [1, 2, 3]
+    assert db2._materialized["SALES"]["watermark"] == datetime.datetime(2024, 1, 7)
+
+
+def test_refresh_uses_saved_modes(refresh, ctx):
+    kept = pandas.DataFrame({"ID": [1], "TS": [10]})
+    refresh(kept, pandas.DataFrame({"ID": [2], "TS": [20]}), 10, modes=("EXACT", "NATIVE"))
+    assert db2.typeModes(ctx) == ("EXACT", "NATIVE")
+
+
+def test_lookbackValue():
+    assert db2.lookbackValue(20, 5) == 15
+    assert db2.lookbackValue(datetime.date(2024, 1, 5), 2) == datetime.date(2024, 1, 3)
+    assert db2.lookbackValue("2024-01-05", 2) == "2024-01-03"
+    assert db2.lookbackValue("2024-01-05 10:00:00", 1) == "2024-01-04 10:00:00"
@@ -0,0 +1,202 @@
+import types
+
+import pytest
+
+import db2
+
+pandas = pytest.importorskip("pandas")
+
+
+class Cursor(object):
+
+    # A scrollable cursor over a list of rows that counts the work done
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.position = 0
+        self.fetches = 0
+        self.counts = 0
+        self.freed = 0
+
+
+def driver(cursor):
+
+    def fetch_tuple(stmt, row=None):
+        if (stmt == "count"): return (len(cursor.rows),)
+        if (row != None): cursor.position = row - 1
+        if (cursor.position >= len(cursor.rows)): return False
+        cursor.fetches += 1
+        cursor.position += 1
+        return cursor.rows[cursor.position - 1]
+
+    def exec_immediate(hdbc, sql):
+        cursor.counts += 1
+        return "count"
+
+    def free_result(stmt):
+        if (stmt == "cursor"): cursor.freed += 1
+
+    return types.SimpleNamespace(fetch_tuple=fetch_tuple, exec_immediate=exec_immediate, free_result=free_result)
+
+
+def make(ctx):
+
+    # A PagedResult over the cursor, with 1000 rows in pages of 10 and no database
+
+    result = db2.PagedResult.__new__(db2.PagedResult)
+    result.ctx = ctx
+    result.hdbc = None
+    result.sql = "select * from t"
+    result.pagesize = 10
+    result.pages = {}
+    result.rows = None
+    result.stmt = "cursor"
+    result.columns = ["ID", "NAME"]
+    result.types = ["int", "string"]
+    result.scales = [0, 0]
+    return result
+
+
+@pytest.fixture
+def cursor(monkeypatch):
+    cursor = Cursor([(i, "row %d" % i) for i in range(1000)])
+    monkeypatch.setattr(db2, "ibm_db", driver(cursor))
+    return cursor
+
+
+@pytest.fixture
+def paged(cursor, ctx):
+    return make(ctx), cursor
+
+
+def ids(df):
+    return list(df["ID"])
+
+
+def test_window(paged):
+    result, cursor = paged
+    assert ids(result[25:40]) == list(range(25, 40))
+    assert list(result[25:40].index) == list(range(25, 40))
+    assert cursor.counts == 0                                 # Plain slices do not count the rows
+    assert cursor.fetches == 20                               # Pages 2 and 3
+
+
+def test_page_cache(paged):
+    result, cursor = paged
+    result.page(3)
+    result.page(3)
+    result[30:35]
+    assert cursor.fetches == 10
+
+
+def test_page(paged):
+    result, cursor = paged
+    assert ids(result.page(0)) == list(range(10))
+    assert ids(result.page(99)) == list(range(990, 1000))
+    assert len(result.page(100)) == 0
+
+
+def test_past_the_end(paged):
+    result, cursor = paged
+    assert ids(result[995:2000]) == list(range(995, 1000))
+    assert cursor.counts == 0
+    assert len(result) == 1000                                # Found the end while reading
+
+
+def test_negative_and_open(paged):
+    result, cursor = paged
+    assert ids(result[-3:]) == [997, 998, 999]
+    assert cursor.counts == 1
+    assert ids(result[:5]) == list(range(5))
+    assert ids(result[990:-5]) == list(range(990, 995))
+    assert result[-1]["ID"] == 999
+    assert result[0]["ID"] == 0
+    with pytest.raises(IndexError):
+        result[1000]
+
+
+def test_step(paged):
+    result, cursor = paged
+    assert ids(result[0:50:10]) == [0, 10, 20, 30, 40]
+    assert ids(result[5:0:-2]) == [5, 3, 1]
+    assert ids(result[::-250]) == [999, 749, 499, 249]
+
+
+def test_close(paged):
+    result, cursor = paged
+    with result as r:
+        r.page(0)
+    assert cursor.freed == 1
+    result.close()
+    del result
+    assert cursor.freed == 1
+
+
+def test_del(cursor, ctx):
+    result = make(ctx)
+    result.page(0)
+    del result
+    assert cursor.freed == 1
+
+
+@pytest.mark.parametrize("where", [
+    "ID > 10",
+    "NAME LIKE 'a;b%' AND (ID < 5 OR ID IS NULL)",
+    "NAME = 'it''s -- fine'",
+    '"Order Date" >= \'2024-01-01\'',
+    "ORDERS > 1 AND SELECTED = 'Y'",
+])
+def test_grid_filter(where):
+    assert db2.gridFilter(where) == None
+
+
+@pytest.mark.parametrize("where, message", [
+    ("1=1; DROP TABLE T", ";"),
+    ("ID > 1 -- rest", ";"),
+    ("ID > 1 /* x */", ";"),
+    ("1=1) AS X, SYSCAT.TABLES AS Y WHERE (1=1", "parentheses"),
+    ("(ID > 1", "parentheses"),
+    ("NAME = 'open", "not closed"),
+    ("1=1 UNION ALL SELECT * FROM SYSCAT.TABLES", "UNION"),
+    ("ID IN (select ID from T)", "SELECT"),
+    ("ID > 1 fetch first 1 rows only", "FETCH"),
+])
+def test_grid_filter_refused(where, message):
+    assert message in db2.gridFilter(where)
+
+
+def test_grid_reopen_refused(cursor, ctx, monkeypatch):
+
+    # A filter that is refused does not open a new cursor and the old one is kept
+
+    source = db2.GridSource.__new__(db2.GridSource)
+    source.result = make(ctx)
+    source.sql, source.sort, source.descending, source.where = "select * from t", None, False, ""
+    monkeypatch.setattr(db2, "PagedResult", lambda *args: pytest.fail("cursor opened"))
+    assert "SELECT" in source.reopen(where="ID IN (SELECT ID FROM U)")
+    assert source.where == "" and cursor.freed == 0
+
+
+def test_grid_without_widgets(cursor, ctx, monkeypatch, capsys):
+
+    # Without ipywidgets the first window is shown with a message that paging is not available
+
+    class Source(object):
+        def __init__(self, ctx, sql):
+            self.result = make(ctx)
+        def window(self, start):
+            return self.result[start:start + 5]
+        def describe(self):
+            return "Rows 1 to 5 of 1000"
+
+    monkeypatch.setattr(db2, "GridSource", Source)
+    monkeypatch.setattr(db2, "widgetsAvailable", lambda: False)
+    monkeypatch.setitem(db2._environment, "jupyter", False)
+    db2.showGrid(ctx, "select * from t")
+    out = capsys.readouterr().out
+    assert "Rows 1 to 5 of 1000" in out and "ipywidgets" in out
+    assert cursor.freed == 1
+
+    ctx.flags = {"-q"}
+    db2.showGrid(ctx, "select * from t")
+    assert "ipywidgets" not in capsys.readouterr().out
@@ -0,0 +1,125 @@
+import pytest
+
+import db2
+import legacy
+
+_vars = {"0": "macro", "1": "employee", "2": "o'brien", "argc": "2"}
+
+_args = [
+    "",
+    "word",
+    "   leading blanks",
+    "two  blanks",
+    "trailing blank ",
+    "'a quoted string' next",
+    '"double quoted" next',
+    "'it''s' escaped",
+    '"say ""hi""" escaped',
+    "mixed 'quote \" inside' \"and ' this\"",
+    "'unterminated quote",
+    "echo {1} {^1} {2}",
+    "var name 'value {1}'",
+    "if {argc} = 2",
+]
+
+
+@pytest.mark.parametrize("text", _args)
+def test_parseArgs(text):
+    assert db2.parseArgs(text, _vars) == legacy.parseArgs(text, _vars)
+    assert db2.parseArgs(text, None) == legacy.parseArgs(text, None)
+
+
+@pytest.mark.parametrize("text", [
+    "",
+    "()",
+    "(1, 2, 3)",
+    "1,2,3",
+    "( 'a,b' , \"c,d\" )",
+    "('it''s', 'x')",
+    "(\"say \"\"hi\"\"\", 2)",
+    "(-1, 1.5, 1e3, 0x10)",
+    "(name, 'str', 7)",
+    "(1, 'unterminated",
+    "(1,,2)",
+    "(1, 2",
+])
+def test_splitargs(text):
+    assert db2.splitargs(text) == legacy.splitargs(text)
+
+
+def test_splitargs_no_eval():
+
+    # Only number literals are numbers; the old version ran eval on every argument
+
+    assert db2.splitargs("(1+2, abs)") == [["1+2", False, False], ["abs", False, False]]
+
+
+@pytest.mark.parametrize("text", [
+    "select * from employee",
+    "-q select 1",
+    "  -q   -grid   select 1",
+    "-a -b",
+    "-a -b ",
+    "",
+    "   ",
+    "-q select '-x' from t",
+    "-q values 'a -b'",
+])
+def test_setFlags(ctx, text):
+    sql, flags = legacy.setFlags(text)
+    assert db2.setFlags(text, ctx) == sql
+    assert ctx.flags == set(flags)
+
+
+def test_setFlags_values(ctx):
+    sql = db2.setFlags("-q -conn   prod  select 1", ctx)
+    assert sql.strip() == "select 1"
+    assert ctx.flags == {"-q", "-conn"}
+    assert ctx.flagValues == {"-conn": "prod"}
+
+
+@pytest.mark.parametrize("text", [
+    "select 1; select 2",
+    "select 1;select 2;",
+    "  select 1  ;  ;  select 2  ",
+    "values 'a;b'; values \"c;d\"",
+    "values 'it''s;'; values 2",
+    "values 'unterminated; values 2",
+    "",
+])
+def test_splitSQL(text):
+    old = [sql.strip() for sql in legacy.splitSQL(text, ";") if sql.strip() != ""]
+    assert list(db2.splitSQL(text, ";")) == old
+
+
+def test_splitSQL_delimiter():
+    assert list(db2.splitSQL("select 1 @ values '@' @", "@")) == ["select 1", "values '@'"]
+
+
+def test_splitSQL_comments():
+    text = "select 1 -- a comment; not a statement\n; /* another ; */ select 2;"
+    assert list(db2.splitSQL(text, ";")) == ["select 1", "select 2"]
+
+
+def test_splitSQL_compound():
+    text = "create procedure p() begin declare x int; set x = 1; end; call p();"
+    assert list(db2.splitSQL(text, ";")) == ["create procedure p() begin declare x int; set x = 1; end", "call p()"]
+
+
+def test_splitSQL_lines():
+
+    # A file is read a line at a time and quotes can span lines
+
+    lines = ["select 1;\n", "values 'a\n", "b';\n"]
+    assert list(db2.splitSQL(iter(lines), ";")) == ["select 1", "values 'a\nb'"]
+
+
+@pytest.mark.parametrize("text", [
+    "select {1} from t",
+    "{^1} {2} {3}",
+    "{*0}",
+    "no placeholders",
+    "{argc}{argc}",
+])
+def test_subvars(text):
+    assert db2.subvars(text, _vars) == legacy.subvars(text, _vars)
@@ -0,0 +1,120 @@
+import decimal
+import types
+
+import pytest
+
+import db2
+
+
+@pytest.fixture
+def errors(monkeypatch):
+    shown = []
+    monkeypatch.setattr(db2, "errormsg", shown.append)
+    return shown
+
+
+def partitions(ctx, count, by, bounds=None):
+    ctx.flags = {"-partitions", "-by"}
+    ctx.flagValues = {"-partitions": str(count), "-by": by}
+    if (bounds != None):
+        ctx.flags.add("-bounds")
+        ctx.flagValues["-bounds"] = bounds
+    return ctx
+
+
+class Answer(object):
+
+    # exec_immediate returns the rows for the query and remembers the SQL
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.sql = []
+
+    def module(self):
+        def exec_immediate(hdbc, sql):
+            self.sql.append(sql)
+            return iter(self.rows)
+        return types.SimpleNamespace(exec_immediate=exec_immediate, fetch_tuple=lambda stmt: next(stmt, False))
+
+
+def test_plan_bounds(ctx, errors):
+    plan = db2.partitionPlan(partitions(ctx, 3, "ID", "10,20"), "select * from t")
+    assert plan == [("ID < ? OR ID IS NULL", ("10",)),
+                    ("ID >= ? AND ID < ?", ("10", "20")),
+                    ("ID >= ?", ("20",))]
+    assert errors == []
+
+
+def test_plan_quoted_column(ctx, errors):
+    plan = db2.partitionPlan(partitions(ctx, 2, '"Order Date"', "'2024-01-01'"), "select * from t")
+    assert plan[0] == ('"Order Date" < ? OR "Order Date" IS NULL', ("2024-01-01",))
+
+
+@pytest.mark.parametrize("by", ["ID; DROP TABLE T", "ID)", "A + B", "T.ID", "1ID", '"open'])
+def test_plan_bad_column(ctx, errors, by):
+    assert db2.partitionPlan(partitions(ctx, 2, by, "1"), "select * from t") == None
+    assert "-by" in errors[0]
+
+
+@pytest.mark.parametrize("count", [0, db2._partitionMax + 1, "x"])
+def test_plan_bad_count(ctx, errors, count):
+    assert db2.partitionPlan(partitions(ctx, count, "ID", "1"), "select * from t") == None
+    assert "between" in errors[0]
+
+
+def test_plan_one_partition(ctx, errors):
+    assert db2.partitionPlan(partitions(ctx, 1, "ID"), "select * from t") == [("", ())]
+
+
+def test_bounds_integer(ctx, monkeypatch):
+    answer = Answer([(0, 100)])
+    monkeypatch.setattr(db2, "ibm_db", answer.module())
+    assert db2.partitionBounds(ctx, "select * from t", "ID", 4) == [25, 50, 75]
+    assert answer.sql == ["SELECT MIN(ID), MAX(ID) FROM (select * from t) AS PART"]
+
+
+def test_bounds_narrow(ctx, monkeypatch):
+
+    # Fewer distinct values than partitions gives fewer bounds, never repeated ones
+
+    monkeypatch.setattr(db2, "ibm_db", Answer([(1, 2)]).module())
+    assert db2.partitionBounds(ctx, "select * from t", "ID", 4) == []
+    monkeypatch.setattr(db2, "ibm_db", Answer([(decimal.Decimal("1.0"), decimal.Decimal("2.0"))]).module())
+    assert db2.partitionBounds(ctx, "select * from t", "ID", 2) == [decimal.Decimal("1.5")]
+
+
+def test_bounds_empty(ctx, monkeypatch):
+    monkeypatch.setattr(db2, "ibm_db", Answer([(None, None)]).module())
+    assert db2.partitionBounds(ctx, "select * from t", "ID", 4) == []
+
+
+def test_bounds_quantiles(ctx, monkeypatch):
+
+    # Strings use NTILE; a tile that starts with the same value as the one before is dropped
+
+    answer = Answer([("A",), ("F",), ("F",), ("T",)])
+    monkeypatch.setattr(db2, "ibm_db", answer.module())
+    ctx.flags = {"-quantiles"}
+    assert db2.partitionBounds(ctx, "select * from t", "NAME", 4) == ["F", "T"]
+    assert "NTILE(4) OVER (ORDER BY NAME)" in answer.sql[0]
+
+
+def test_single_statement(ctx, errors, monkeypatch):
+    rendered = []
+    monkeypatch.setattr(db2, "renderStatement", lambda ctx, sql: rendered.append(sql) or ("SELECT", sql))
+    monkeypatch.setattr(db2, "partitionPlan", lambda ctx, sql: None)
+
+    assert db2.runPartitions(ctx, "select * from t;  ") == None
+    assert rendered == ["select * from t"]
+
+    assert db2.runPartitions(ctx, "select * from t; delete from t") == None
+    assert "single query" in errors[0]
+    assert len(rendered) == 1
+
+
+def test_autocommit_warning(ctx, errors, monkeypatch):
+    monkeypatch.setitem(db2._session, "autocommit", False)
+    monkeypatch.setattr(db2, "renderStatement", lambda ctx, sql: ("SELECT", sql))
+    monkeypatch.setattr(db2, "partitionPlan", lambda ctx, sql: None)
+    db2.runPartitions(ctx, "select * from t")
+    assert "AUTOCOMMIT is OFF" in errors[0]
@@ -0,0 +1,164 @@
+import decimal
+import json
+import threading
+import types
+
+import pytest
+
+import db2
+
+
+class Database(object):
+
+    # Statements that do not return rows, run on a connection that remembers them
+
+    def __init__(self):
+        self.sql = []
+        self.executed = []
+
+    def module(self):
+        def prepare(hdbc, sql, options=None):
+            self.sql.append((hdbc, sql))
+            return len(self.sql)
+        def execute(stmt, parms=None):
+            self.executed.append((stmt, parms))
+            return True
+        def exec_immediate(hdbc, sql):
+            self.sql.append((hdbc, sql))
+            return len(self.sql)
+        return types.SimpleNamespace(prepare=prepare, execute=execute, exec_immediate=exec_immediate,
+                                     num_fields=lambda stmt: 0, num_rows=lambda stmt: 1, fetch_tuple=lambda stmt: False,
+                                     free_result=lambda stmt: None, connect=lambda dsn, user, pwd: "replay",
+                                     close=lambda hdbc: None, commit=lambda hdbc: self.sql.append((hdbc, "COMMIT")),
+                                     rollback=lambda hdbc: None, autocommit=lambda hdbc, value: None)
+
+
+@pytest.fixture
+def recording(monkeypatch, tmp_path, ctx):
+
+    # Recording to a file with ctx as the context of the %sql call, like the magic does
+
+    monkeypatch.setattr(db2, "_recording", {"file": None, "name": "", "start": 0, "count": 0})
+    monkeypatch.setattr(db2, "success", lambda message: None)
+    monkeypatch.setattr(db2, "errormsg", lambda message: None)
+    monkeypatch.setattr(db2, "cacheInvalidate", lambda ctx: None)
+    monkeypatch.setattr(db2.ExecContext, "connect", lambda self: True)
+    database = Database()
+    monkeypatch.setattr(db2, "ibm_db", database.module())
+    name = str(tmp_path / "workload.jsonl")
+    db2.parseRecord("RECORD START " + name)
+    previous = db2.setContext(ctx)
+    yield name, database
+    if (db2._recording["file"] != None): db2.recordStop()
+    db2.setContext(previous)
+
+
+def events(name):
+    with open(name) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_format(recording, ctx):
+    name, database = recording
+    db2.renderStatement(ctx, "UPDATE T SET A = 1")
+    db2.recordStart("execute", None, [1, decimal.Decimal("2.50"), None], "7", ctx=ctx)
+    ctx.sqlcode = -204
+    db2.recordStop()
+
+    header, update, execute = events(name)
+    assert header["kind"] == "session"
+    assert update["kind"] == "sql" and update["sql"] == "UPDATE T SET A = 1"
+    assert set(update) == {"kind", "offset", "sql", "stmtid", "parms", "elapsed", "sqlcode"}
+    assert update["sqlcode"] == 0 and update["elapsed"] >= 0
+    assert execute["parms"] == [1, "2.50", None] and execute["stmtid"] == "7"
+    assert execute["sqlcode"] == -204
+    assert execute["offset"] >= update["offset"]
+
+
+def test_script(recording, ctx):
+
+    # Statements of a -f script are recorded like the ones of the main loop
+
+    name, database = recording
+    assert db2.runScriptStatement(ctx, "DELETE FROM T", True) == (True, 1)
+    assert db2.runScriptStatement(ctx, "COMMIT", True)[0]
+    db2.recordStop()
+    assert [(e["kind"], e["sql"]) for e in events(name)[1:]] == [("sql", "DELETE FROM T"), ("commit", "COMMIT")]
+
+
+def test_not_recorded(recording, ctx):
+    name, database = recording
+    db2.renderStatement(ctx, "PREPARE SELECT * FROM T")
+    db2.renderStatement(ctx, "EXPORT TO t.csv SELECT * FROM T")
+    db2.renderStatement(ctx, "   ")
+    db2.recordStop()
+    assert events(name)[1:] == []
+
+
+def test_fanout(recording, monkeypatch, ctx):
+
+    # Every target records its own statement, at the same time as the others
+
+    name, database = recording
+    profiles = {}
+    for target in ("A", "B", "C"):
+        profiles[target] = {"name": target, "connected": True, "settings": db2._settings, "hdbc": target, "hdbi": None,
+                            "stmt": [], "stmtID": [], "stmtSQL": [], "session": {"registers": {}, "autocommit": True}}
+    monkeypatch.setattr(db2, "_profiles", profiles)
+    ctx.flags = {"-fanout", "-q"}
+    ctx.flagValues = {"-fanout": "A,B,C"}
+    db2.runFanout(ctx, "DELETE FROM T; DELETE FROM U")
+    db2.recordStop()
+
+    recorded = events(name)[1:]
+    assert sorted(e["sql"] for e in recorded) == ["DELETE FROM T"] * 3 + ["DELETE FROM U"] * 3
+    assert all(e["elapsed"] >= 0 for e in recorded)
+    assert db2._recording["count"] == 6
+
+
+def test_threads(recording):
+
+    # Contexts on other threads keep their own statement being timed
+
+    name, database = recording
+
+    def run(index):
+        tctx = db2.ExecContext()
+        db2.setContext(tctx)
+        for n in range(20):
+            db2.renderStatement(tctx, "UPDATE T%d SET A = %d" % (index, n))
+        db2.recordEnd(tctx)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(4)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    db2.recordStop()
+
+    recorded = events(name)[1:]
+    assert len(recorded) == 80
+    for i in range(4):
+        assert [e["sql"] for e in recorded if e["sql"].startswith("UPDATE T%d " % i)] == \
+            ["UPDATE T%d SET A = %d" % (i, n) for n in range(20)]
+
+
+def test_round_trip(recording, ctx):
+
+    # A replay runs the recorded statements again, with the same values for EXECUTE
+
+    name, database = recording
+    db2.renderStatement(ctx, "DELETE FROM T")
+    db2.recordStart("prepare", "INSERT INTO T VALUES (?,?)", ctx=ctx)
+    ctx.recorded["stmtid"] = "S1"
+    db2.recordStart("execute", None, [1, decimal.Decimal("0.5")], "S1", ctx=ctx)
+    db2.recordStart("commit", "COMMIT", ctx=ctx)
+    db2.recordStop()
+
+    loaded = db2.loadRecording(name)
+    assert [e["kind"] for e in loaded] == ["sql", "prepare", "execute", "commit"]
+
+    del database.sql[:]
+    results = []
+    db2.replaySession(loaded, db2._settings, 1000.0, db2.time.time(), results)
+    assert results[0]["errors"] == 0 and len(results[0]["latencies"]) == 4
+    assert [sql for hdbc, sql in database.sql] == ["DELETE FROM T", "INSERT INTO T VALUES (?,?)", "COMMIT"]
+    assert database.executed == [(2, (1, "0.5"))]
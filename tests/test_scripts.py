@@ -0,0 +1,34 @@
+import pytest
+
+import db2
+
+
+@pytest.fixture
+def connects(monkeypatch):
+
+    # Record the connections that are made instead of going to a database
+
+    made = []
+    monkeypatch.setattr(db2, "_profiles", {})
+    monkeypatch.setattr(db2, "_connected", True)
+    monkeypatch.setattr(db2, "db2_doConnect", lambda quiet=False: made.append("default") or True)
+    monkeypatch.setattr(db2, "profileConnect", lambda profile, quiet=False: made.append(profile["name"]) or False)
+    return made
+
+
+def test_connect_as(connects, ctx):
+
+    # A script that connects a profile gets the result of that connection, not the default one
+
+    assert db2.runScriptStatement(ctx, "CONNECT AS PROD TO proddb", True) == (False, 0)
+    assert connects == ["PROD"]
+
+
+def test_connect(connects, ctx):
+    assert db2.runScriptStatement(ctx, "CONNECT TO sample", True) == (True, 0)
+    assert connects == ["default"]
+
+
+def test_connect_error(connects, ctx):
+    assert db2.runScriptStatement(ctx, "CONNECT AS", True) == (False, 0)
+    assert connects == []
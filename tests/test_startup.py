@@ -0,0 +1,50 @@
+import runpy
+import sys
+import types
+
+import pytest
+
+import db2
+import bench_startup
+
+
+class Shell(object):
+    config = {}
+    user_ns = {}
+
+    def register_magics(self, magics):
+        self.magics = magics
+
+
+def test_lazy_import(tmp_path):
+
+    # Importing the module must not import pandas, ibm_db or qgrid
+
+    assert bench_startup.run(bench_startup._modules, str(tmp_path)) == ""
+
+
+def test_load_extension(tmp_path):
+    float(bench_startup.run(bench_startup._load, str(tmp_path)))
+
+
+def test_run_is_lazy(tmp_path, monkeypatch):
+
+    # %run db2.py copies the placeholders into the notebook and they still work there
+
+    pandas = pytest.importorskip("pandas")
+    monkeypatch.chdir(tmp_path)
+    namespace = runpy.run_path(db2.__file__, init_globals={"get_ipython": Shell}, run_name="__main__")
+    assert isinstance(namespace["pandas"], namespace["LazyModule"])
+    assert namespace["pandas"].DataFrame is pandas.DataFrame
+
+
+def test_placeholder_uses_sys_modules(monkeypatch):
+
+    # A module that is already loaded is used as it is, even one that could not be imported by name
+
+    module = types.SimpleNamespace(value=42)
+    monkeypatch.setitem(sys.modules, "db2_test_module", module)
+    monkeypatch.delitem(db2.__dict__, "db2_test_module", raising=False)
+    assert db2.LazyModule("db2_test_module").value == 42
+    assert db2.db2_test_module is module
+    del db2.db2_test_module
@@ -0,0 +1,87 @@
+import pytest
+
+import db2
+import legacy
+
+_vars = {"0": "macro", "1": "employee", "2": "empno", "3": "lastname", "argc": "3", "name": "dept"}
+
+
+@pytest.mark.parametrize("text", [
+    "select {2} from {1}",
+    "{^1}",
+    "select {*2} from {1}",
+    "{*1}",
+    "{*3}",
+    "{argc} arguments",
+    "{name}",
+    "{^name}",
+    "{1}{2}{3}",
+    "no placeholders",
+    "unclosed {1",
+    "closed only 1}",
+    "{1} and } after",
+    "{9}",
+    "{^9}",
+    "{*9}",
+    "{undefined}",
+])
+def test_render(text):
+
+    # Everything the old subvars got right comes out the same
+
+    expected = legacy.subvars(text, _vars)
+    assert db2.renderTemplate(db2.compileTemplate(text), _vars) == expected
+    assert db2.subvars(text, _vars) == expected
+
+
+def test_compile():
+    assert db2.compileTemplate("select {2} from {^1} where x in ({*3})") == \
+        ("select ", ("", "2", None), " from ", ("^", "1", None), " where x in (", ("*", "3", 3), ")")
+    assert db2.compileTemplate("plain text") == ("plain text",)
+    assert db2.compileTemplate("") == ()
+
+
+def test_empty_braces():
+
+    # {} is left alone (the old version failed with an IndexError)
+
+    assert db2.subvars("values {} {1}", _vars) == "values {} employee"
+    with pytest.raises(IndexError):
+        legacy.subvars("values {} {1}", _vars)
+
+
+def test_stray_brace():
+
+    # A } before the next { is text and does not pair with the {
+
+    assert db2.subvars("a } b {1}", _vars) == "a } b employee"
+    assert db2.subvars("{{1}}", _vars) == "{employee}"
+    assert legacy.subvars("{{1}}", _vars) == "null}"
+
+
+def test_star_name():
+
+    # {*name} is the variable on its own (the old version gave back the whole line unchanged)
+
+    assert db2.subvars("x {*name}", _vars) == "x dept"
+    assert legacy.subvars("x {*name}", _vars) == "x {*name}"
+
+
+def test_out_of_range():
+    assert db2.subvars("{4} {^4} [{*4}]", _vars) == "null null []"
+    assert db2.subvars("{*0}", {"0": "only"}) == "only"
+
+
+def test_no_vars():
+    assert db2.subvars("select {1}", None) == "select {1}"
+
+
+def test_cached():
+    assert db2.getTemplate("select {1} from t") is db2.getTemplate("select {1} from t")
+
+
+def test_many_placeholders():
+    text = "{1} " * 20000
+    assert db2.subvars(text, _vars) == legacy.subvars(text, _vars)
+    values = {str(i): "v" + str(i) for i in range(5000)}
+    assert db2.subvars("{*0}", values) == " ".join("v" + str(i) for i in range(5000))